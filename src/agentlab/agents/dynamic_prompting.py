@@ -1,7 +1,9 @@
 import abc
-import difflib
+import collections
 import logging
+import math
 import platform
+import re
 import time
 from copy import deepcopy, copy
 from dataclasses import asdict, dataclass
@@ -19,6 +21,8 @@ from agentlab.llm.llm_utils import (
     image_to_jpg_base64_url,
     parse_html_tags_raise,
     extract_code_blocks,
+    close_unclosed_html_tags,
+    keep_last_html_tag,
 )
 
 
@@ -57,7 +61,8 @@ class ObsFlags(Flags):
         use_past_error_logs (bool): If use_history is True, expose all previous errors in the history.
         use_action_history (bool): If use_history is True, include the actions in the history.
         use_think_history (bool): If use_history is True, include all previous chains of thoughts in the history.
-        use_diff (bool): Add a diff of the current and previous HTML to the prompt.
+        use_diff (bool): If use_history is True, each history step shows a diff of the HTML and
+            AXTree with the previous step, matching elements by bid.
         html_type (str): Type of HTML to use in the prompt, may depend on preprocessing of observation.
         use_screenshot (bool): Add a screenshot of the page to the prompt, following OpenAI's API. This will be automatically disabled if the model does not have vision capabilities.
         use_som (bool): Add a set of marks to the screenshot.
@@ -65,6 +70,10 @@ class ObsFlags(Flags):
         extract_clickable_tag (bool): Add a "clickable" tag to clickable elements in the AXTree.
         extract_coords (Literal['False', 'center', 'box']): Add the coordinates of the elements.
         filter_visible_elements_only (bool): Only show visible elements in the AXTree.
+        summarize_history (bool): When the prompt needs to be shrunk, first collapse old history steps
+            into compact action/error/memory lines, and into summaries if a summarizer is available.
+        use_relevance_pruning (bool): When the AXTree needs to be shrunk, prune the subtrees least
+            relevant to the goal and recent actions instead of truncating from the bottom.
     """
 
     use_html: bool = True
@@ -89,6 +98,8 @@ class ObsFlags(Flags):
     openai_vision_detail: Literal["low", "high", "auto"] = "auto"
     filter_with_bid_only: bool = False
     filter_som_only: bool = False
+    use_relevance_pruning: bool = False
+    summarize_history: bool = False
 
 
 @dataclass
@@ -209,6 +220,94 @@ class Trunkater(Shrinkable):
         self.shrink_calls += 1
 
 
+def _tokenize(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def bm25_scores(documents: list[str], query: str, k1=1.5, b=0.75) -> list[float]:
+    """Score each document against the query with Okapi BM25.
+
+    Fully local and dependency free, this is meant to rank a few thousand
+    AXTree lines, not to build a search engine.
+    """
+    docs_tokens = [_tokenize(doc) for doc in documents]
+    query_tokens = set(_tokenize(query))
+    if not docs_tokens or not query_tokens:
+        return [0.0] * len(documents)
+
+    n_docs = len(docs_tokens)
+    avg_len = max(1e-6, sum(len(tokens) for tokens in docs_tokens) / n_docs)
+    doc_freq = collections.Counter()
+    for tokens in docs_tokens:
+        doc_freq.update(query_tokens.intersection(tokens))
+    idf = {
+        term: math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+        for term in query_tokens
+    }
+
+    scores = []
+    for tokens in docs_tokens:
+        term_freq = collections.Counter(tokens)
+        norm = k1 * (1 - b + b * len(tokens) / avg_len)
+        score = 0.0
+        for term in query_tokens:
+            tf = term_freq.get(term, 0)
+            if tf:
+                score += idf[term] * tf * (k1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def prune_ax_tree_by_relevance(ax_tree_lines: list[str], scores: list[float], n_keep: int):
+    """Select the lines to keep by removing the least relevant subtrees first.
+
+    The depth of a node is given by its indentation. The relevance of a
+    subtree is the maximum score of its nodes, so that ancestors of relevant
+    nodes are always kept along with them.
+
+    Returns
+    -------
+    list[bool] : whether each line is kept.
+    """
+    depths = [len(line) - len(line.lstrip("\t ")) for line in ax_tree_lines]
+    n_lines = len(ax_tree_lines)
+
+    # end of each subtree and relevance of each subtree, computed bottom up
+    subtree_end = list(range(1, n_lines + 1))
+    subtree_score = list(scores)
+    for i in reversed(range(n_lines)):
+        j = i + 1
+        while j < n_lines and depths[j] > depths[i]:
+            subtree_score[i] = max(subtree_score[i], subtree_score[j])
+            j = subtree_end[j]
+        subtree_end[i] = j
+
+    kept = [True] * n_lines
+    n_kept = n_lines
+    # least relevant first, deepest first among ties, bottom of the page first
+    for i in sorted(range(n_lines), key=lambda i: (subtree_score[i], -depths[i], -i)):
+        if n_kept <= n_keep:
+            break
+        if not kept[i]:
+            continue
+        for j in range(i, subtree_end[i]):
+            if kept[j]:
+                kept[j] = False
+                n_kept -= 1
+    return kept
+
+
+def _prompt_to_str(prompt) -> str:
+    """Extract the text of a prompt, which is either a string or a list of
+    OpenAI content parts."""
+    if isinstance(prompt, str):
+        return prompt
+    elif isinstance(prompt, list):
+        return "\n".join([p["text"] for p in prompt if p["type"] == "text"])
+    else:
+        raise ValueError(f"Unrecognized type for prompt: {type(prompt)}")
+
+
 def fit_tokens(
     shrinkable: Shrinkable,
     max_prompt_tokens=None,
@@ -249,12 +348,7 @@ def fit_tokens(
 
     for _ in range(max_iterations):
         prompt = shrinkable.prompt
-        if isinstance(prompt, str):
-            prompt_str = prompt
-        elif isinstance(prompt, list):
-            prompt_str = "\n".join([p["text"] for p in prompt if p["type"] == "text"])
-        else:
-            raise ValueError(f"Unrecognized type for prompt: {type(prompt)}")
+        prompt_str = _prompt_to_str(prompt)
         n_token = count_tokens(prompt_str, model=model_name)
         if n_token <= max_prompt_tokens:
             return prompt
@@ -270,6 +364,165 @@ def fit_tokens(
     return prompt
 
 
+def allocate_token_budget(sizes: dict, priorities: dict, budget: int) -> dict:
+    """Split a token budget across prompt elements.
+
+    Weighted water-filling: each element is entitled to a share of the budget
+    proportional to its priority. Elements smaller than their share keep their
+    full size and the leftover is redistributed among the others. The result is
+    deterministic for a given input.
+
+    Parameters
+    ----------
+    sizes : dict
+        Current number of tokens of each element.
+    priorities : dict
+        Positive priority of each element.
+    budget : int
+        Total number of tokens available for these elements.
+
+    Returns
+    -------
+    dict : the token quota of each element.
+    """
+    quotas = {}
+    budget = max(0, budget)
+    remaining = [key for key in sizes]
+    while remaining:
+        total_priority = sum(priorities[key] for key in remaining)
+        if total_priority <= 0:
+            for key in remaining:
+                quotas[key] = 0
+            break
+
+        shares = {key: budget * priorities[key] / total_priority for key in remaining}
+        satisfied = [key for key in remaining if sizes[key] <= shares[key]]
+        if not satisfied:
+            for key in remaining:
+                quotas[key] = int(shares[key])
+            break
+
+        for key in satisfied:
+            quotas[key] = sizes[key]
+            budget -= sizes[key]
+        remaining = [key for key in remaining if key not in satisfied]
+
+    return quotas
+
+
+def _shrink_to_quota(element: Shrinkable, quota: int, size: int, max_iterations, model_name):
+    """Shrink an element until it fits its quota.
+
+    The element is only tokenized when a shrink changed its prompt, since
+    some elements only start truncating after a few calls.
+
+    Returns
+    -------
+    (int, bool) : the size of the element and whether it can't shrink further,
+    i.e. a shrink didn't reduce its size or max_iterations were reached.
+    """
+    text = _prompt_to_str(element.prompt)
+    for _ in range(max_iterations):
+        element.shrink()
+        new_text = _prompt_to_str(element.prompt)
+        if new_text == text:
+            continue
+        new_size = count_tokens(new_text, model=model_name)
+        if new_size >= size:
+            return new_size, True
+        text, size = new_text, new_size
+        if size <= quota:
+            return size, False
+    return size, True
+
+
+def fit_tokens_by_budget(
+    shrinkable: Shrinkable,
+    max_prompt_tokens=None,
+    max_iterations=20,
+    model_name="openai/gpt-4",
+    additional_prompts=[""],
+):
+    """Fit a prompt to `max_prompt_tokens` by giving a token quota to each of its
+    shrinkable elements.
+
+    `shrinkable` must implement `budget_elements()`, returning a list of
+    (name, element, priority). The budget left after the non-shrinkable part of
+    the prompt is split with `allocate_token_budget` and each element is
+    shrunk to its own quota, tokenizing only that element. Elements that can't
+    shrink further keep their size and the budget is split again among the
+    others, which also receive the quota left unused by the elements that
+    shrank below theirs.
+
+    The allocation is logged and stored in `shrinkable.token_budget`.
+
+    Parameters are the same as `fit_tokens`.
+
+    Returns
+    -------
+    str : the prompt after shrinking.
+    """
+    if max_prompt_tokens is None or not hasattr(shrinkable, "budget_elements"):
+        return fit_tokens(
+            shrinkable,
+            max_prompt_tokens=max_prompt_tokens,
+            max_iterations=max_iterations,
+            model_name=model_name,
+            additional_prompts=additional_prompts,
+        )
+
+    if isinstance(additional_prompts, str):
+        additional_prompts = [additional_prompts]
+
+    available_tokens = max_prompt_tokens
+    for prompt in additional_prompts:
+        available_tokens -= count_tokens(prompt, model=model_name) + 1
+
+    n_token = count_tokens(_prompt_to_str(shrinkable.prompt), model=model_name)
+    if n_token <= available_tokens:
+        return shrinkable.prompt
+
+    elements = {name: element for name, element, _ in shrinkable.budget_elements()}
+    priorities = {name: priority for name, _, priority in shrinkable.budget_elements()}
+    sizes = {
+        name: count_tokens(_prompt_to_str(element.prompt), model=model_name)
+        for name, element in elements.items()
+    }
+    initial_sizes = dict(sizes)
+    fixed_tokens = n_token - sum(sizes.values())
+
+    stuck = set()
+    # each round either fits all the elements or adds at least one to stuck
+    for _ in range(len(elements) + 1):
+        active = {name: sizes[name] for name in elements if name not in stuck}
+        budget = available_tokens - fixed_tokens - sum(sizes[name] for name in stuck)
+        quotas = allocate_token_budget(active, priorities, budget)
+        over_quota = [name for name in active if sizes[name] > quotas[name]]
+        if not over_quota:
+            break
+        for name in over_quota:
+            sizes[name], is_stuck = _shrink_to_quota(
+                elements[name], quotas[name], sizes[name], max_iterations, model_name
+            )
+            if is_stuck:
+                stuck.add(name)
+    quotas.update({name: sizes[name] for name in stuck})
+
+    shrinkable.token_budget = {
+        "fixed": fixed_tokens,
+        "quotas": quotas,
+        "sizes": initial_sizes,
+        "final_sizes": sizes,
+    }
+    logging.info(f"Token budget allocation (available={available_tokens}): {shrinkable.token_budget}")
+    if fixed_tokens + sum(sizes.values()) > available_tokens:
+        logging.info(
+            f"The shrinkable elements can't fit the budget, the prompt is still about "
+            f"{fixed_tokens + sum(sizes.values())} tokens (greater than {available_tokens})."
+        )
+    return shrinkable.prompt
+
+
 class HTML(Trunkater):
     def __init__(self, html, visible_elements_only: bool, visible: bool = True, prefix="") -> None:
         super().__init__(visible=visible, start_trunkate_iteration=5)
@@ -292,7 +545,14 @@ class AXTree(Trunkater):
         coord_type=None,
         visible_tag=True,
         prefix="",
+        relevance_query: str = None,
     ) -> None:
+        """AXTree prompt element.
+
+        If `relevance_query` is provided, shrinking removes the subtrees least
+        relevant to the query (see `prune_ax_tree_by_relevance`) instead of
+        truncating the bottom of the tree.
+        """
         super().__init__(visible=visible, start_trunkate_iteration=10)
         bid_info = """\
 Note: [bid] is the unique alpha-numeric identifier at the beginning of lines for each element in the AXTree. Always use bid to refer to elements in your actions.
@@ -326,7 +586,30 @@ present, the element is not visible on the page.
 """
         else:
             vsible_tag_note = ""
-        self._prompt = f"\n{prefix}AXTree:\n{bid_info}{coord_note}{visible_elements_note}{vsible_tag_note}{ax_tree}\n"
+        self._header = f"\n{prefix}AXTree:\n{bid_info}{coord_note}{visible_elements_note}{vsible_tag_note}"
+        self._prompt = f"{self._header}{ax_tree}\n"
+
+        self.relevance_query = relevance_query
+        if relevance_query is not None:
+            self._ax_tree_lines = ax_tree.splitlines()
+            self._scores = None
+            self._n_keep = len(self._ax_tree_lines)
+
+    def shrink(self) -> None:
+        if self.relevance_query is None:
+            return super().shrink()
+
+        if self.is_visible and self.shrink_calls >= self.start_trunkate_iteration:
+            if self._scores is None:
+                self._scores = bm25_scores(self._ax_tree_lines, self.relevance_query)
+            self._n_keep = int(self._n_keep * (1 - self.shrink_speed))
+            kept = prune_ax_tree_by_relevance(self._ax_tree_lines, self._scores, self._n_keep)
+            lines = [line for line, keep in zip(self._ax_tree_lines, kept) if keep]
+            self.deleted_lines = len(self._ax_tree_lines) - len(lines)
+            ax_tree = "\n".join(lines)
+            self._prompt = f"{self._header}{ax_tree}\n... Pruned {self.deleted_lines} lines least relevant to the goal to reduce prompt size.\n"
+
+        self.shrink_calls += 1
 
 
 class Error(PromptElement):
@@ -363,10 +646,16 @@ class Observation(Shrinkable):
     Contains the html, the accessibility tree and the error logs.
     """
 
-    def __init__(self, obs, flags: ObsFlags) -> None:
+    def __init__(self, obs, flags: ObsFlags, recent_actions=()) -> None:
         super().__init__()
         self.flags = flags
         self.obs = obs
+        if flags.use_relevance_pruning:
+            relevance_query = "\n".join(
+                [obs.get("goal", "") or ""] + [a for a in recent_actions if a is not None]
+            )
+        else:
+            relevance_query = None
         self.html = HTML(
             obs[flags.html_type],
             visible_elements_only=flags.filter_visible_elements_only,
@@ -380,6 +669,7 @@ class Observation(Shrinkable):
             coord_type=flags.extract_coords,
             visible_tag=flags.extract_visible_tag,
             prefix="## ",
+            relevance_query=relevance_query,
         )
         self.error = Error(
             obs["last_action_error"],
@@ -587,6 +877,77 @@ elements in the page is through bid which are specified in your observations.
         return ans_dict
 
 
+ANSWER_TAGS = ("think", "plan", "step", "memory", "action_draft", "criticise", "action")
+_ACTION_CALL = re.compile(r"^\s*[A-Za-z_]\w*\(.*\)\s*$")
+
+
+def repair_answer(text_answer: str, keys=ANSWER_TAGS) -> list[str]:
+    """Propose locally repaired versions of a malformed answer.
+
+    Candidates are ordered from the least to the most invasive repair: close
+    unclosed tags, keep only the last <action>, reduce the action to its last
+    code block or to the lines that look like function calls, and finally use
+    the last code block of the answer as the action if there is no action tag.
+    The caller is responsible for validating the candidates.
+    """
+    candidates = []
+
+    def add(candidate):
+        if candidate != text_answer and candidate not in candidates:
+            candidates.append(candidate)
+
+    text = close_unclosed_html_tags(text_answer, keys)
+    add(text)
+    text = keep_last_html_tag(text, "action")
+    add(text)
+
+    match = re.search(r"<action>(.*?)</action>", text, re.DOTALL)
+    if match:
+        content = match.group(1)
+        blocks = extract_code_blocks(content)
+        if blocks:
+            cleaned_actions = [blocks[-1][1]]
+        else:
+            calls = [line.strip() for line in content.splitlines() if _ACTION_CALL.match(line)]
+            cleaned_actions = ["\n".join(calls), calls[-1]] if calls else []
+        for action in cleaned_actions:
+            add(f"{text[:match.start(1)]}\n{action}\n{text[match.end(1):]}")
+    else:
+        blocks = extract_code_blocks(text)
+        if blocks:
+            add(f"{text}\n<action>\n{blocks[-1][1]}\n</action>\n")
+
+    return candidates
+
+
+def make_answer_regex(action_set: AbstractActionSet, tags=("think",)) -> str:
+    """Regular expression matching well-formed answers, for constrained
+    decoding with self-hosted models.
+
+    The answer contains the requested tags, in the order of the abstract
+    example, followed by the action. Free text tags can't contain "<". With a
+    HighLevelActionSet, the action is restricted to calls of the functions of
+    the action set, one per line if multiaction is enabled.
+    """
+    tag_order = ("think", "plan", "step", "memory", "action_draft", "criticise")
+    parts = []
+    for tag in tag_order:
+        if tag not in tags:
+            continue
+        content = r"[0-9]+" if tag == "step" else r"\n[^<]*\n"
+        parts.append(f"<{tag}>{content}</{tag}>\n\n")
+
+    if isinstance(action_set, HighLevelActionSet):
+        names = "|".join(re.escape(name) for name in action_set.action_set.keys())
+        call = rf"({names})\([^\n]*\)"
+        action = rf"{call}(\n{call})*" if action_set.multiaction else call
+    else:
+        action = r"[^<]+"
+    parts.append(f"<action>\n{action}\n</action>")
+
+    return "".join(parts)
+
+
 def make_action_set(action_flags: ActionFlags) -> AbstractActionSet:
 
     if action_flags.action_set == "python":
@@ -632,61 +993,103 @@ response from the page.
             return {"think": text_answer, "parse_error": str(e)}
 
 
-# def diff(previous, new):
-#     """Return a string showing the difference between original and new.
+_BID_PATTERNS = (
+    re.compile(r"^\s*\[([^\]\s]+)\]"),  # AXTree lines: "[a12] button 'OK'"
+    re.compile(r'\bbid="([^"]+)"'),  # HTML lines: '<button bid="a12">'
+)
+
+
+def _key_lines(text: str) -> dict:
+    """Map each non-empty line of an AXTree or HTML string to a stable key.
+
+    Lines carrying a bid are keyed by their bid, so that an element keeps the
+    same key even if it moves in the tree. Other lines are keyed by their
+    content and occurrence count.
+    """
+    keyed_lines = {}
+    occurrences = collections.Counter()
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        for pattern in _BID_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                key = ("bid", match.group(1))
+                break
+        else:
+            key = ("text", line, occurrences[line])
+            occurrences[line] += 1
+        keyed_lines.setdefault(key, line)
+    return keyed_lines
+
 
-#     If the difference is above diff_threshold, return the diff string."""
+def diff(previous, new):
+    """Return a header and a list of lines describing the structural
+    difference between two AXTree or HTML strings.
 
-#     if previous == new:
-#         return "Identical", []
+    Elements are matched by bid (see `_key_lines`), which makes the diff linear
+    in the size of the page and robust to elements moving around. Removed lines
+    are prefixed with "-", added lines with "+" and modified elements with "~".
+    """
 
-#     if len(previous) == 0 or previous is None:
-#         return "previous is empty", []
+    if previous == new:
+        return "Identical", []
 
-#     diff_gen = difflib.ndiff(previous.splitlines(), new.splitlines())
+    if previous is None or len(previous) == 0:
+        return "previous is empty", []
 
-#     diff_lines = []
-#     plus_count = 0
-#     minus_count = 0
-#     for line in diff_gen:
-#         if line.strip().startswith("+"):
-#             diff_lines.append(line)
-#             plus_count += 1
-#         elif line.strip().startswith("-"):
-#             diff_lines.append(line)
-#             minus_count += 1
-#         else:
-#             continue
+    previous_lines = _key_lines(previous)
+    new_lines = _key_lines(new)
 
-#     header = f"{plus_count} lines added and {minus_count} lines removed:"
+    removed = [f"- {line}" for key, line in previous_lines.items() if key not in new_lines]
+    added = []
+    changed = []
+    for key, line in new_lines.items():
+        if key not in previous_lines:
+            added.append(f"+ {line}")
+        elif previous_lines[key] != line:
+            changed.append(f"~ {line}")
 
-#     return header, diff_lines
+    header = f"{len(added)} elements added, {len(removed)} removed and {len(changed)} changed:"
 
+    return header, removed + added + changed
 
-# class Diff(Shrinkable):
-#     def __init__(
-#         self, previous, new, prefix="", max_line_diff=20, shrink_speed=2, visible=True
-#     ) -> None:
-#         super().__init__(visible=visible)
-#         self.previous = previous
-#         self.new = new
-#         self.max_line_diff = max_line_diff
-#         self.shrink_speed = shrink_speed
-#         self.prefix = prefix
 
-#     def shrink(self):
-#         self.max_line_diff -= self.shrink_speed
-#         self.max_line_diff = max(1, self.max_line_diff)
+class Diff(Shrinkable):
+    """Structural diff between two consecutive observations.
 
-#     @property
-#     def _prompt(self) -> str:
-#         header, diff_lines = diff(self.previous, self.new)
+    Shrinking reduces the number of diff lines shown by `shrink_speed` at each
+    iteration.
+    """
 
-#         diff_str = "\n".join(diff_lines[: self.max_line_diff])
-#         if len(diff_lines) > self.max_line_diff:
-#             original_count = len(diff_lines)
-#             diff_str = f"{diff_str}\nDiff truncated, {original_count - self.max_line_diff} changes now shown."
-#         return f"{self.prefix}{header}\n{diff_str}\n"
+    def __init__(
+        self, previous, new, prefix="", max_line_diff=20, shrink_speed=2, visible=True
+    ) -> None:
+        super().__init__(visible=visible)
+        self.previous = previous
+        self.new = new
+        self.max_line_diff = max_line_diff
+        self.shrink_speed = shrink_speed
+        self.prefix = prefix
+        self._diff = None
+
+    def shrink(self):
+        self.max_line_diff -= self.shrink_speed
+        self.max_line_diff = max(1, self.max_line_diff)
+
+    @property
+    def _prompt(self) -> str:
+        # the diff is computed lazily and only once, shrinking only truncates it
+        if self._diff is None:
+            self._diff = diff(self.previous, self.new)
+        header, diff_lines = self._diff
+
+        diff_str = "\n".join(diff_lines[: self.max_line_diff])
+        if len(diff_lines) > self.max_line_diff:
+            original_count = len(diff_lines)
+            diff_str = f"{diff_str}\nDiff truncated, {original_count - self.max_line_diff} changes not shown."
+        return f"{self.prefix}{header}\n{diff_str}\n"
 
 
 class HistoryStep(Shrinkable):
@@ -694,20 +1097,20 @@ class HistoryStep(Shrinkable):
         self, previous_obs, current_obs, action, memory, thought, flags: ObsFlags, shrink_speed=1
     ) -> None:
         super().__init__()
-        # self.html_diff = Diff(
-        #     previous_obs[flags.html_type],
-        #     current_obs[flags.html_type],
-        #     prefix="\n### HTML diff:\n",
-        #     shrink_speed=shrink_speed,
-        #     visible=lambda: flags.use_html and flags.use_diff,
-        # )
-        # self.ax_tree_diff = Diff(
-        #     previous_obs["axtree_txt"],
-        #     current_obs["axtree_txt"],
-        #     prefix=f"\n### Accessibility tree diff:\n",
-        #     shrink_speed=shrink_speed,
-        #     visible=lambda: flags.use_ax_tree and flags.use_diff,
-        # )
+        self.html_diff = Diff(
+            previous_obs[flags.html_type],
+            current_obs[flags.html_type],
+            prefix="\n### HTML diff:\n",
+            shrink_speed=shrink_speed,
+            visible=lambda: flags.use_html and flags.use_diff,
+        )
+        self.ax_tree_diff = Diff(
+            previous_obs["axtree_txt"],
+            current_obs["axtree_txt"],
+            prefix=f"\n### Accessibility tree diff:\n",
+            shrink_speed=shrink_speed,
+            visible=lambda: flags.use_ax_tree and flags.use_diff,
+        )
         self.error = Error(
             current_obs["last_action_error"],
             visible=(
@@ -721,15 +1124,27 @@ class HistoryStep(Shrinkable):
         self.action = action
         self.memory = memory
         self.thought = thought
+        self.last_action_error = current_obs["last_action_error"]
         self.flags = flags
+        self.collapsed = False
 
     def shrink(self):
         super().shrink()
-        # self.html_diff.shrink()
-        # self.ax_tree_diff.shrink()
+        if self.flags.summarize_history and not self.collapsed:
+            # first shrinking stage: collapse the step into compact lines
+            self.collapsed = True
+            return
+        self.html_diff.shrink()
+        self.ax_tree_diff.shrink()
 
     @property
     def _prompt(self) -> str:
+        if self.collapsed:
+            return self.collapsed_prompt
+        return self.full_prompt
+
+    @property
+    def full_prompt(self) -> str:
         prompt = ""
 
         if self.flags.use_think_history:
@@ -738,26 +1153,66 @@ class HistoryStep(Shrinkable):
         if self.flags.use_action_history:
             prompt += f"\n<action>\n{self.action}\n</action>\n"
 
-        # prompt += f"{self.error.prompt}{self.html_diff.prompt}{self.ax_tree_diff.prompt}"
-        prompt += f"{self.error.prompt}"
+        prompt += f"{self.error.prompt}{self.html_diff.prompt}{self.ax_tree_diff.prompt}"
 
         if self.memory is not None:
             prompt += f"\n<memory>\n{self.memory}\n</memory>\n"
 
         return prompt
 
+    @property
+    def collapsed_prompt(self) -> str:
+        """Compact version of the step, without thoughts and diffs."""
+        lines = [f"action: {' '.join(str(self.action).split())}"]
+        if self.error.is_visible:
+            error = self.last_action_error.strip().splitlines()[0][:200]
+            lines.append(f"error: {error}")
+        if self.memory is not None:
+            lines.append(f"memory: {' '.join(str(self.memory).split())}")
+        return "\n".join(lines) + "\n"
+
 
 class History(Shrinkable):
     def __init__(
-        self, history_obs, actions, memories, thoughts, flags: ObsFlags, shrink_speed=1
+        self,
+        history_obs,
+        actions,
+        memories,
+        thoughts,
+        flags: ObsFlags,
+        shrink_speed=1,
+        summarizer: callable = None,
+        summary_cache: dict = None,
+        summary_chunk_size=5,
     ) -> None:
+        """History of previous steps.
+
+        Parameters
+        ----------
+        summarizer : callable, optional
+            Function mapping the text of consecutive history steps to a short
+            summary. Only used if flags.summarize_history is True, once all
+            steps are collapsed. If it returns None, e.g. because the summary
+            model failed, the steps stay collapsed and are shrunk as usual.
+        summary_cache : dict, optional
+            Summaries already produced, keyed by (first_step, last_step + 1).
+            Pass the same dict across steps of an episode so that each chunk is
+            summarized only once.
+        summary_chunk_size : int, optional
+            Number of steps summarized together.
+        """
         if memories is None:
             memories = [None] * len(actions)
         super().__init__(visible=lambda: flags.use_history)
         assert len(history_obs) == len(actions) + 1
         assert len(history_obs) == len(memories) + 1
 
+        self.flags = flags
         self.shrink_speed = shrink_speed
+        self.summarizer = summarizer
+        self.summary_cache = summary_cache if summary_cache is not None else {}
+        self.summary_chunk_size = summary_chunk_size
+        self.n_summarized = 0
         self.history_steps: list[HistoryStep] = []
 
         for i in range(1, len(history_obs)):
@@ -772,22 +1227,111 @@ class History(Shrinkable):
                 )
             )
 
+    def summarize(self) -> bool:
+        """Apply the next stage of history summarization.
+
+        The oldest half of the full steps are collapsed into compact
+        action/error/memory lines. Once all steps are collapsed, and if a
+        summarizer is provided, chunks of old steps are replaced by a summary.
+        The most recent step is never summarized.
+
+        Returns
+        -------
+        bool : False if there is nothing left to summarize.
+        """
+        if not self.flags.summarize_history:
+            return False
+
+        full_steps = [step for step in self.history_steps if not step.collapsed]
+        if full_steps:
+            for step in full_steps[: math.ceil(len(full_steps) / 2)]:
+                step.collapsed = True
+            return True
+
+        if self.summarizer is None:
+            return False
+
+        chunk_size = self.summary_chunk_size
+        n_summarized = (len(self.history_steps) - 1) // chunk_size * chunk_size
+        previous_n_summarized = self.n_summarized
+        for start in range(self.n_summarized, n_summarized, chunk_size):
+            key = (start, start + chunk_size)
+            if key not in self.summary_cache:
+                steps = self.history_steps[start : start + chunk_size]
+                text = "\n".join(
+                    f"## step {start + i}\n{step.full_prompt}" for i, step in enumerate(steps)
+                )
+                summary = self.summarizer(text)
+                if summary is None:
+                    # the summarizer failed, the remaining steps stay collapsed
+                    self.summarizer = None
+                    break
+                self.summary_cache[key] = summary
+            self.n_summarized = start + chunk_size
+        return self.n_summarized > previous_n_summarized
+
     def shrink(self):
         """Shrink individual steps"""
-        # TODO set the shrink speed of older steps to be higher
         super().shrink()
-        for step in self.history_steps:
+        if self.summarize():
+            return
+        for step in self.history_steps[self.n_summarized :]:
             step.shrink()
 
     @property
     def _prompt(self):
         prompts = ["# History of interaction with the task:\n"]
+        for start in range(0, self.n_summarized, self.summary_chunk_size):
+            end = start + self.summary_chunk_size
+            prompts.append(f"## steps {start} to {end - 1} (summary)")
+            prompts.append(f"{self.summary_cache[(start, end)]}\n")
         for i, step in enumerate(self.history_steps):
+            if i < self.n_summarized:
+                continue
             prompts.append(f"## step {i}")
             prompts.append(step.prompt)
         return "\n".join(prompts) + "\n"
 
 
+class SummarizeHistoryPrompt(PromptElement):
+    def __init__(self, history_text: str, visible: bool = True) -> None:
+        super().__init__(visible=visible)
+        self._prompt = f"""\
+# Instructions
+Summarize the following steps of a web agent interacting with a page. Keep the
+actions that were performed, the errors that occurred and any information that
+may be needed to complete the task. Answer with a few short lines, without any
+tags or preamble.
+
+{history_text}
+"""
+
+
+class RepairAnswerPrompt(PromptElement):
+    def __init__(
+        self, answer: str, retry_message: str, action_prompt: ActionPrompt, visible: bool = True
+    ) -> None:
+        super().__init__(visible=visible)
+        self._prompt = f"""\
+# Instructions
+The answer below was rejected by the program that parses it, with the following
+error:
+
+{retry_message}
+
+Rewrite the answer so that it follows the expected format. Keep its content and
+intent, only fix the formatting. Tags such as <think> and <action> must be
+opened and closed exactly once. The action must only use the action space
+described below. Answer with the rewritten answer only.
+
+{action_prompt.prompt}
+# Expected format:
+{action_prompt.concrete_ex}
+# Answer to fix:
+{answer}
+"""
+
+
 def make_obs_preprocessor(flags: ObsFlags):
     def obs_mapping(obs: dict):
         obs = copy(obs)
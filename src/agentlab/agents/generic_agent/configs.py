@@ -3,6 +3,7 @@ from agentlab.agents import dynamic_prompting as dp
 from .generic_agent import GenericAgentArgs
 from agentlab.llm.llm_configs import CHAT_MODEL_ARGS_DICT
 from agentlab.llm.chat_api import CheatMiniWoBLLMArgs
+from agentlab.experiments import args
 
 
 # GPT-3.5 default config
@@ -109,3 +110,13 @@ AGENT_4o_VISION = GenericAgentArgs(
     chat_model_args=CHAT_MODEL_ARGS_DICT["openai/gpt-4o-2024-05-13"],
     flags=FLAGS_GPT_4o_VISION,
 )
+
+# search space around the GPT-4o config, see successive_halving
+FLAGS_SEARCH_SPACE = FLAGS_GPT_4o.copy()
+FLAGS_SEARCH_SPACE.use_plan = args.Choice([True, False])
+FLAGS_SEARCH_SPACE.use_criticise = args.Choice([True, False])
+FLAGS_SEARCH_SPACE.use_memory = args.Choice([True, False])
+FLAGS_SEARCH_SPACE.use_concrete_example = args.Choice([True, False])
+FLAGS_SEARCH_SPACE.obs.use_html = args.Choice([True, False])
+FLAGS_SEARCH_SPACE.obs.use_think_history = args.Choice([True, False])
+FLAGS_SEARCH_SPACE.action.multi_actions = args.Choice([True, False])
@@ -1,3 +1,5 @@
+import copy
+import logging
 import traceback
 from dataclasses import asdict, dataclass
 from warnings import warn
@@ -10,7 +12,7 @@ from langchain.schema import HumanMessage, SystemMessage
 from browsergym.experiments.agent import Agent
 from agentlab.agents import dynamic_prompting as dp
 from agentlab.agents.utils import openai_monitored_agent
-from agentlab.llm.chat_api import ChatModelArgs
+from agentlab.llm.chat_api import CascadeChatModel, ChatModelArgs
 from agentlab.llm.llm_utils import ParseError, RetryError, retry_and_fit, retry
 from .generic_agent_prompt import GenericPromptFlags, MainPrompt
 
@@ -21,10 +23,16 @@ class GenericAgentArgs(AbstractAgentArgs):
     chat_model_args: ChatModelArgs = None
     flags: GenericPromptFlags = None
     max_retry: int = 4
+    summary_model_args: ChatModelArgs = None
+    repair_model_args: ChatModelArgs = None
 
     def make_agent(self):
         return GenericAgent(
-            chat_model_args=self.chat_model_args, flags=self.flags, max_retry=self.max_retry
+            chat_model_args=self.chat_model_args,
+            flags=self.flags,
+            max_retry=self.max_retry,
+            summary_model_args=self.summary_model_args,
+            repair_model_args=self.repair_model_args,
         )
 
 
@@ -35,17 +43,31 @@ class GenericAgent(Agent):
         chat_model_args: ChatModelArgs,
         flags: GenericPromptFlags,
         max_retry: int = 4,
+        summary_model_args: ChatModelArgs = None,
+        repair_model_args: ChatModelArgs = None,
     ):
 
         self.chat_llm = chat_model_args.make_chat_model()
         self.chat_model_args = chat_model_args
         self.max_retry = max_retry
 
-        self.flags = flags
+        # optional cheap model used to summarize old history steps
+        self.summary_llm = None
+        if summary_model_args is not None:
+            self.summary_llm = summary_model_args.make_chat_model()
+
+        # optional cheap model used to fix the format of malformed answers
+        self.repair_llm = None
+        if repair_model_args is not None:
+            self.repair_llm = repair_model_args.make_chat_model()
+
+        # _check_flag_constancy modifies the flags, which can be shared with other agents
+        self.flags = copy.deepcopy(flags)
         self.action_set = dp.make_action_set(self.flags.action)
-        self._obs_preprocessor = dp.make_obs_preprocessor(flags.obs)
+        self._obs_preprocessor = dp.make_obs_preprocessor(self.flags.obs)
 
         self._check_flag_constancy()
+        self._set_decoding_constraint()
         self.reset(seed=None)
 
     def obs_preprocessor(self, obs: dict) -> dict:
@@ -55,6 +77,9 @@ class GenericAgent(Agent):
     def get_action(self, obs):
 
         self.obs_history.append(obs)
+        if isinstance(self.chat_llm, CascadeChatModel):
+            self.chat_llm.new_step(min_tier=self._cascade_min_tier(obs))
+
         main_prompt = MainPrompt(
             action_set=self.action_set,
             obs_history=self.obs_history,
@@ -64,26 +89,44 @@ class GenericAgent(Agent):
             previous_plan=self.plan,
             step=self.plan_step,
             flags=self.flags,
+            history_summarizer=self._summarize_history if self.summary_llm else None,
+            history_summary_cache=self.history_summaries,
         )
 
         max_prompt_tokens, max_trunk_itr = self._get_maxes()
 
         fit_function = partial(
-            dp.fit_tokens,
+            dp.fit_tokens_by_budget if self.flags.use_token_budget else dp.fit_tokens,
             max_prompt_tokens=max_prompt_tokens,
             model_name=self.chat_model_args.model_name,
             max_iterations=max_trunk_itr,
         )
 
-        def parser(text):
+        def strict_parser(text):
             try:
                 ans_dict = main_prompt._parse_answer(text)
             except ParseError as e:
-                # these parse errors will be caught by the retry function and
-                # the chat_llm will have a chance to recover
                 return None, False, str(e)
             return ans_dict, True, ""
 
+        def parser(text):
+            ans_dict, valid, retry_message = strict_parser(text)
+            if valid:
+                return ans_dict, True, ""
+            # a local repair is much cheaper than resending the whole prompt
+            if self.flags.use_answer_repair:
+                ans_dict = main_prompt.repair_and_parse_answer(text)
+                if ans_dict is not None:
+                    return ans_dict, True, ""
+            # so is asking a small model to fix the format of the answer
+            if self.repair_llm is not None:
+                ans_dict = self._repair_with_llm(main_prompt, text, retry_message, strict_parser)
+                if ans_dict is not None:
+                    return ans_dict, True, ""
+            # these parse errors will be caught by the retry function and
+            # the chat_llm will have a chance to recover
+            return None, False, retry_message
+
         try:
             # TODO, we would need to further shrink the prompt if the retry
             # cause it to be too long
@@ -125,6 +168,10 @@ class GenericAgent(Agent):
         self.actions.append(ans_dict["action"])
         self.memories.append(ans_dict.get("memory", None))
         self.thoughts.append(ans_dict.get("think", None))
+        if isinstance(self.chat_llm, CascadeChatModel):
+            ans_dict["stats"] = dict(self.chat_llm.stats)
+        if hasattr(main_prompt, "token_budget"):
+            ans_dict["token_budget"] = main_prompt.token_budget
         ans_dict["chat_model_args"] = asdict(self.chat_model_args)
         return ans_dict["action"], ans_dict
 
@@ -136,6 +183,68 @@ class GenericAgent(Agent):
         self.thoughts = []
         self.actions = []
         self.obs_history = []
+        self.history_summaries = {}
+
+    def _cascade_min_tier(self, obs) -> int:
+        """Start from the stronger tier if the cheap one seems to be stuck."""
+        args = self.chat_model_args
+        if args.escalate_on_action_error and obs.get("last_action_error"):
+            return 1
+        if (
+            args.escalate_on_repeated_action
+            and len(self.actions) >= 2
+            and self.actions[-1] == self.actions[-2]
+        ):
+            return 1
+        return 0
+
+    def _summarize_history(self, history_text: str) -> str:
+        """Summarize a chunk of history steps with the summary model.
+
+        Returns None if the summary model failed, the history is then shrunk
+        without summaries.
+        """
+        chat_messages = [
+            SystemMessage(content=dp.SystemPrompt().prompt),
+            HumanMessage(content=dp.SummarizeHistoryPrompt(history_text).prompt),
+        ]
+        try:
+            return self.summary_llm.invoke(chat_messages).content.strip()
+        except Exception as e:
+            logging.warning(f"The summary model failed, keeping the history steps: {e}")
+            return None
+
+    def _repair_with_llm(self, main_prompt: MainPrompt, answer, retry_message, parser):
+        """Ask the repair model to fix the format of a malformed answer.
+
+        Only the answer, the parsing error and the action space are sent, not
+        the whole prompt. Returns None if the repaired answer is still invalid
+        or if the repair model failed, in which case the main model retries.
+        """
+        chat_messages = [
+            HumanMessage(
+                content=dp.RepairAnswerPrompt(
+                    answer, retry_message, main_prompt.action_prompt
+                ).prompt
+            )
+        ]
+        try:
+            # don't wait long for a rate limit, the main model can retry instead
+            ans_dict = retry(
+                self.repair_llm,
+                chat_messages,
+                n_retry=1,
+                parser=parser,
+                min_retry_wait_time=1,
+                rate_limit_max_wait_time=10,
+            )
+        except RetryError:
+            return None
+        except Exception as e:
+            logging.warning(f"The repair model failed, retrying with the main model: {e}")
+            return None
+        ans_dict["llm_repaired_answer"] = chat_messages[1].content
+        return ans_dict
 
     def _check_flag_constancy(self):
         flags = self.flags
@@ -156,6 +265,27 @@ does not support vision. Disabling use_screenshot."""
                 flags.obs.use_screenshot = False
         return flags
 
+    def _set_decoding_constraint(self):
+        """Constrain the answers of the chat model to be parseable, if supported."""
+        if not self.flags.use_constrained_decoding:
+            return
+        if not hasattr(self.chat_llm, "regex"):
+            warn(
+                f"use_constrained_decoding is set to True, but {type(self.chat_llm).__name__} "
+                "does not support constrained decoding. Ignoring it."
+            )
+            return
+        tags = []
+        if self.flags.use_thinking:
+            tags.append("think")
+        if self.flags.use_plan:
+            tags += ["plan", "step"]
+        if self.flags.use_memory:
+            tags.append("memory")
+        if self.flags.use_criticise:
+            tags += ["action_draft", "criticise"]
+        self.chat_llm.regex = dp.make_answer_regex(self.action_set, tags=tags)
+
     def _get_maxes(self):
         maxes = (
             self.flags.max_prompt_tokens,
@@ -3,7 +3,7 @@ import logging
 from browsergym.core import action
 from browsergym.core.action.base import AbstractActionSet
 from agentlab.agents import dynamic_prompting as dp
-from agentlab.llm.llm_utils import parse_html_tags_raise
+from agentlab.llm.llm_utils import ParseError, parse_html_tags_raise
 
 
 @dataclass
@@ -24,6 +24,12 @@ class GenericPromptFlags(dp.Flags):
         extra_instructions (Optional[str]): Extra instructions to provide to the agent.
         add_missparsed_messages (bool): When retrying, add the missparsed messages to the prompt.
         use_retry_and_fit (bool): Use the retry_and_fit function that shrinks the prompt at each retry iteration.
+        use_answer_repair (bool): Try to repair a malformed answer locally (unclosed or duplicated tags,
+            stray prose around the action) before asking the LLM to retry.
+        use_constrained_decoding (bool): If the chat model supports it (self-hosted TGI or vLLM), constrain
+            the generation to a regex matching well-formed answers, see dp.make_answer_regex.
+        use_token_budget (bool): Fit the prompt by allocating a token quota to the observation and to each
+            history step, favoring recent steps, instead of shrinking everything uniformly.
     """
 
     obs: dp.ObsFlags
@@ -41,6 +47,9 @@ class GenericPromptFlags(dp.Flags):
     extra_instructions: str | None = None
     add_missparsed_messages: bool = True
     use_retry_and_fit: bool = False
+    use_token_budget: bool = False
+    use_answer_repair: bool = False
+    use_constrained_decoding: bool = False
 
 
 BASIC_FLAGS = GenericPromptFlags(
@@ -125,10 +134,20 @@ class MainPrompt(dp.Shrinkable):
         previous_plan: str,
         step: int,
         flags: GenericPromptFlags,
+        history_summarizer: callable = None,
+        history_summary_cache: dict = None,
     ) -> None:
         super().__init__()
         self.flags = flags
-        self.history = dp.History(obs_history, actions, memories, thoughts, flags.obs)
+        self.history = dp.History(
+            obs_history,
+            actions,
+            memories,
+            thoughts,
+            flags.obs,
+            summarizer=history_summarizer,
+            summary_cache=history_summary_cache,
+        )
         if self.flags.enable_chat:
             self.instructions = dp.ChatInstructions(
                 obs_history[-1]["chat_messages"], extra_instructions=flags.extra_instructions
@@ -142,7 +161,7 @@ class MainPrompt(dp.Shrinkable):
                 obs_history[-1]["goal"], extra_instructions=flags.extra_instructions
             )
 
-        self.obs = dp.Observation(obs_history[-1], self.flags.obs)
+        self.obs = dp.Observation(obs_history[-1], self.flags.obs, recent_actions=actions[-3:])
 
         self.action_prompt = dp.ActionPrompt(action_set, action_flags=flags.action)
 
@@ -203,9 +222,25 @@ Make sure to follow the template with proper tags:
         return self.obs.add_screenshot(prompt)
 
     def shrink(self):
+        if self.history.is_visible and self.history.summarize():
+            # summarize the history before touching the current observation
+            return
         self.history.shrink()
         self.obs.shrink()
 
+    def budget_elements(self, history_decay=0.8):
+        """Shrinkable elements and their priority, used by dp.fit_tokens_by_budget.
+
+        The current observation has the highest priority and the priority of
+        history steps decays with their age.
+        """
+        elements = [("obs", self.obs, 1.0)]
+        n_steps = len(self.history.history_steps)
+        for i, step in enumerate(self.history.history_steps):
+            priority = 0.5 * history_decay ** (n_steps - 1 - i)
+            elements.append((f"history_step_{i}", step, priority))
+        return elements
+
     def _parse_answer(self, text_answer):
         ans_dict = {}
         ans_dict.update(self.think.parse_answer(text_answer))
@@ -215,6 +250,21 @@ Make sure to follow the template with proper tags:
         ans_dict.update(self.action_prompt.parse_answer(text_answer))
         return ans_dict
 
+    def repair_and_parse_answer(self, text_answer):
+        """Parse the first locally repaired version of `text_answer` that is
+        valid, including the validation of the action by the action set.
+
+        Returns None if no repair is valid.
+        """
+        for repaired_answer in dp.repair_answer(text_answer):
+            try:
+                ans_dict = self._parse_answer(repaired_answer)
+            except ParseError:
+                continue
+            ans_dict["repaired_answer"] = repaired_answer
+            return ans_dict
+        return None
+
 
 class Memory(dp.PromptElement):
     _prompt = ""  # provided in the abstract and concrete examples
@@ -77,3 +77,14 @@ ERR_CLASS_MAP = {
     "retry_error": is_retry_error,
     "input_length_error": is_input_length_error,
 }
+
+
+def get_error_class(err_msg: str, stack_trace: str):
+    """Name of the first class of ERR_CLASS_MAP matching the error,
+    "other_error" if none matches and None if there is no error."""
+    if err_msg is None:
+        return None
+    for err_class, check_function in ERR_CLASS_MAP.items():
+        if check_function(err_msg, stack_trace):
+            return err_class
+    return "other_error"
@@ -17,10 +17,11 @@ from agentlab.analyze.error_categorization import (
 )
 from browsergym.experiments.loop import ExpResult, yield_all_exp_results, get_exp_result
 from agentlab.experiments.exp_utils import RESULTS_DIR
+from agentlab.experiments.study_manifest import StudyManifest
+from agentlab.experiments.task_collections import get_task_category_map
 
 from IPython.display import display
 from agentlab.utils.bootstrap import bootstrap_matrix, convert_df_to_array
-from browsergym.workarena import TASK_CATEGORY_MAP
 
 warnings.filterwarnings("ignore", category=pd.errors.PerformanceWarning)
 
@@ -126,6 +127,15 @@ def load_result_df(
             should be excluded from the index.
     """
 
+    if result_df is None and StudyManifest.exists(exp_dir):
+        # the manifest already has the records, no need to open each experiment
+        df = pd.DataFrame(StudyManifest(exp_dir).records())
+        if len(df) == 0:
+            return None
+        if set_index:
+            set_index_from_variables(df, index_white_list, index_black_list)
+        return df
+
     if result_df is not None:
         result_list = list(result_df["exp_result"])
     else:
@@ -745,9 +755,12 @@ def split_by_key(df: pd.DataFrame, key, force_at_leaste_one_variable=True):
     return df_dict
 
 
-def set_task_category_as_index(result_df, task_category_map=TASK_CATEGORY_MAP):
+def set_task_category_as_index(result_df, task_category_map=None):
     """Create task_category index from task_name if needed and re-assign index
-    from variables using task_category."""
+    from variables using task_category. task_category_map defaults to the
+    categories of the WorkArena tasks."""
+    if task_category_map is None:
+        task_category_map = get_task_category_map()
     # rested index task_name (level 0)
     new_df = result_df.reset_index(inplace=False)
     if not "task_category" in new_df.columns:
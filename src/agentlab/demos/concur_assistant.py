@@ -2,6 +2,7 @@ from agentlab.agents.dynamic_prompting import Flags
 from agentlab.agents.generic_agent.generic_agent import GenericAgentArgs
 from browsergym.experiments.loop import ExpArgs
 from agentlab.experiments.exp_utils import RESULTS_DIR
+from agentlab.demos.concur_storage_state import CONCUR_SESSION
 from agentlab.llm.chat_api import ChatModelArgs
 from agentlab.experiments import args
 
@@ -134,7 +135,7 @@ exp_args = ExpArgs(
     headless=False,
     record_video=True,
     wait_for_user_message=True,
-    storage_state=RESULTS_DIR / "concur_state.json",
+    storage_state=CONCUR_SESSION,
     slow_mo=1000,
     viewport={"width": 1500, "height": 1280},
 )
@@ -1,30 +1,25 @@
-from playwright.sync_api import sync_playwright
 from agentlab.experiments.exp_utils import RESULTS_DIR
+from agentlab.experiments.session_pool import SESSION_DIR_NAME, SessionArgs, get_storage_state
 
 
-def manual_login_and_save_state():
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=False)  # Set headless=False to see the browser
-        context = browser.new_context()
-        page = context.new_page()
+def manual_login(page):
+    # Wait for the user to complete the login manually
+    input(
+        "Please log in manually in the opened browser window. Press Enter here once you're done..."
+    )
 
-        # Navigate to the login page
-        page.goto("https://servicenow.okta.com/app/UserHome?session_hint=AUTHENTICATED")
 
-        # Wait for the user to complete the login manually
-        input(
-            "Please log in manually in the opened browser window. Press Enter here once you're done..."
-        )
+# the login is done once and reused by the episodes until it expires
+CONCUR_SESSION = SessionArgs(
+    name="concur",
+    login_url="https://servicenow.okta.com/app/UserHome?session_hint=AUTHENTICATED",
+    login_fn=manual_login,
+    max_age=8 * 3600,
+    headless=False,  # Set headless=False to see the browser
+)
 
-        # Save the state after manual login
-        context.storage_state(path=RESULTS_DIR / "concur_state.json")
 
-        print("Authentication state has been saved to state.json.")
-
-        # Cleanup
-        page.close()
-        context.close()
-        browser.close()
-
-
-manual_login_and_save_state()
+if __name__ == "__main__":
+    # log in ahead of launching the demo in RESULTS_DIR
+    path = get_storage_state(CONCUR_SESSION, RESULTS_DIR / SESSION_DIR_NAME)
+    print(f"Authentication state has been saved to {path}.")
@@ -17,7 +17,7 @@ class CrossProd:
 class Distribution(ABC):
     """Generic Class to identify that this is a distribution"""
 
-    def sample(self):
+    def sample(self, rng=np.random):
         pass
 
 
@@ -48,131 +48,174 @@ def _find_cprod_with_paths(obj, path=None):
         A list of tuples where the first element is the path to the CrossProd
         object and the second element is the CrossProd object.
     """
+    return _find_with_paths(obj, CrossProd, path)
+
+
+def _find_with_paths(obj, cls, path=None):
+    """Find all the objects of type cls and their paths in the given object,
+    searching through dataclasses and dictionaries."""
     if path is None:
         path = []
 
-    if isinstance(obj, CrossProd):
+    if isinstance(obj, cls):
         return [(path, obj)]
 
-    cprod_paths = []
+    found_paths = []
     if is_dataclass(obj):
         for field in fields(obj):
             field_value = getattr(obj, field.name)
-            cprod_paths += _find_cprod_with_paths(field_value, path + [field.name])
+            found_paths += _find_with_paths(field_value, cls, path + [field.name])
     elif isinstance(obj, dict):
         for key, value in obj.items():
-            cprod_paths += _find_cprod_with_paths(value, path + [key])
+            found_paths += _find_with_paths(value, cls, path + [key])
 
-    return cprod_paths
+    return found_paths
+
+
+def _get_value(obj, key):
+    if isinstance(obj, dict):
+        return obj[key]
+    return getattr(obj, key)
 
 
 def _set_value(obj, path, value):
     """Set the value of the given path in the given object to the given value."""
     for key in path[:-1]:
-        if isinstance(obj, dict):
-            obj = obj[key]
-        else:
-            obj = getattr(obj, key)
+        obj = _get_value(obj, key)
     if isinstance(obj, dict):
         obj[path[-1]] = value
     else:
         setattr(obj, path[-1], value)
 
 
-def expand_cross_product(obj: Any | list[Any]):
-    """Expand the given object into a list of objects with all combinations of
-    CrossProd objects.
+def _copy_paths(obj, paths):
+    """Shallow copy obj and the objects along the given paths, so that the
+    values at the end of the paths can be set without modifying obj. All the
+    other sub-objects are shared with obj."""
+    root = copy.copy(obj)
+    copied = {(): root}
+    for path in paths:
+        parent = root
+        for i, key in enumerate(path[:-1]):
+            prefix = tuple(path[: i + 1])
+            if prefix not in copied:
+                copied[prefix] = copy.copy(_get_value(parent, key))
+                _set_value(parent, [key], copied[prefix])
+            parent = copied[prefix]
+    return root
 
-    This function will recursively search for CrossProd objects in the given
-    object and create a list of objects with all combinations of CrossProd. It
-    searches through dataclasses and dictionaries.
+
+def iter_cross_product(obj: Any | list[Any]):
+    """Lazy version of expand_cross_product.
+
+    Only the objects along the paths of the CrossProd objects are copied, the
+    other sub-objects are shared between the yielded objects. Don't modify
+    them in place; launch_exp gives each experiment its own copy when
+    preparing it.
 
     Parameters:
     -----------
     obj : Any | List[Any]
         The object to expand.
 
-    Returns:
-    --------
-    List[Any]
-        A list of objects with all combinations of CrossProd objects.
-
+    Yields:
+    -------
+    Any
+        Objects with all combinations of CrossProd objects.
     """
-
     if isinstance(obj, CrossProd):
-        return obj.elements
+        yield from obj.elements
+        return
 
     if isinstance(obj, list):
         obj_list = obj
     else:
         obj_list = [obj]
 
-    result = []
-
     for obj in obj_list:
         cprod_paths = _find_cprod_with_paths(obj)
         if not cprod_paths:
-            return [copy.deepcopy(obj)]
+            yield copy.deepcopy(obj)
+            continue
 
         paths, cprod_objects = zip(*cprod_paths)
         combinations = product(*[cprod_obj.elements for cprod_obj in cprod_objects])
 
         for combo in combinations:
-            new_obj = copy.deepcopy(obj)
+            new_obj = _copy_paths(obj, paths)
             for path, value in zip(paths, combo):
-                _set_value(new_obj, path, value)
-            result.append(new_obj)
+                # elements are copied, a value chosen for several objects
+                # shouldn't be shared between them
+                _set_value(new_obj, path, copy.deepcopy(value))
+            yield new_obj
 
-    return result
+
+def expand_cross_product(obj: Any | list[Any]):
+    """Expand the given object into a list of objects with all combinations of
+    CrossProd objects.
+
+    This function will recursively search for CrossProd objects in the given
+    object and create a list of objects with all combinations of CrossProd. It
+    searches through dataclasses and dictionaries. See iter_cross_product for
+    a lazy version.
+
+    Parameters:
+    -----------
+    obj : Any | List[Any]
+        The object to expand.
+
+    Returns:
+    --------
+    List[Any]
+        A list of objects with all combinations of CrossProd objects.
+
+    """
+    return list(iter_cross_product(obj))
 
 
 def sample_and_expand_cross_product(obj: Any | list[Any], n_samples: int):
     """This will sample first and then expand the cross product."""
-    return expand_cross_product(sample_args(obj, n_samples))
+    return list(iter_cross_product(list(iter_sample_args(obj, n_samples))))
 
 
-def sample_args(obj: Any | list[Any], n_samples: int):
-    """Sample the given object n_samples times. Each sample is a deep copy of
-    the original object with any object of type Distribution replaced by a
-    sample from that distribution.
+def iter_sample_args(obj: Any | list[Any], n_samples: int, rng=np.random):
+    """Lazy version of sample_args.
 
-    Parameters:
-    -----------
-        obj: Any or List[Any],
-            the object to sample
-        n_samples: int,
-            the number of samples to generate
+    Only the objects along the paths of the Distribution objects are copied,
+    the other sub-objects are shared between the samples.
     """
-
     if isinstance(obj, list):
         obj_list = obj
     else:
         obj_list = [obj]
 
-    result = []
-
     for obj in obj_list:
+        dist_paths = _find_with_paths(obj, Distribution)
         for _ in range(n_samples):
-            result.append(_sample_single(copy.deepcopy(obj)))
-
-    return result
+            if isinstance(obj, Distribution):
+                yield copy.deepcopy(obj.sample(rng=rng))
+                continue
+            new_obj = _copy_paths(obj, [path for path, _ in dist_paths])
+            for path, dist in dist_paths:
+                _set_value(new_obj, path, copy.deepcopy(dist.sample(rng=rng)))
+            yield new_obj
 
 
-def _sample_single(obj):
-    """Sample the given object once."""
-    if isinstance(obj, Distribution):
-        return obj.sample()
-
-    if is_dataclass(obj):
-        for field in fields(obj):
-            value = getattr(obj, field.name)
-            sampled_value = _sample_single(value)
-            setattr(obj, field.name, sampled_value)
-    elif isinstance(obj, dict):
-        for key, value in obj.items():
-            obj[key] = _sample_single(value)
+def sample_args(obj: Any | list[Any], n_samples: int, rng=np.random):
+    """Sample the given object n_samples times. Each sample is a copy of
+    the original object with any object of type Distribution replaced by a
+    sample from that distribution.
 
-    return obj
+    Parameters:
+    -----------
+        obj: Any or List[Any],
+            the object to sample
+        n_samples: int,
+            the number of samples to generate
+        rng: np.random.Generator or module,
+            the random number generator used by the distributions
+    """
+    return list(iter_sample_args(obj, n_samples, rng))
 
 
 def _change_value(obj, path, value):
@@ -0,0 +1,419 @@
+"""Run several episodes in a single process.
+
+Episodes are run in lockstep: at each step, the `get_action` calls of all
+active episodes are sent concurrently, then all environments are stepped.
+Self-hosted servers (TGI, vLLM) batch concurrent requests on the GPU and API
+models serve them in parallel, instead of receiving one request per worker
+process.
+
+Environment calls stay in the main thread since browsergym shares a single
+synchronous playwright instance per process.
+
+After each step, the agent state and the actions sent to the environment are
+saved in `checkpoint.json`. An episode resumed from a previous run replays the
+recorded actions in a fresh environment, without querying the agent, and
+continues from there.
+
+Each episode writes its logs to the `experiment.log` of its directory. Since
+episodes share the root logger, a record goes to the file of the episode that
+the emitting thread is working on.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+import copy
+import gzip
+import json
+import logging
+from pathlib import Path
+import pickle
+import threading
+import traceback
+
+from agentlab.analyze.error_categorization import get_error_class
+from agentlab.experiments.browser_pool import install_browser_pool
+from agentlab.experiments.circuit_breaker import CircuitBreaker
+from agentlab.experiments.progress import PROGRESS_FILE, ProgressSink
+from agentlab.experiments.resource_limits import ResourceLimiter
+from agentlab.experiments.result_index import ResultIndex
+from agentlab.experiments.session_pool import SESSION_DIR_NAME, SessionArgs, get_storage_state
+from agentlab.experiments.study_manifest import StudyManifest
+from browsergym.experiments.loop import (
+    ExpArgs,
+    StepInfo,
+    _extract_err_msg,
+    _is_debugging,
+    _send_chat_info,
+    save_package_versions,
+)
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.json"
+# attributes of the agent saved in the checkpoint, if it has them
+AGENT_STATE_ATTRIBUTES = ("plan", "plan_step", "memories", "thoughts", "actions")
+LOG_FILE = "experiment.log"
+
+# exp_id of the episode each thread is working on, see Episode._log_scope
+_log_context = threading.local()
+
+
+def load_checkpoint(exp_dir) -> dict:
+    """Load the checkpoint of an experiment, None if there is none."""
+    path = Path(exp_dir) / CHECKPOINT_FILE
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text())
+    except json.JSONDecodeError:
+        # the process died while writing it
+        return None
+
+
+def _load_step_info(exp_dir, step: int) -> StepInfo:
+    try:
+        with gzip.open(Path(exp_dir) / f"step_{step}.pkl.gz", "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+class Episode:
+    """State of one experiment run by `run_exp_batch`."""
+
+    def __init__(self, exp_args: ExpArgs, resume_dir=None):
+        self.exp_args = exp_args
+        self.resume_dir = resume_dir
+        self.env_actions = []
+        self.agent = None
+        self.env = None
+        self.step_info = None
+        self.episode_info = []
+        self.action = None
+        self.err_msg = None
+        self.stack_trace = None
+        self.done = False
+        self.log_handler = None
+        # events of all the episodes of the study go to the same file
+        self.progress = ProgressSink(Path(exp_args.exp_dir).parent / PROGRESS_FILE)
+
+    def _fail(self, e: Exception):
+        self.err_msg = (
+            f"Exception uncaught by agent or environment in task "
+            f"{self.exp_args.env_args.task_name}.\n{type(e).__name__}:\n{e}"
+        )
+        self.stack_trace = traceback.format_exc()
+        self.exp_args.err_msg = self.err_msg
+        self.exp_args.stack_trace = self.stack_trace
+        logger.warning(f"{self.exp_args.exp_name}: {self.err_msg}\n{self.stack_trace}")
+        self.done = True
+        if _is_debugging() and self.exp_args.enable_debug:
+            logger.warning("Debug mode is enabled. Raising the error.")
+            raise e
+
+    @contextmanager
+    def _log_scope(self):
+        """Send the logs of the current thread to the log file of this episode."""
+        previous_exp_id = getattr(_log_context, "exp_id", None)
+        _log_context.exp_id = self.exp_args.exp_id
+        try:
+            yield
+        finally:
+            _log_context.exp_id = previous_exp_id
+
+    def _set_log_handler(self):
+        exp_args = self.exp_args
+        exp_id = exp_args.exp_id
+        self.log_handler = logging.FileHandler(Path(exp_args.exp_dir) / LOG_FILE)
+        self.log_handler.setLevel(exp_args.logging_level)
+        self.log_handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(process)d - %(name)s - %(levelname)s - %(message)s")
+        )
+        self.log_handler.addFilter(lambda record: getattr(_log_context, "exp_id", None) == exp_id)
+        root_logger = logging.getLogger()
+        if root_logger.getEffectiveLevel() > exp_args.logging_level:
+            root_logger.setLevel(exp_args.logging_level)
+        root_logger.addHandler(self.log_handler)
+
+    def _unset_log_handler(self):
+        if self.log_handler is not None:
+            logging.getLogger().removeHandler(self.log_handler)
+            self.log_handler.close()
+            self.log_handler = None
+
+    def start(self):
+        """Create the agent and the environment and reset it."""
+        self._set_log_handler()
+        with self._log_scope():
+            self._start()
+
+    def _start(self):
+        exp_args = self.exp_args
+        try:
+            save_package_versions(exp_args.exp_dir)
+            logger.info(f"Running experiment {exp_args.exp_name} in:\n  {exp_args.exp_dir}")
+            self.progress.emit(
+                "episode_start",
+                exp_id=exp_args.exp_id,
+                exp_name=exp_args.exp_name,
+                task_name=exp_args.env_args.task_name,
+            )
+            self.agent = exp_args.agent_args.make_agent()
+            env_args = exp_args.env_args
+            if isinstance(env_args.storage_state, SessionArgs):
+                # log in once for all the episodes of exp_root
+                session_dir = Path(exp_args.exp_dir).parents[1] / SESSION_DIR_NAME
+                env_args = copy.copy(env_args)
+                env_args.storage_state = str(get_storage_state(env_args.storage_state, session_dir))
+            self.env = env_args.make_env(
+                action_mapping=self.agent.action_set.to_python_code,
+                exp_dir=exp_args.exp_dir,
+            )
+            self.step_info = StepInfo(step=0)
+            self.episode_info = [self.step_info]
+            self.step_info.from_reset(
+                self.env,
+                seed=exp_args.env_args.task_seed,
+                obs_preprocessor=self.agent.obs_preprocessor,
+            )
+            self.done = self.step_info.is_done
+
+            checkpoint = load_checkpoint(self.resume_dir) if self.resume_dir else None
+            if checkpoint is not None and not self.done:
+                self._replay(checkpoint)
+        except Exception as e:
+            self._fail(e)
+
+    def _replay(self, checkpoint: dict):
+        """Replay the actions of a previous run and restore the agent state."""
+        exp_args = self.exp_args
+        logger.info(
+            f"Resuming {exp_args.exp_name}: replaying {len(checkpoint['actions'])} actions."
+        )
+        obs_history = []
+        for action in checkpoint["actions"]:
+            previous_step_info = _load_step_info(self.resume_dir, self.step_info.step)
+            if previous_step_info is not None:
+                self.step_info.agent_info = previous_step_info.agent_info
+                self.step_info.stats = previous_step_info.stats
+            self.step_info.action = action
+            # same chat history as the previous run
+            _send_chat_info(self.env.unwrapped.chat, action, self.step_info.agent_info)
+            obs_history.append(self.step_info.obs)
+            self.env_actions.append(action)
+            self.step_info.save_step_info(
+                exp_args.exp_dir, save_screenshot=exp_args.save_screenshot, save_som=exp_args.save_som
+            )
+
+            self.step_info = StepInfo(step=self.step_info.step + 1)
+            self.episode_info.append(self.step_info)
+            self.step_info.from_step(self.env, action, obs_preprocessor=self.agent.obs_preprocessor)
+            if self.step_info.is_done:
+                self.done = True
+                return
+
+        for attr, val in checkpoint["agent_state"].items():
+            setattr(self.agent, attr, val)
+        if hasattr(self.agent, "obs_history"):
+            self.agent.obs_history = obs_history
+        self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        checkpoint = {
+            "actions": self.env_actions,
+            "agent_state": {
+                attr: getattr(self.agent, attr)
+                for attr in AGENT_STATE_ATTRIBUTES
+                if hasattr(self.agent, attr)
+            },
+        }
+        # write then rename, so that a crash never leaves a partial checkpoint
+        path = Path(self.exp_args.exp_dir) / CHECKPOINT_FILE
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(checkpoint, default=str))
+        tmp_path.replace(path)
+
+    def act(self):
+        """Query the agent. Safe to call from a worker thread."""
+        with self._log_scope():
+            self._act()
+
+    def _act(self):
+        try:
+            self.action = self.step_info.from_action(self.agent)
+        except Exception as e:
+            self._fail(e)
+            return
+        stats = self.step_info.stats or {}
+        self.progress.emit(
+            "step",
+            exp_id=self.exp_args.exp_id,
+            step=self.step_info.step,
+            tokens=stats.get("openai_total_tokens"),
+            cost=stats.get("openai_total_cost"),
+        )
+
+    def step(self):
+        """Save the step and send the action to the environment."""
+        with self._log_scope():
+            self._step()
+
+    def _step(self):
+        exp_args = self.exp_args
+        try:
+            if self.action is None:
+                # will end the episode after saving the step info.
+                self.step_info.truncated = True
+
+            self.step_info.save_step_info(
+                exp_args.exp_dir, save_screenshot=exp_args.save_screenshot, save_som=exp_args.save_som
+            )
+            _send_chat_info(self.env.unwrapped.chat, self.action, self.step_info.agent_info)
+
+            if self.action is None:
+                self.done = True
+                return
+
+            self.env_actions.append(self.action)
+            self._save_checkpoint()
+
+            self.step_info = StepInfo(step=self.step_info.step + 1)
+            self.episode_info.append(self.step_info)
+            self.step_info.from_step(self.env, self.action, obs_preprocessor=self.agent.obs_preprocessor)
+            self.done = self.step_info.is_done
+        except Exception as e:
+            self._fail(e)
+
+    def close(self):
+        """Save the last step and the summary info, close the environment and
+        the log file."""
+        try:
+            with self._log_scope():
+                self._close()
+        finally:
+            self._unset_log_handler()
+
+    def _close(self):
+        exp_args = self.exp_args
+        try:
+            if self.step_info is not None:
+                self.step_info.save_step_info(
+                    exp_args.exp_dir, save_screenshot=exp_args.save_screenshot, save_som=exp_args.save_som
+                )
+        except Exception as e:
+            logger.error(f"Error while saving step info of {exp_args.exp_name}: {e}")
+        try:
+            err_msg = self.err_msg
+            if not err_msg and self.episode_info and not self.episode_info[-1].is_done:
+                e = KeyboardInterrupt("Early termination??")
+                err_msg = f"Exception uncaught by agent or environment in task {exp_args.env_args.task_name}.\n{type(e).__name__}:\n{e}"
+            exp_args.save_summary_info(self.episode_info, exp_args.exp_dir, err_msg, self.stack_trace)
+        except Exception as e:
+            logger.error(f"Error while saving summary info of {exp_args.exp_name}: {e}")
+        try:
+            study_dir = Path(exp_args.exp_dir).parent
+            # studies prepared by launch_exp have a manifest
+            if StudyManifest.exists(study_dir):
+                summary_info = json.loads((Path(exp_args.exp_dir) / "summary_info.json").read_text())
+                StudyManifest(study_dir).set_finished(exp_args, summary_info)
+                # the index is shared by the studies of exp_root
+                ResultIndex(study_dir.parent).add(exp_args, summary_info)
+        except Exception as e:
+            logger.error(f"Error while indexing the results of {exp_args.exp_name}: {e}")
+        try:
+            if not err_msg:
+                err_msg, stack_trace = _extract_err_msg(self.episode_info)
+            else:
+                stack_trace = self.stack_trace
+            self.progress.emit(
+                "episode_end",
+                exp_id=exp_args.exp_id,
+                n_steps=len(self.episode_info) - 1,
+                reward=sum(step_info.reward for step_info in self.episode_info),
+                err_class=get_error_class(err_msg, stack_trace),
+            )
+            circuit_breaker = CircuitBreaker.load(Path(exp_args.exp_dir).parent)
+            if circuit_breaker is not None:
+                circuit_breaker.record(err_msg, stack_trace, exp_id=exp_args.exp_id)
+        except Exception as e:
+            logger.error(f"Error while reporting the end of {exp_args.exp_name}: {e}")
+        try:
+            if self.env is not None:
+                self.env.close()
+        except Exception as e:
+            logger.error(f"Error while closing the environment of {exp_args.exp_name}: {e}")
+
+
+def run_exp_batch(
+    exp_args_list: list[ExpArgs],
+    max_llm_concurrency: int = None,
+    resume_dirs: list = None,
+    max_episodes_per_browser: int = None,
+    resource_limiter: ResourceLimiter = None,
+):
+    """Run a batch of prepared experiments in the current process.
+
+    Args:
+        exp_args_list: experiments to run, `prepare` must have been called.
+        max_llm_concurrency: maximum number of concurrent `get_action` calls.
+            Defaults to the number of experiments.
+        resume_dirs: for each experiment, directory of a previous run to
+            resume from, or None to start from scratch.
+        max_episodes_per_browser: if set, browsers are kept alive and reused
+            by the following episodes of this process, and recycled after
+            this many episodes. See browser_pool.
+        resource_limiter: if set, wait for the resources used by the batch
+            to be available and hold them until the end.
+    """
+    if max_episodes_per_browser:
+        install_browser_pool(max_episodes_per_browser)
+
+    # don't start episodes that would fail while a backend is down
+    circuit_breaker = CircuitBreaker.load(Path(exp_args_list[0].exp_dir).parent)
+    if circuit_breaker is not None:
+        is_probe = circuit_breaker.wait_until_closed(probe_id=exp_args_list[0].exp_id)
+        if is_probe and len(exp_args_list) > 1:
+            # the probe is a single episode, the others wait for its outcome
+            resume_dirs = resume_dirs or [None] * len(exp_args_list)
+            _run_with_resources(
+                exp_args_list[:1], max_llm_concurrency, resume_dirs[:1], resource_limiter
+            )
+            run_exp_batch(
+                exp_args_list[1:],
+                max_llm_concurrency,
+                resume_dirs[1:],
+                max_episodes_per_browser,
+                resource_limiter,
+            )
+            return
+
+    _run_with_resources(exp_args_list, max_llm_concurrency, resume_dirs, resource_limiter)
+
+
+def _run_with_resources(exp_args_list, max_llm_concurrency, resume_dirs, resource_limiter):
+    with resource_limiter.acquire(exp_args_list) if resource_limiter else nullcontext():
+        _run_episodes(exp_args_list, max_llm_concurrency, resume_dirs)
+
+
+def _run_episodes(exp_args_list: list[ExpArgs], max_llm_concurrency: int, resume_dirs: list):
+    resume_dirs = resume_dirs or [None] * len(exp_args_list)
+    episodes = [
+        Episode(exp_args, resume_dir) for exp_args, resume_dir in zip(exp_args_list, resume_dirs)
+    ]
+    try:
+        for episode in episodes:
+            episode.start()
+
+        n_workers = max_llm_concurrency or max(len(episodes), 1)
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            while True:
+                active = [episode for episode in episodes if not episode.done]
+                if not active:
+                    break
+                list(pool.map(Episode.act, active))
+                for episode in active:
+                    if not episode.done:
+                        episode.step()
+    finally:
+        for episode in episodes:
+            episode.close()
@@ -0,0 +1,145 @@
+"""Reuse browsers across the episodes run by a worker process.
+
+Browsergym launches a new Chromium for every episode (and another one for its
+chat window) and closes it at the end. Once `install_browser_pool` is called,
+`launch` returns a shared browser instead and closing it only closes the
+contexts created through it. Each episode still gets fresh contexts, only the
+browser process is reused. Browsers are recycled after
+`max_episodes_per_browser` launches to bound memory leaks.
+"""
+
+import atexit
+import json
+import logging
+
+import browsergym.core.chat
+import browsergym.core.env
+
+logger = logging.getLogger(__name__)
+
+
+class _SharedBrowser:
+    """Proxy of a shared browser whose `close` only closes its own contexts."""
+
+    def __init__(self, entry: "_PoolEntry"):
+        self._entry = entry
+        self._browser = entry.browser
+        self._contexts = []
+        self._closed = False
+        entry.n_active += 1
+
+    def new_context(self, **kwargs):
+        context = self._browser.new_context(**kwargs)
+        self._contexts.append(context)
+        return context
+
+    def close(self):
+        for context in self._contexts:
+            try:
+                context.close()
+            except Exception as e:
+                logger.warning(f"Error while closing a browser context: {e}")
+        self._contexts = []
+        if not self._closed:
+            self._closed = True
+            self._entry.n_active -= 1
+
+    def __getattr__(self, name):
+        return getattr(self._browser, name)
+
+
+class _PoolEntry:
+    def __init__(self, browser):
+        self.browser = browser
+        self.n_launches = 0
+        self.n_active = 0
+
+
+class BrowserPool:
+    """Browsers shared by the episodes of a process, one per set of launch
+    arguments.
+
+    A browser is recycled after `max_episodes_per_browser` launches, as soon
+    as no episode is using it anymore.
+    """
+
+    def __init__(self, max_episodes_per_browser: int = 50):
+        self.max_episodes_per_browser = max_episodes_per_browser
+        self._entries = {}  # launch key -> _PoolEntry
+
+    def launch(self, browser_type, **kwargs) -> _SharedBrowser:
+        key = json.dumps([browser_type.name, kwargs], sort_keys=True, default=str)
+        entry = self._entries.get(key)
+        if entry is not None and not entry.browser.is_connected():
+            entry = None
+        elif (
+            entry is not None
+            and entry.n_launches >= self.max_episodes_per_browser
+            and entry.n_active == 0
+        ):
+            logger.info(f"Recycling browser after {entry.n_launches} episodes.")
+            self._close_browser(entry.browser)
+            entry = None
+        if entry is None:
+            entry = _PoolEntry(browser_type.launch(**kwargs))
+            self._entries[key] = entry
+        entry.n_launches += 1
+        return _SharedBrowser(entry)
+
+    def _close_browser(self, browser):
+        try:
+            browser.close()
+        except Exception as e:
+            logger.warning(f"Error while closing a browser: {e}")
+
+    def close(self):
+        for entry in self._entries.values():
+            self._close_browser(entry.browser)
+        self._entries = {}
+
+
+class _PooledBrowserType:
+    def __init__(self, browser_type, pool: BrowserPool):
+        self._browser_type = browser_type
+        self._pool = pool
+
+    def launch(self, **kwargs):
+        return self._pool.launch(self._browser_type, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._browser_type, name)
+
+
+class _PooledPlaywright:
+    def __init__(self, playwright, pool: BrowserPool):
+        self._playwright = playwright
+        self.chromium = _PooledBrowserType(playwright.chromium, pool)
+
+    def __getattr__(self, name):
+        return getattr(self._playwright, name)
+
+
+_BROWSER_POOL: BrowserPool = None
+
+
+def install_browser_pool(max_episodes_per_browser: int = 50) -> BrowserPool:
+    """Make browsergym environments of this process reuse their browsers.
+
+    Calling it again in the same process returns the installed pool.
+    """
+    global _BROWSER_POOL
+    if _BROWSER_POOL is not None:
+        return _BROWSER_POOL
+
+    pool = BrowserPool(max_episodes_per_browser)
+    get_global_playwright = browsergym.core.env._get_global_playwright
+
+    def _get_pooled_playwright():
+        return _PooledPlaywright(get_global_playwright(), pool)
+
+    browsergym.core.env._get_global_playwright = _get_pooled_playwright
+    browsergym.core.chat._get_global_playwright = _get_pooled_playwright
+    atexit.register(pool.close)
+
+    _BROWSER_POOL = pool
+    return pool
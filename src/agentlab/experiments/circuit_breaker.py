@@ -0,0 +1,218 @@
+"""Circuit breaker shared by the workers of a study.
+
+When a backend (LLM server, ServiceNow instance, ...) goes down, every episode
+fails with a server error. The workers record the outcome of each episode in
+a SQLite database of the study directory. When the fraction of critical
+server errors (see `error_categorization.is_critical_server_error`) among
+the last episodes exceeds a threshold, the circuit opens and workers wait
+before starting new episodes. After a backoff, one worker runs a probe
+episode: the circuit closes if it succeeds, otherwise it opens again with a
+doubled backoff. Only the outcome of the probe episode, identified by its
+exp_id, closes or reopens the circuit, not the outcome of episodes that
+started before the outage. Episodes that failed with server errors are relaunched by
+`launch_exp.meta_main`.
+"""
+
+from contextlib import closing
+import logging
+from pathlib import Path
+import sqlite3
+import time
+
+from agentlab.analyze.error_categorization import is_critical_server_error
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_BREAKER_FILE = "circuit_breaker.db"
+
+_SETTINGS = (
+    "window",
+    "threshold",
+    "min_episodes",
+    "initial_backoff",
+    "max_backoff",
+    "probe_timeout",
+)
+
+
+class CircuitBreaker:
+    """Circuit breaker of a study, see create and load.
+
+    Args:
+        db_path: path of the database of the circuit breaker.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=60, isolation_level=None))
+
+    @classmethod
+    def create(
+        cls,
+        study_dir,
+        window: int = 10,
+        threshold: float = 0.5,
+        min_episodes: int = 5,
+        initial_backoff: float = 30,
+        max_backoff: float = 1800,
+        probe_timeout: float = 3600,
+    ) -> "CircuitBreaker":
+        """Create the circuit breaker of a study, or update its settings.
+
+        Args:
+            study_dir: directory of the study.
+            window: number of recent episodes over which the error rate is
+                computed.
+            threshold: fraction of critical server errors that opens the
+                circuit.
+            min_episodes: minimum number of recent episodes to open the circuit.
+            initial_backoff: seconds before the first probe.
+            max_backoff: maximum seconds between probes.
+            probe_timeout: seconds after which a probe that didn't finish,
+                e.g. because its worker died, is replaced by another one.
+        """
+        settings = dict(
+            window=window,
+            threshold=threshold,
+            min_episodes=min_episodes,
+            initial_backoff=initial_backoff,
+            max_backoff=max_backoff,
+            probe_timeout=probe_timeout,
+        )
+        breaker = cls(Path(study_dir) / CIRCUIT_BREAKER_FILE)
+        with breaker._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS state (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    status TEXT NOT NULL,
+                    closed_at REAL NOT NULL,
+                    backoff REAL,
+                    next_probe REAL,
+                    probe_started REAL,
+                    probe_id TEXT,
+                    window INTEGER NOT NULL,
+                    threshold REAL NOT NULL,
+                    min_episodes INTEGER NOT NULL,
+                    initial_backoff REAL NOT NULL,
+                    max_backoff REAL NOT NULL,
+                    probe_timeout REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outcomes (time REAL NOT NULL, server_error INTEGER)"
+            )
+            conn.execute(
+                f"INSERT INTO state (id, status, closed_at, {', '.join(_SETTINGS)}) "
+                f"VALUES (0, 'closed', ?, {', '.join('?' * len(_SETTINGS))}) "
+                f"ON CONFLICT(id) DO UPDATE SET "
+                + ", ".join(f"{name} = excluded.{name}" for name in _SETTINGS),
+                (time.time(), *settings.values()),
+            )
+        return breaker
+
+    @classmethod
+    def load(cls, study_dir) -> "CircuitBreaker":
+        """The circuit breaker of a study, or None if it has none."""
+        db_path = Path(study_dir) / CIRCUIT_BREAKER_FILE
+        return cls(db_path) if db_path.exists() else None
+
+    def _state(self, conn) -> dict:
+        cursor = conn.execute("SELECT * FROM state WHERE id = 0")
+        names = [description[0] for description in cursor.description]
+        return dict(zip(names, cursor.fetchone()))
+
+    def _open(self, conn, backoff: float):
+        logger.warning(
+            f"Too many server errors, pausing new episodes. Next probe in {backoff:.0f}s."
+        )
+        conn.execute(
+            "UPDATE state SET status = 'open', backoff = ?, next_probe = ? WHERE id = 0",
+            (backoff, time.time() + backoff),
+        )
+
+    def status(self) -> str:
+        """'closed', 'open' or 'half_open' (a probe episode is running)."""
+        with self._connect() as conn:
+            return self._state(conn)["status"]
+
+    def record(self, err_msg: str, stack_trace: str, exp_id: str = None):
+        """Record the outcome of an episode.
+
+        Args:
+            err_msg: error message of the episode, None if it succeeded.
+            stack_trace: stack trace of the error.
+            exp_id: id of the episode. While the circuit is half open, only
+                the outcome of the probe episode changes its state.
+        """
+        server_error = bool(is_critical_server_error(err_msg, stack_trace))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO outcomes VALUES (?, ?)", (time.time(), server_error))
+            state = self._state(conn)
+            if state["status"] == "half_open" and exp_id == state["probe_id"]:
+                if server_error:
+                    self._open(conn, min(2 * state["backoff"], state["max_backoff"]))
+                else:
+                    logger.info("Probe episode succeeded, resuming new episodes.")
+                    conn.execute(
+                        "UPDATE state SET status = 'closed', closed_at = ? WHERE id = 0",
+                        (time.time(),),
+                    )
+            elif state["status"] == "closed":
+                # only episodes that finished since the circuit closed count
+                errors = [
+                    row[0]
+                    for row in conn.execute(
+                        "SELECT server_error FROM outcomes WHERE time >= ? "
+                        "ORDER BY time DESC LIMIT ?",
+                        (state["closed_at"], state["window"]),
+                    )
+                ]
+                if (
+                    len(errors) >= state["min_episodes"]
+                    and sum(errors) / len(errors) >= state["threshold"]
+                ):
+                    self._open(conn, state["initial_backoff"])
+            conn.execute("COMMIT")
+
+    def wait_until_closed(self, probe_id: str = None, poll_interval: float = 5) -> bool:
+        """Block while the circuit is open.
+
+        Args:
+            probe_id: exp_id of the episode this worker would run as a probe.
+            poll_interval: seconds between checks of the state.
+
+        Returns:
+            True if this worker is chosen to run the probe episode, False
+            when the circuit is closed.
+        """
+        t0 = time.time()
+        while True:
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                state = self._state(conn)
+                now = time.time()
+                is_probe = (state["status"] == "open" and now >= state["next_probe"]) or (
+                    state["status"] == "half_open"
+                    and now - state["probe_started"] > state["probe_timeout"]
+                )
+                if is_probe:
+                    conn.execute(
+                        "UPDATE state SET status = 'half_open', probe_started = ?, probe_id = ? "
+                        "WHERE id = 0",
+                        (now, probe_id),
+                    )
+                conn.execute("COMMIT")
+
+            if state["status"] == "closed" or is_probe:
+                if now - t0 > poll_interval:
+                    logger.info(f"Waited {now - t0:.0f}s for the circuit breaker.")
+                if is_probe:
+                    logger.info(f"Running the probe episode {probe_id}.")
+                return is_probe
+            wait = poll_interval
+            if state["status"] == "open":
+                wait = min(poll_interval, max(0, state["next_probe"] - now))
+            time.sleep(wait)
@@ -0,0 +1,182 @@
+"""Estimate the cost and wall time of a study before launching it.
+
+Per-step token, cost and duration stats are collected from the summary info of
+previous studies, grouped by task, benchmark, model and agent flags. Each
+experiment uses the most specific group with the same model, and the wall
+time is simulated by dispatching the expected durations to n_jobs workers in
+launch order.
+"""
+
+from dataclasses import asdict, dataclass
+import heapq
+import json
+
+from browsergym.experiments.loop import ExpArgs, _flatten_dict, yield_all_exp_results
+
+from agentlab.experiments.scheduling import estimate_duration
+from agentlab.experiments.study_manifest import StudyManifest
+
+MODEL_KEY = "agent_args.chat_model_args.model_name"
+FLAGS_PREFIX = "agent_args.flags."
+# first available stat is used
+TOKEN_KEYS = ("stats.cum_openai_total_tokens", "stats.cum_n_token_agent_messages")
+COST_KEY = "stats.cum_openai_total_cost"
+
+_STAT_NAMES = (
+    "n_episodes",
+    "n_steps",
+    "tokens",
+    "token_steps",
+    "cost",
+    "cost_steps",
+    "duration",
+    "duration_steps",
+)
+
+
+def _match_keys(flat_exp_args: dict) -> list[tuple]:
+    """Groups of an experiment, from the most to the least specific."""
+    task_name = flat_exp_args.get("env_args.task_name", "")
+    benchmark = task_name.split(".")[0]
+    model_name = flat_exp_args.get(MODEL_KEY)
+    flags = json.dumps(
+        {key: val for key, val in flat_exp_args.items() if key.startswith(FLAGS_PREFIX)},
+        sort_keys=True,
+        default=str,
+    )
+    return [
+        ("task", task_name, model_name, flags),
+        ("benchmark", benchmark, model_name, flags),
+        ("model", benchmark, model_name),
+    ]
+
+
+def _iter_records(result_dirs):
+    if isinstance(result_dirs, (str, bytes)) or not hasattr(result_dirs, "__iter__"):
+        result_dirs = [result_dirs]
+    for result_dir in result_dirs:
+        if StudyManifest.exists(result_dir):
+            yield from StudyManifest(result_dir).records()
+        else:
+            for exp_result in yield_all_exp_results(result_dir, progress_fn=None):
+                yield exp_result.get_exp_record()
+
+
+def load_step_stats(result_dirs) -> dict[tuple, dict]:
+    """Sum of steps, tokens, cost and duration per group of experiments.
+
+    Args:
+        result_dirs: a directory or a list of directories of previous studies.
+
+    Returns:
+        A dict mapping the groups of _match_keys to their summed stats.
+    """
+    history = {}
+    for record in _iter_records(result_dirs):
+        n_steps = record.get("stats.cum_steps")
+        if not n_steps:
+            continue  # incomplete experiment
+        tokens = next((record[key] for key in TOKEN_KEYS if record.get(key) is not None), None)
+        cost = record.get(COST_KEY)
+        duration = record.get("stats.cum_step_elapsed")
+        if duration is not None:
+            duration += record.get("stats.cum_agent_elapsed") or 0
+
+        for key in _match_keys(record):
+            stats = history.setdefault(key, dict.fromkeys(_STAT_NAMES, 0))
+            stats["n_episodes"] += 1
+            stats["n_steps"] += n_steps
+            if tokens is not None:
+                stats["tokens"] += tokens
+                stats["token_steps"] += n_steps
+            if cost is not None:
+                stats["cost"] += cost
+                stats["cost_steps"] += n_steps
+            if duration is not None:
+                stats["duration"] += duration
+                stats["duration_steps"] += n_steps
+    return history
+
+
+def _per_step(stats: dict, name: str, steps_name: str):
+    return stats[name] / stats[steps_name] if stats[steps_name] else None
+
+
+def _makespan(durations: list[float], n_jobs: int) -> float:
+    """Wall time of running durations in order on n_jobs workers."""
+    workers = [0.0] * max(1, min(n_jobs, len(durations)))
+    for duration in durations:
+        heapq.heappush(workers, heapq.heappop(workers) + duration)
+    return max(workers)
+
+
+@dataclass
+class LaunchEstimate:
+    """Expected totals of a study.
+
+    Attributes:
+        n_experiments: number of experiments of the study.
+        n_with_history: number of experiments estimated from previous studies.
+        tokens: expected tokens of the experiments with a token history.
+        cost: expected cost in dollars of the experiments with a cost history.
+        wall_time: expected wall time in seconds.
+    """
+
+    n_experiments: int
+    n_with_history: int
+    tokens: float
+    cost: float
+    wall_time: float
+
+    def __str__(self):
+        wall_time = f"{int(self.wall_time // 3600)}h{int(self.wall_time % 3600 // 60):02d}m"
+        return (
+            f"Estimated cost: ${self.cost:.2f}, {self.tokens / 1e6:.1f}M tokens, "
+            f"wall time: {wall_time} "
+            f"({self.n_with_history}/{self.n_experiments} experiments estimated from previous "
+            f"studies, the others count for no cost)."
+        )
+
+
+def estimate_launch(
+    exp_args_list: list[ExpArgs], n_jobs: int = 1, history=None
+) -> LaunchEstimate:
+    """Estimate the tokens, cost and wall time of running the experiments.
+
+    Args:
+        exp_args_list: experiments, in launch order.
+        n_jobs: number of parallel jobs.
+        history: stats of previous studies, see load_step_stats.
+
+    Returns:
+        A LaunchEstimate.
+    """
+    history = history or {}
+    tokens = cost = 0.0
+    durations = []
+    n_with_history = 0
+    for exp_args in exp_args_list:
+        flat_exp_args = _flatten_dict(asdict(exp_args))
+        stats = next((history[key] for key in _match_keys(flat_exp_args) if key in history), None)
+        duration = None
+        if stats is not None:
+            n_with_history += 1
+            n_steps = stats["n_steps"] / stats["n_episodes"]
+            if exp_args.env_args.max_steps is not None:
+                n_steps = min(n_steps, exp_args.env_args.max_steps)
+            tokens += (_per_step(stats, "tokens", "token_steps") or 0) * n_steps
+            cost += (_per_step(stats, "cost", "cost_steps") or 0) * n_steps
+            duration_per_step = _per_step(stats, "duration", "duration_steps")
+            if duration_per_step is not None:
+                duration = duration_per_step * n_steps
+        if duration is None:
+            duration = estimate_duration(exp_args.env_args)
+        durations.append(duration)
+
+    return LaunchEstimate(
+        n_experiments=len(exp_args_list),
+        n_with_history=n_with_history,
+        tokens=tokens,
+        cost=cost,
+        wall_time=_makespan(durations, n_jobs) if durations else 0.0,
+    )
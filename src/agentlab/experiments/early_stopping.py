@@ -0,0 +1,162 @@
+"""Stop running seeds of configurations that are clearly worse than the best one.
+
+The experiments of a study are grouped by configuration (the agent args) and
+scheduled in rounds: round `i` runs the `i`-th seed of every task for every
+configuration still active. After each round, a bootstrap interval of the
+mean reward of each configuration is computed, stratified by task, and the
+configurations whose interval is entirely below the one of the best
+configuration stop receiving episodes.
+"""
+
+from collections import defaultdict
+from dataclasses import asdict
+import json
+import logging
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from browsergym.experiments.loop import ExpArgs, ExpResult, _flatten_dict
+
+from agentlab.utils.bootstrap import stratified_bootstrap
+
+logger = logging.getLogger(__name__)
+
+
+def config_key(exp_args: ExpArgs) -> str:
+    """Identifies the configuration of an experiment, i.e. its agent args."""
+    return json.dumps(_flatten_dict(asdict(exp_args.agent_args)), sort_keys=True, default=str)
+
+
+def make_rounds(exp_args_list: list[ExpArgs]) -> list[list[ExpArgs]]:
+    """Split experiments in rounds of one seed per task and configuration.
+
+    The order of exp_args_list is kept within each round.
+    """
+    def _key(exp_args):
+        return config_key(exp_args), exp_args.env_args.task_name
+
+    seeds = defaultdict(list)
+    for exp_args in exp_args_list:
+        seeds[_key(exp_args)].append(exp_args.env_args.task_seed)
+    for seed_list in seeds.values():
+        # None seeds are random, they can go in any round
+        seed_list.sort(key=lambda seed: (seed is None, seed or 0))
+
+    rounds = defaultdict(list)
+    for exp_args in exp_args_list:
+        seed_list = seeds[_key(exp_args)]
+        i = seed_list.index(exp_args.env_args.task_seed)
+        seed_list[i] = object()  # duplicated seeds go in the next rounds
+        rounds[i].append(exp_args)
+    return [rounds[i] for i in sorted(rounds)]
+
+
+def load_rewards(exp_args_list: list[ExpArgs], metric: str = "cum_reward") -> pd.DataFrame:
+    """Rewards of the finished experiments, one row per experiment."""
+    records = []
+    for exp_args in exp_args_list:
+        try:
+            reward = ExpResult(exp_args.exp_dir).summary_info[metric]
+        except (FileNotFoundError, KeyError):
+            continue
+        task_name = exp_args.env_args.task_name
+        records.append({"config": config_key(exp_args), "task_name": task_name, metric: reward})
+    return pd.DataFrame(records, columns=["config", "task_name", metric])
+
+
+def get_dominated_configs(
+    df: pd.DataFrame,
+    metric: str = "cum_reward",
+    confidence: float = 0.95,
+    n_bootstrap: int = 1000,
+    rng: np.random.Generator = None,
+) -> set[str]:
+    """Configurations whose bootstrap interval is below the one of the best.
+
+    Args:
+        df: rewards with columns config, task_name and metric, see load_rewards.
+        metric: column to compare.
+        confidence: confidence level of the intervals.
+        n_bootstrap: number of bootstrap samples.
+        rng: random number generator, for reproducibility.
+
+    Returns:
+        The set of dominated configurations.
+    """
+    if df["config"].nunique() < 2:
+        return set()
+    rng = np.random.default_rng() if rng is None else rng
+    bs_df = stratified_bootstrap(
+        df,
+        group_by="config",
+        strat="task_name",
+        metric=metric,
+        func=np.mean,
+        repeat=n_bootstrap,
+        rng=rng,
+    )
+    alpha = 1 - confidence
+    grouped = bs_df.groupby("config")[metric]
+    lower = grouped.quantile(alpha / 2)
+    upper = grouped.quantile(1 - alpha / 2)
+
+    best = df.groupby("config")[metric].mean().idxmax()
+    return set(upper.index[upper < lower[best]])
+
+
+def run_with_early_stopping(
+    exp_args_list: list[ExpArgs],
+    run_fn: Callable[[list[ExpArgs]], None],
+    min_rounds: int = 2,
+    metric: str = "cum_reward",
+    confidence: float = 0.95,
+    n_bootstrap: int = 1000,
+) -> list[ExpArgs]:
+    """Run the experiments in rounds of seeds and stop dominated configurations.
+
+    Args:
+        exp_args_list: experiments of the study, with several seeds per task.
+        run_fn: runs a list of experiments, which then have their results in
+            their exp_dir.
+        min_rounds: number of rounds run before any configuration is stopped.
+            With a single seed per task, the intervals ignore the variance
+            across seeds and are too narrow.
+        metric: summary info field to compare, higher is better.
+        confidence: confidence level of the intervals.
+        n_bootstrap: number of bootstrap samples.
+
+    Returns:
+        The experiments that were run.
+    """
+    rounds = make_rounds(exp_args_list)
+    dominated = set()
+    done = []
+    for i, round_exp_args in enumerate(rounds):
+        round_exp_args = [
+            exp_args for exp_args in round_exp_args if config_key(exp_args) not in dominated
+        ]
+        if not round_exp_args:
+            continue
+        logger.info(
+            f"Early stopping round {i + 1}/{len(rounds)}: {len(round_exp_args)} experiments."
+        )
+        run_fn(round_exp_args)
+        done.extend(round_exp_args)
+
+        if i + 1 < min_rounds:
+            continue
+        newly_dominated = (
+            get_dominated_configs(load_rewards(done, metric), metric, confidence, n_bootstrap)
+            - dominated
+        )
+        agent_names = {config_key(exp_args): exp_args.agent_args.agent_name for exp_args in done}
+        for key in newly_dominated:
+            logger.info(f"Stopping {agent_names[key]}, it is dominated by the best configuration.")
+        dominated |= newly_dominated
+
+    logger.info(
+        f"Early stopping ran {len(done)}/{len(exp_args_list)} experiments, "
+        f"{len(dominated)} configurations were stopped."
+    )
+    return done
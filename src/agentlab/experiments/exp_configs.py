@@ -4,6 +4,7 @@ from browsergym.experiments.loop import EnvArgs, ExpArgs
 from agentlab.agents.generic_agent.generic_agent import GenericAgentArgs
 from agentlab.agents import dynamic_prompting as dp
 from agentlab.experiments import args
+from agentlab.experiments import scheduling
 from agentlab.experiments import task_collections as tasks
 from agentlab.agents.generic_agent.generic_agent_prompt import (
     GenericPromptFlags,
@@ -25,6 +26,18 @@ def get_exp_args_list(func_name: str, *a, **kw):
 
     exp_args_list = func(*a, **kw)  # type: list[ExpArgs]
 
+    return func_name, schedule_exp_args(exp_args_list)
+
+
+def schedule_exp_args(exp_args_list: list[ExpArgs], durations: dict[str, float] = None):
+    """Order experiments longest expected first, WorkArena sort tasks last.
+
+    Args:
+        exp_args_list: experiments to order.
+        durations: episode durations per task name from previous studies, see
+            scheduling.load_episode_durations. If None, durations are
+            estimated from max_steps.
+    """
     not_filter_task = []
     filter_task = []
     has_webarena = False
@@ -39,15 +52,17 @@ def get_exp_args_list(func_name: str, *a, **kw):
         else:
             not_filter_task.append(exp_args)
 
-    # shuffle sepearately
+    # shuffle sepearately, the shuffling breaks ties of the (stable) sort
     if not has_webarena:
         logging.info("Shuffling the task list.")
         random.shuffle(not_filter_task)
         random.shuffle(filter_task)
+        not_filter_task = scheduling.sort_longest_first(not_filter_task, durations)
+        filter_task = scheduling.sort_longest_first(filter_task, durations)
 
     exp_arg_list = not_filter_task + filter_task
     logging.info(f"{len(filter_task)}/{len(exp_arg_list)} are moved to the end.")
-    return func_name, exp_arg_list
+    return exp_arg_list
 
 
 def make_seeds(n, offset=42):
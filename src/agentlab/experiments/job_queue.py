@@ -0,0 +1,292 @@
+"""Job queue to run a study on several machines.
+
+The prepared `ExpArgs` of a study are stored in a SQLite database on a shared
+filesystem. Workers, on any node, lease one job at a time and renew their
+lease with heartbeats while the experiment runs. Jobs whose lease expired,
+e.g. because the worker died, go back to the queue and resume from their
+last checkpoint. A job is failed after `max_attempts` leases.
+
+Start workers on other nodes with:
+
+    python -m agentlab.experiments.job_queue --queue_path <study_dir>/job_queue.db
+
+Note: SQLite locking relies on the filesystem, avoid filesystems with broken
+locks (e.g. some NFS setups).
+"""
+
+import argparse
+import json
+from contextlib import closing
+import logging
+import os
+from pathlib import Path
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from browsergym.experiments.loop import ExpArgs
+
+from agentlab.experiments.resource_limits import LOCK_DIR_NAME, ResourceLimiter
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FILE = "job_queue.db"
+
+
+class JobQueue:
+    """SQLite queue of experiments with leases.
+
+    Args:
+        db_path: path of the database, created if needed.
+        lease_duration: seconds after which a job leased by a worker that
+            stopped sending heartbeats is given to another worker.
+        max_attempts: number of leases after which a job is marked as failed.
+    """
+
+    def __init__(self, db_path, lease_duration: float = 300, max_attempts: int = 3):
+        self.db_path = str(db_path)
+        self.lease_duration = lease_duration
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    exp_args BLOB NOT NULL,
+                    resume_dir TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker_id TEXT,
+                    lease_expires REAL,
+                    n_attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueue_order INTEGER NOT NULL
+                )"""
+            )
+
+    def _connect(self):
+        # isolation_level=None: transactions are handled explicitly. Closing the
+        # connection rolls back an unfinished transaction.
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return closing(conn)
+
+    def enqueue(self, exp_args_list: list[ExpArgs], resume_dirs: list = None):
+        """Add prepared experiments to the queue.
+
+        Experiments already in the queue, e.g. when relaunching, are put back
+        in the pending state, unless a worker is running them.
+
+        Args:
+            exp_args_list: prepared experiments.
+            resume_dirs: for each experiment, directory of a previous run to
+                resume from, or None.
+        """
+        resume_dirs = resume_dirs or [None] * len(exp_args_list)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            query = "SELECT COALESCE(MAX(enqueue_order) + 1, 0) FROM jobs"
+            (order,) = conn.execute(query).fetchone()
+            for i, (exp_args, resume_dir) in enumerate(zip(exp_args_list, resume_dirs)):
+                exp_args.make_id()
+                conn.execute(
+                    "INSERT INTO jobs (job_id, exp_args, resume_dir, enqueue_order) "
+                    "VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(job_id) DO UPDATE SET exp_args = excluded.exp_args, "
+                    "resume_dir = excluded.resume_dir, enqueue_order = excluded.enqueue_order, "
+                    "status = 'pending', worker_id = NULL, lease_expires = NULL, n_attempts = 0 "
+                    "WHERE status != 'leased'",
+                    (
+                        exp_args.exp_id,
+                        pickle.dumps(exp_args),
+                        None if resume_dir is None else str(resume_dir),
+                        order + i,
+                    ),
+                )
+            conn.execute("COMMIT")
+
+    def lease(self, worker_id: str) -> tuple[ExpArgs, str, int]:
+        """Lease the next pending job.
+
+        A job leased again after its worker died is prepared in a new
+        directory, which resumes from the checkpoint of the previous attempt.
+
+        Returns:
+            The experiment, the directory to resume from and the attempt
+            number (starting at 1), or (None, None, None) if no job is
+            pending.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._requeue_expired(conn)
+            row = conn.execute(
+                "SELECT job_id, exp_args, resume_dir, n_attempts FROM jobs "
+                "WHERE status = 'pending' ORDER BY enqueue_order LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None, None, None
+            job_id, exp_args, resume_dir, n_attempts = row
+            exp_args = pickle.loads(exp_args)
+            if n_attempts > 0:
+                # stored with the lease, so that the next attempt resumes from this one
+                resume_dir = _prepare_retry(exp_args)
+                conn.execute(
+                    "UPDATE jobs SET exp_args = ?, resume_dir = ? WHERE job_id = ?",
+                    (pickle.dumps(exp_args), resume_dir, job_id),
+                )
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', worker_id = ?, lease_expires = ?, "
+                "n_attempts = ? WHERE job_id = ?",
+                (worker_id, time.time() + self.lease_duration, n_attempts + 1, job_id),
+            )
+            conn.execute("COMMIT")
+        return exp_args, resume_dir, n_attempts + 1
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extend the lease of a job. Returns False if the lease was lost."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ? "
+                "WHERE job_id = ? AND worker_id = ? AND status = 'leased'",
+                (time.time() + self.lease_duration, job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str) -> bool:
+        """Mark a job as done. Returns False if the lease was lost, in which
+        case the job belongs to another worker."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', lease_expires = NULL "
+                "WHERE job_id = ? AND worker_id = ? AND status = 'leased'",
+                (job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def _requeue_expired(self, conn):
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN n_attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker_id = NULL, lease_expires = NULL "
+            "WHERE status = 'leased' AND lease_expires < ?",
+            (self.max_attempts, time.time()),
+        )
+
+    def counts(self) -> dict[str, int]:
+        """Number of jobs per status."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._requeue_expired(conn)
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+            conn.execute("COMMIT")
+        return dict(rows)
+
+
+def _prepare_retry(exp_args: ExpArgs) -> str:
+    """Prepare the experiment of a previous attempt in a new directory.
+
+    Returns:
+        The directory of the previous attempt, to resume from.
+    """
+    from agentlab.experiments.launch_exp import _prepare_exp_args
+
+    # same study directory, the previous attempt is moved to _<name>
+    (resume_dir,) = _prepare_exp_args([exp_args], Path(exp_args.exp_dir).parent)
+    return str(resume_dir)
+
+
+def _heartbeat_loop(queue: JobQueue, job_id, worker_id, stop: threading.Event, interval):
+    while not stop.wait(interval):
+        if not queue.heartbeat(job_id, worker_id):
+            logger.warning(f"Worker {worker_id} lost the lease of job {job_id}.")
+            return
+
+
+def run_worker(
+    queue_path,
+    worker_id: str = None,
+    lease_duration: float = 300,
+    heartbeat_interval: float = 60,
+    max_attempts: int = 3,
+    max_episodes_per_browser: int = None,
+    resource_limiter=None,
+    run_fn=None,
+):
+    """Run jobs from the queue until no job is pending.
+
+    Args:
+        queue_path: path of the queue database.
+        worker_id: unique name of the worker. Defaults to host, pid and a
+            random suffix.
+        lease_duration: see JobQueue.
+        heartbeat_interval: seconds between lease renewals. Must be well below
+            lease_duration.
+        max_attempts: see JobQueue.
+        max_episodes_per_browser: see launch_exp.main.
+        resource_limiter: see resource_limits.ResourceLimiter.
+        run_fn: function running one experiment, with the signature of
+            launch_exp.run_exp. Defaults to launch_exp.run_exp.
+    """
+    if run_fn is None:
+        from agentlab.experiments.launch_exp import run_exp as run_fn
+
+    worker_id = worker_id or f"{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex[:6]}"
+    queue = JobQueue(queue_path, lease_duration=lease_duration, max_attempts=max_attempts)
+
+    while True:
+        exp_args, resume_dir, attempt = queue.lease(worker_id)
+        if exp_args is None:
+            logger.info(f"Worker {worker_id}: no pending job left.")
+            return
+        if attempt > 1:
+            logger.info(f"Attempt {attempt} of {exp_args.exp_name}, resuming from {resume_dir}.")
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat_loop,
+            args=(queue, exp_args.exp_id, worker_id, stop, heartbeat_interval),
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            run_fn(exp_args, resume_dir, max_episodes_per_browser, resource_limiter)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        if not queue.complete(exp_args.exp_id, worker_id):
+            logger.warning(f"Job {exp_args.exp_id} completed after its lease expired.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queue_path", required=True, help="path of the queue database")
+    parser.add_argument("--n_workers", default=1, type=int, help="number of worker processes")
+    parser.add_argument("--lease_duration", default=300, type=float)
+    parser.add_argument("--heartbeat_interval", default=60, type=float)
+    parser.add_argument("--max_episodes_per_browser", default=None, type=int)
+    parser.add_argument(
+        "--resource_limits",
+        type=json.loads,
+        default=None,
+        help="Same limits as the launcher, e.g. '{\"workarena\": 8}'.",
+    )
+    args = parser.parse_args()
+
+    from joblib import Parallel, delayed
+
+    resource_limiter = None
+    if args.resource_limits:
+        # lock files are shared with the launcher, in the exp_root of the study
+        lock_dir = Path(args.queue_path).parents[1] / LOCK_DIR_NAME
+        resource_limiter = ResourceLimiter(lock_dir, args.resource_limits)
+
+    Parallel(n_jobs=args.n_workers)(
+        delayed(run_worker)(
+            args.queue_path,
+            lease_duration=args.lease_duration,
+            heartbeat_interval=args.heartbeat_interval,
+            max_episodes_per_browser=args.max_episodes_per_browser,
+            resource_limiter=resource_limiter,
+        )
+        for _ in range(args.n_workers)
+    )
@@ -1,19 +1,40 @@
 from datetime import datetime
 import logging
-import multiprocessing
 from pathlib import Path
 import random
+import re
 from joblib import Parallel, delayed
+import copy
+import json
 from agentlab.analyze import error_categorization
+from agentlab.experiments.batch_runner import run_exp_batch
+from agentlab.experiments.circuit_breaker import CircuitBreaker
+from agentlab.experiments.cost_estimation import estimate_launch, load_step_stats
+from agentlab.experiments.early_stopping import run_with_early_stopping
+from agentlab.experiments.job_queue import QUEUE_FILE, JobQueue, run_worker
+from agentlab.experiments.progress import PROGRESS_FILE, ProgressSink
+from agentlab.experiments.result_index import ResultIndex
+from agentlab.experiments.resource_limits import LOCK_DIR_NAME, ResourceLimiter, split_batches
+from agentlab.experiments.scheduling import load_episode_durations
+from agentlab.experiments.study_manifest import StudyManifest
+from agentlab.llm.chat_api import LLM_CASSETTE_FILE, CassetteChatModelArgs
 from agentlab.llm.llm_configs import CHAT_MODEL_ARGS_DICT
-from browsergym.experiments.loop import ExpArgs, yield_all_exp_results
+from browsergym.experiments.loop import ExpArgs, ExpResult, yield_all_exp_results
 from agentlab.webarena_setup.check_webarena_servers import check_webarena_servers
 import agentlab
 import argparse
 
 
-def run_exp(exp_args: ExpArgs):
-    exp_args.run()
+def run_exp(
+    exp_args: ExpArgs, resume_dir=None, max_episodes_per_browser=None, resource_limiter=None
+):
+    """Run one experiment, resuming from the checkpoint in resume_dir if any."""
+    run_exp_batch(
+        [exp_args],
+        resume_dirs=[resume_dir],
+        max_episodes_per_browser=max_episodes_per_browser,
+        resource_limiter=resource_limiter,
+    )
 
 
 def main(
@@ -27,6 +48,18 @@ def main(
     auto_accept=False,
     use_threads_instead_of_processes=False,
     relaunch_mode=None,
+    episodes_per_process=1,
+    max_llm_concurrency=None,
+    resume_from_checkpoint=True,
+    max_episodes_per_browser=None,
+    use_job_queue=False,
+    duration_history_dirs=None,
+    resource_limits: dict[str, int] = None,
+    early_stopping=False,
+    early_stopping_min_rounds=2,
+    early_stopping_confidence=0.95,
+    rerun_completed=False,
+    circuit_breaker=False,
 ):
     """Launch a group of experiments.
 
@@ -44,6 +77,47 @@ def main(
         use_threads_instead_of_processes: prefer threads over processes in
             joblib, useful for debugging.
         relaunch_mode: choice of None, 'incomplete_only', 'all_errors', 'server_error',
+        episodes_per_process: number of episodes run in lockstep by each job.
+            Their LLM calls are sent concurrently, which lets LLM servers
+            batch them. Fewer episodes are run together when they would
+            exceed resource_limits. See batch_runner.run_exp_batch.
+        max_llm_concurrency: maximum number of concurrent LLM calls within a
+            job, when episodes_per_process > 1.
+        resume_from_checkpoint: when relaunching, replay the actions of the
+            previous run up to where it stopped instead of starting over.
+        max_episodes_per_browser: if set, each worker keeps its browsers alive
+            across episodes and recycles them after this many episodes.
+            Workers are reused across jobs when using processes.
+        use_job_queue: enqueue the experiments in a job queue stored in the
+            study directory and start n_jobs local workers on it. Workers on
+            other nodes can join the study, see job_queue.
+        duration_history_dirs: directory or list of directories of previous
+            studies. Episode durations measured there are used to start the
+            longest experiments first. Otherwise, they are estimated from
+            max_steps. Their tokens and costs are used to estimate the cost
+            of the study in the confirmation message, see cost_estimation.
+        resource_limits: maximum number of concurrent experiments per
+            resource, e.g. {"workarena": 8, "openai/gpt-4o": 16}. Keys are
+            task name prefixes or model names. The limits hold across all
+            the studies launched in exp_root. See resource_limits.
+        early_stopping: run the seeds in rounds and stop running the
+            configurations whose bootstrap interval of the reward is below the
+            one of the best configuration. See early_stopping.
+        early_stopping_min_rounds: number of rounds of seeds run before any
+            configuration is stopped.
+        early_stopping_confidence: confidence level of the intervals.
+        rerun_completed: run experiments even if the same agent args and env
+            args already completed successfully in another study of exp_root.
+            Otherwise, they are skipped and linked into the new study. Only
+            applies to new launches.
+        circuit_breaker: pause new episodes while most episodes fail with
+            critical server errors, e.g. when an LLM server or a ServiceNow
+            instance is down, and resume after a successful probe episode.
+            See circuit_breaker.
+
+    Returns:
+        The name of the study directory in exp_root, or None if the launch
+        was aborted.
     """
     if exp_group_name:
         logging.info(f"Launching experiment group: {exp_group_name}")
@@ -58,17 +132,28 @@ def main(
         exp_group_name = "final_run"
         extra_kwargs = {"benchmark": benchmark, "model_name": model_name}
 
-    exp_args_list, exp_dir = _validate_launch_mode(
+    validated = _validate_launch_mode(
         exp_root,
         exp_group_name,
         exp_args_list,
         relaunch_mode,
         auto_accept,
         extra_kwargs,
+        n_jobs=n_jobs,
+        history_dirs=duration_history_dirs,
+        rerun_completed=rerun_completed,
     )
+    if validated is None:
+        return None
+    exp_args_list, exp_dir = validated
 
     if shuffle_jobs:
         random.shuffle(exp_args_list)
+    elif duration_history_dirs is not None:
+        from agentlab.experiments import exp_configs
+
+        durations = load_episode_durations(duration_history_dirs)
+        exp_args_list = exp_configs.schedule_exp_args(exp_args_list, durations)
 
     # if webarena, check if the server is running
     if any("webarena" in exp_args.env_args.task_name for exp_args in exp_args_list):
@@ -79,14 +164,70 @@ def main(
     registry = {}
 
     logging.info(f"Saving experiments to {exp_dir}")
-    for exp_args in exp_args_list:
-        exp_args.prepare(exp_root=exp_dir)
+    ProgressSink(Path(exp_dir) / PROGRESS_FILE).emit("study_start", n_episodes=len(exp_args_list))
+    logging.info(
+        f"Follow the progress with: python -m agentlab.experiments.progress {exp_dir}"
+    )
 
-    try:
+    if circuit_breaker:
+        CircuitBreaker.create(exp_dir)
+
+    resource_limiter = None
+    if resource_limits:
+        resource_limiter = ResourceLimiter(Path(exp_root) / LOCK_DIR_NAME, resource_limits)
+
+    def launch(exp_args_list):
+        resume_dirs = _prepare_exp_args(exp_args_list, exp_dir, resume_from_checkpoint)
         prefer = "threads" if use_threads_instead_of_processes else "processes"
-        Parallel(n_jobs=n_jobs, prefer=prefer)(
-            delayed(run_exp)(exp_args) for exp_args in exp_args_list
-        )
+        if use_job_queue:
+            queue_path = Path(exp_dir) / QUEUE_FILE
+            JobQueue(queue_path).enqueue(exp_args_list, resume_dirs)
+            logging.info(
+                f"Experiments enqueued in {queue_path}. Other nodes can join with:\n"
+                f"  python -m agentlab.experiments.job_queue --queue_path {queue_path}"
+            )
+            Parallel(n_jobs=n_jobs, prefer=prefer)(
+                delayed(run_worker)(
+                    queue_path,
+                    max_episodes_per_browser=max_episodes_per_browser,
+                    resource_limiter=resource_limiter,
+                )
+                for _ in range(n_jobs)
+            )
+            logging.info(f"Job queue status: {JobQueue(queue_path).counts()}")
+        elif episodes_per_process > 1:
+            # batches never need more slots of a resource than its limit
+            resume_dir_map = {
+                exp_args.exp_id: resume_dir
+                for exp_args, resume_dir in zip(exp_args_list, resume_dirs)
+            }
+            batches = split_batches(exp_args_list, episodes_per_process, resource_limits)
+            Parallel(n_jobs=n_jobs, prefer=prefer)(
+                delayed(run_exp_batch)(
+                    batch,
+                    max_llm_concurrency,
+                    [resume_dir_map[exp_args.exp_id] for exp_args in batch],
+                    max_episodes_per_browser,
+                    resource_limiter,
+                )
+                for batch in batches
+            )
+        else:
+            Parallel(n_jobs=n_jobs, prefer=prefer)(
+                delayed(run_exp)(exp_args, resume_dir, max_episodes_per_browser, resource_limiter)
+                for exp_args, resume_dir in zip(exp_args_list, resume_dirs)
+            )
+
+    try:
+        if early_stopping:
+            run_with_early_stopping(
+                exp_args_list,
+                launch,
+                min_rounds=early_stopping_min_rounds,
+                confidence=early_stopping_confidence,
+            )
+        else:
+            launch(exp_args_list)
     finally:
         # will close servers even if there is an exception or ctrl+c
         # servers won't be closed if the script is killed with kill -9 or segfaults.
@@ -94,12 +235,21 @@ def main(
         logging.info("Closing all LLM servers...")
         logging.info("LLM servers closed.")
 
-    return exp_group_name
+    return Path(exp_dir).name
 
 
 def _validate_launch_mode(
-    exp_root, exp_group_name, exp_args_list, relaunch_mode, auto_accept, extra_kwargs
+    exp_root,
+    exp_group_name,
+    exp_args_list,
+    relaunch_mode,
+    auto_accept,
+    extra_kwargs,
+    n_jobs=1,
+    history_dirs=None,
+    rerun_completed=False,
 ) -> tuple[list[ExpArgs], Path]:
+    completed_dirs = []
     if relaunch_mode is not None:
         # dig into an existing experiment group and relaunch all incomplete experiments
         exp_dir = Path(exp_root) / exp_group_name
@@ -120,7 +270,6 @@ def _validate_launch_mode(
             f"\nHey, You are about to relaunch {len(exp_args_list)} incomplete or errored experiments in {exp_dir}. "
             f"Make sure the processes that were running are all stopped. Otherwise, "
             f"there will be concurrent writing in the same directories.\n"
-            f"Press Y to continue.\n"
         )
 
         # overwrtting the model_url just in case
@@ -142,10 +291,22 @@ def _validate_launch_mode(
             f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{exp_group_name}"
         )
         exp_dir = Path(exp_root) / exp_group_name
-        message = (
-            f"\nYou are about to launch {len(exp_args_list)} experiments in {exp_dir}.\n"
-            f"Press Y to continue.\n"
-        )
+        if not rerun_completed:
+            exp_args_list, completed_dirs = _find_completed(exp_args_list, exp_root)
+        message = f"\nYou are about to launch {len(exp_args_list)} experiments in {exp_dir}.\n"
+        if completed_dirs:
+            message += (
+                f"{len(completed_dirs)} other experiments already completed in other studies of "
+                f"{exp_root}, they will be linked instead of run again. Use rerun_completed=True "
+                f"to run them.\n"
+            )
+
+    try:
+        history = load_step_stats(history_dirs) if history_dirs is not None else None
+        message += f"{estimate_launch(exp_args_list, n_jobs, history)}\n"
+    except Exception as e:
+        logging.warning(f"Could not estimate the cost of the study: {e}")
+    message += "Press Y to continue.\n"
 
     if auto_accept:
         logging.info(message)
@@ -157,12 +318,108 @@ def _validate_launch_mode(
         logging.info("Aborting.")
         return
 
+    if completed_dirs:
+        _link_completed(completed_dirs, exp_dir)
     return exp_args_list, exp_dir
 
 
+def _prepare_exp_args(exp_args_list: list[ExpArgs], exp_dir, resume_from_checkpoint=True):
+    """Prepare the experiments in exp_dir and add them to its manifest.
+
+    Each experiment gets its own copy of its agent and env args, which
+    iter_cross_product shares between experiments, since agents and workers
+    modify them in place.
+
+    Returns:
+        The directories of their previous runs to resume from, or None.
+    """
+    resume_dirs = []
+    for exp_args in exp_args_list:
+        exp_args.agent_args = copy.deepcopy(exp_args.agent_args)
+        exp_args.env_args = copy.deepcopy(exp_args.env_args)
+        previous_exp_dir = exp_args.exp_dir
+        exp_args.prepare(exp_root=exp_dir)
+        if previous_exp_dir is not None:
+            # prepare() moved the previous run to _<name>
+            previous_exp_dir = Path(previous_exp_dir)
+            previous_exp_dir = previous_exp_dir.with_name("_" + previous_exp_dir.name)
+        _set_cassette_paths(exp_args, previous_exp_dir)
+        resume_dirs.append(previous_exp_dir if resume_from_checkpoint else None)
+    StudyManifest(exp_dir).add_prepared(exp_args_list)
+    return resume_dirs
+
+
+def _find_completed(exp_args_list: list[ExpArgs], exp_root) -> tuple[list[ExpArgs], list[Path]]:
+    """Find the experiments that already completed successfully in another
+    study of exp_root.
+
+    Returns:
+        The experiments to run and the directories of the completed ones.
+    """
+    index = ResultIndex(exp_root)
+    remaining = []
+    completed_dirs = []
+    for exp_args in exp_args_list:
+        previous_exp_dir = index.lookup(exp_args)
+        # duplicated experiments are run again
+        if previous_exp_dir is None or previous_exp_dir in completed_dirs:
+            remaining.append(exp_args)
+        else:
+            completed_dirs.append(previous_exp_dir)
+    return remaining, completed_dirs
+
+
+def _link_completed(completed_dirs: list[Path], exp_dir):
+    """Link the directories of completed experiments into exp_dir and add them
+    to its manifest."""
+    manifest = StudyManifest(exp_dir)
+    for previous_exp_dir in completed_dirs:
+        link = Path(exp_dir) / previous_exp_dir.name
+        link.symlink_to(previous_exp_dir, target_is_directory=True)
+        exp_result = ExpResult(link)
+        manifest.add_prepared([exp_result.exp_args])
+        manifest.set_finished(exp_result.exp_args, exp_result.summary_info)
+    logging.info(f"Linked {len(completed_dirs)} experiments that already completed in {exp_dir}.")
+
+
+def _set_cassette_paths(exp_args: ExpArgs, previous_exp_dir=None):
+    """Record the LLM calls of each experiment into its own directory and
+    replay the ones of its previous run, stored in previous_exp_dir, if any."""
+    chat_model_args = getattr(exp_args.agent_args, "chat_model_args", None)
+    if not isinstance(chat_model_args, CassetteChatModelArgs):
+        return
+
+    chat_model_args.cassette_path = str(Path(exp_args.exp_dir) / LLM_CASSETTE_FILE)
+    if previous_exp_dir is not None:
+        chat_model_args.replay_path = str(Path(previous_exp_dir) / LLM_CASSETTE_FILE)
+    elif chat_model_args.replay_root is not None:
+        chat_model_args.replay_path = _find_cassette(chat_model_args.replay_root, exp_args)
+
+
+def _find_cassette(replay_root, exp_args: ExpArgs):
+    """Find the cassette of the experiment with the same name in replay_root."""
+    # same sanitization as ExpArgs._make_dir
+    exp_str = re.sub(r"[\/:*?<>|]", "_", exp_args.exp_name)
+    name_pattern = re.compile(rf"\d{{4}}-\d\d-\d\d_\d\d-\d\d-\d\d_{re.escape(exp_str)}(_\d+)?")
+    # most recent first
+    for cassette in sorted(Path(replay_root).glob(f"*/{LLM_CASSETTE_FILE}"), reverse=True):
+        if name_pattern.fullmatch(cassette.parent.name):
+            return str(cassette)
+    return None
+
+
 def _yield_incomplete_experiments(exp_root, relaunch_mode="incomplete_only"):
     """Find all incomplete experiments and relaunch them."""
     # TODO(make relanch_mode a callable, for flexibility)
+    if StudyManifest.exists(exp_root):
+        # no need to open every experiment directory
+        for exp_dir, status, err_msg, stack_trace in StudyManifest(exp_root).status():
+            if status != "done" or (
+                err_msg is not None and _should_relaunch(relaunch_mode, err_msg, stack_trace)
+            ):
+                yield ExpResult(exp_dir).exp_args
+        return
+
     for exp_result in yield_all_exp_results(
         exp_root, progress_fn=None
     ):  # type: ExpArgs
@@ -172,26 +429,27 @@ def _yield_incomplete_experiments(exp_root, relaunch_mode="incomplete_only"):
             yield exp_result.exp_args
             continue
 
-        if relaunch_mode == "incomplete_only":
-            continue
-
         err_msg = summary_info.get("err_msg", None)
         stack_trace = summary_info.get("stack_trace", None)
 
-        if err_msg is not None:
-            if relaunch_mode == "all_errors":
-                yield exp_result.exp_args
-            elif relaunch_mode == "server_errors":
-                critical_server_error = error_categorization.is_critical_server_error(
-                    err_msg, stack_trace
-                )
-                minor_server_error = error_categorization.is_minor_server_error(
-                    err_msg, stack_trace
-                )
-                if critical_server_error or minor_server_error:
-                    yield exp_result.exp_args
-            else:
-                raise ValueError(f"Unknown relaunch_mode: {relaunch_mode}")
+        if err_msg is not None and _should_relaunch(relaunch_mode, err_msg, stack_trace):
+            yield exp_result.exp_args
+
+
+def _should_relaunch(relaunch_mode, err_msg, stack_trace) -> bool:
+    """Whether a finished experiment with an error should be relaunched."""
+    if relaunch_mode == "incomplete_only":
+        return False
+    elif relaunch_mode == "all_errors":
+        return True
+    elif relaunch_mode == "server_errors":
+        critical_server_error = error_categorization.is_critical_server_error(
+            err_msg, stack_trace
+        )
+        minor_server_error = error_categorization.is_minor_server_error(err_msg, stack_trace)
+        return critical_server_error or minor_server_error
+    else:
+        raise ValueError(f"Unknown relaunch_mode: {relaunch_mode}")
 
 
 # TODO: is that still relevant since the column fixes on workarena ?
@@ -204,14 +462,16 @@ def meta_main(
     use_threads_instead_of_processes=False,
     relaunch_mode=None,
     n_retry=10,
+    **kwargs,
 ):
+    """Launch with a circuit breaker, and relaunch the experiments that failed
+    with server errors until none is left or n_retry relaunches were made.
 
-    manager = multiprocessing.Manager()
-    server_error_flag = manager.Value("i", 0)
-
+    Other kwargs are passed to main.
+    """
     itr = 0
-    while itr < n_retry:
-        exp_group_name = main(
+    while True:
+        exp_dir_name = main(
             exp_root=exp_root,
             exp_group_name=exp_group_name,
             n_jobs=n_jobs,
@@ -219,23 +479,33 @@ def meta_main(
             auto_accept=auto_accept,
             use_threads_instead_of_processes=use_threads_instead_of_processes,
             relaunch_mode=relaunch_mode,
-            server_error_flag=server_error_flag,
+            circuit_breaker=True,
+            **kwargs,
         )
-        if not server_error_flag.value:
+        if exp_dir_name is None:
+            return
+
+        exp_dir = Path(exp_root) / exp_dir_name
+        n_failed = len(list(_yield_incomplete_experiments(exp_dir, "server_errors")))
+        if n_failed == 0:
+            return
+
+        if itr == n_retry:
+            logging.info("Server error occurred too many times. Aborting.")
             return
 
         # values to overwrite for the next iterations
-        server_error_flag.value = 0
+        exp_group_name = exp_dir_name
         relaunch_mode = "server_errors"
         auto_accept = True
 
         itr += 1
         logging.info("\n-----------------------------------")
-        logging.info(f"Server error occurred. Retrying {itr}/{n_retry}...")
+        logging.info(
+            f"{n_failed} experiments failed with server errors. Retrying {itr}/{n_retry}..."
+        )
         logging.info("-----------------------------------\n")
 
-    logging.info("Server error occurred too many times. Aborting.")
-
 
 if __name__ == "__main__":
     from agentlab.experiments.exp_utils import RESULTS_DIR
@@ -279,6 +549,50 @@ if __name__ == "__main__":
         choices=[None, "incomplete_only", "all_errors", "server_errors"],
         help="Find all incomplete experiments and relaunch them.",
     )
+    parser.add_argument(
+        "--episodes_per_process",
+        default=1,
+        type=int,
+        help="Number of episodes run in lockstep by each job, to batch LLM calls.",
+    )
+    parser.add_argument(
+        "--duration_history_dirs",
+        nargs="*",
+        default=None,
+        help="Previous studies used to estimate episode durations, to start the longest first.",
+    )
+    parser.add_argument(
+        "--resource_limits",
+        type=json.loads,
+        default=None,
+        help='Maximum number of concurrent experiments per resource, e.g. \'{"workarena": 8}\'.',
+    )
+    parser.add_argument(
+        "--use_job_queue",
+        action="store_true",
+        help="Run the experiments from a job queue that workers on other nodes can join.",
+    )
+    parser.add_argument(
+        "--max_episodes_per_browser",
+        default=None,
+        type=int,
+        help="Reuse browsers across episodes, recycling them after this many episodes.",
+    )
+    parser.add_argument(
+        "--early_stopping",
+        action="store_true",
+        help="Run seeds in rounds and stop the configurations that are clearly worse.",
+    )
+    parser.add_argument(
+        "--rerun_completed",
+        action="store_true",
+        help="Run experiments that already completed successfully in another study.",
+    )
+    parser.add_argument(
+        "--circuit_breaker",
+        action="store_true",
+        help="Pause new episodes while a backend is down.",
+    )
 
     args, unknown = parser.parse_known_args()
     main(
@@ -288,4 +602,12 @@ if __name__ == "__main__":
         benchmark=args.benchmark,
         model_name=args.model_name,
         relaunch_mode=args.relaunch_mode,
+        episodes_per_process=args.episodes_per_process,
+        max_episodes_per_browser=args.max_episodes_per_browser,
+        use_job_queue=args.use_job_queue,
+        duration_history_dirs=args.duration_history_dirs,
+        resource_limits=args.resource_limits,
+        early_stopping=args.early_stopping,
+        rerun_completed=args.rerun_completed,
+        circuit_breaker=args.circuit_breaker,
     )
@@ -0,0 +1,164 @@
+"""Live progress of a study.
+
+Workers append small json events to `progress_events.jsonl` in the study
+directory: study start, episode start and end, and one event per step with its
+tokens and cost. `summarize_progress` aggregates them into throughput, ETA,
+errors per class and cost burn rate, and
+
+    python -m agentlab.experiments.progress <study_dir>
+
+displays them live in the terminal.
+"""
+
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+import time
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_FILE = "progress_events.jsonl"
+
+
+class ProgressSink:
+    """Appends progress events to a jsonl file shared by all workers."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def emit(self, event: str, **data):
+        record = {"event": event, "time": time.time(), "pid": os.getpid(), **data}
+        try:
+            # a single short write in append mode is not interleaved with other
+            # processes' writes
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write progress event: {e}")
+
+
+def load_events(study_dir) -> list[dict]:
+    path = Path(study_dir) / PROGRESS_FILE
+    if not path.exists():
+        return []
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue  # partially written line
+    return events
+
+
+def summarize_progress(events: list[dict], now: float = None, window: float = 600) -> dict:
+    """Aggregate the events of the last launch of a study.
+
+    Args:
+        events: progress events, see load_events.
+        now: current time, defaults to time.time().
+        window: seconds over which throughput and burn rate are measured.
+
+    Returns:
+        A dict of progress statistics.
+    """
+    now = time.time() if now is None else now
+    # a relaunch starts a new launch
+    starts = [i for i, event in enumerate(events) if event["event"] == "study_start"]
+    if starts:
+        start_event = events[starts[-1]]
+        events = events[starts[-1] :]
+        n_total = start_event["n_episodes"]
+        t_start = start_event["time"]
+    else:
+        n_total = None
+        t_start = min((event["time"] for event in events), default=now)
+
+    running = set()
+    ended = []
+    cost = tokens = recent_cost = 0.0
+    for event in events:
+        if event["event"] == "episode_start":
+            running.add(event["exp_id"])
+        elif event["event"] == "episode_end":
+            running.discard(event["exp_id"])
+            ended.append(event)
+        elif event["event"] == "step":
+            cost += event.get("cost") or 0
+            tokens += event.get("tokens") or 0
+            if event["time"] >= now - window:
+                recent_cost += event.get("cost") or 0
+
+    window = min(window, max(now - t_start, 1e-6))
+    n_recent = sum(event["time"] >= now - window for event in ended)
+    episodes_per_min = n_recent / window * 60
+
+    errors = {}
+    for event in ended:
+        if event.get("err_class") is not None:
+            errors[event["err_class"]] = errors.get(event["err_class"], 0) + 1
+
+    eta = None
+    if n_total is not None and episodes_per_min > 0:
+        eta = (n_total - len(ended)) / episodes_per_min * 60
+
+    return {
+        "n_total": n_total,
+        "n_done": len(ended),
+        "n_running": len(running),
+        "episodes_per_min": episodes_per_min,
+        "eta_seconds": eta,
+        "success_rate": (
+            sum((event.get("reward") or 0) > 0 for event in ended) / len(ended) if ended else None
+        ),
+        "error_rate": sum(errors.values()) / len(ended) if ended else None,
+        "errors_per_class": errors,
+        "cost": cost,
+        "cost_per_hour": recent_cost / window * 3600,
+        "tokens": tokens,
+        "elapsed_seconds": now - t_start,
+    }
+
+
+def format_progress(summary: dict) -> str:
+    def _duration(seconds):
+        if seconds is None:
+            return "?"
+        return f"{int(seconds // 3600)}h{int(seconds % 3600 // 60):02d}m"
+
+    n_total = "?" if summary["n_total"] is None else summary["n_total"]
+    lines = [
+        f"episodes: {summary['n_done']}/{n_total} done, {summary['n_running']} running",
+        f"throughput: {summary['episodes_per_min']:.1f} episodes/min, "
+        f"elapsed: {_duration(summary['elapsed_seconds'])}, "
+        f"ETA: {_duration(summary['eta_seconds'])}",
+    ]
+    if summary["n_done"]:
+        lines.append(
+            f"success rate: {summary['success_rate']:.1%}, error rate: {summary['error_rate']:.1%}"
+        )
+    for err_class, count in sorted(summary["errors_per_class"].items(), key=lambda x: -x[1]):
+        lines.append(f"  {err_class}: {count}")
+    lines.append(
+        f"cost: ${summary['cost']:.2f} (${summary['cost_per_hour']:.2f}/h), "
+        f"tokens: {summary['tokens']:,.0f}"
+    )
+    return "\n".join(lines)
+
+
+def watch(study_dir, refresh: float = 5):
+    """Print the progress of a study every `refresh` seconds."""
+    while True:
+        summary = summarize_progress(load_events(study_dir))
+        print("\033[2J\033[H" + f"{study_dir}\n\n" + format_progress(summary), flush=True)
+        time.sleep(refresh)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("study_dir", help="directory of the study")
+    parser.add_argument("--refresh", default=5, type=float, help="refresh period in seconds")
+    args = parser.parse_args()
+    watch(args.study_dir, args.refresh)
@@ -0,0 +1,132 @@
+"""Limit the number of concurrent experiments using a shared resource.
+
+Limits are declared per resource, e.g. `{"workarena": 8, "openai/gpt-4o": 16}`.
+A resource matches an experiment if its task name starts with the resource
+name (benchmarks) or if it is the model name of the agent. Each resource has
+`limit` slots, which are lock files in a directory shared by all the workers,
+possibly across studies and nodes. A worker runs an experiment once it holds a
+slot of every matching resource.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import logging
+import os
+from pathlib import Path
+import re
+import time
+
+from browsergym.experiments.loop import ExpArgs
+
+logger = logging.getLogger(__name__)
+
+LOCK_DIR_NAME = ".resource_locks"
+
+
+def get_resources(exp_args: ExpArgs, limits: dict[str, int]) -> list[str]:
+    """Resources of `limits` used by an experiment."""
+    task_name = exp_args.env_args.task_name
+    chat_model_args = getattr(exp_args.agent_args, "chat_model_args", None)
+    model_name = getattr(chat_model_args, "model_name", None)
+    return [
+        resource
+        for resource in limits
+        if task_name.startswith(resource) or resource == model_name
+    ]
+
+
+def split_batches(
+    exp_args_list: list[ExpArgs], batch_size: int, limits: dict[str, int] = None
+) -> list[list[ExpArgs]]:
+    """Split experiments in batches run together, see batch_runner.run_exp_batch.
+
+    Each experiment goes in the first batch that has room for it, so that no
+    batch uses more slots of a resource than its limit.
+    """
+    limits = limits or {}
+    batches = []
+    for exp_args in exp_args_list:
+        resources = get_resources(exp_args, limits)
+        for batch, used in batches:
+            if len(batch) < batch_size and all(used[r] < limits[r] for r in resources):
+                break
+        else:
+            batch, used = [], dict.fromkeys(limits, 0)
+            batches.append((batch, used))
+        batch.append(exp_args)
+        for resource in resources:
+            used[resource] += 1
+    return [batch for batch, _ in batches]
+
+
+class ResourceLimiter:
+    """Limits on the number of concurrent experiments per resource, enforced
+    across processes with lock files.
+
+    Args:
+        lock_dir: directory of the lock files, shared by all the workers.
+        limits: maximum number of concurrent experiments per resource.
+        poll_interval: seconds between attempts when all slots are taken.
+    """
+
+    def __init__(self, lock_dir, limits: dict[str, int], poll_interval: float = 1):
+        self.lock_dir = Path(lock_dir)
+        self.limits = limits
+        self.poll_interval = poll_interval
+
+    def _slot_paths(self, resource: str) -> list[Path]:
+        safe_name = re.sub(r"[^\w.-]", "_", resource)
+        return [self.lock_dir / f"{safe_name}.{i}.lock" for i in range(self.limits[resource])]
+
+    def _try_acquire(self, needed: dict[str, int]) -> list:
+        """Lock `needed[resource]` slots of each resource, or none at all."""
+        held = []
+        for resource in sorted(needed):
+            n_acquired = 0
+            for path in self._slot_paths(resource):
+                if n_acquired == needed[resource]:
+                    break
+                fd = os.open(path, os.O_CREAT | os.O_RDWR)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                held.append(fd)
+                n_acquired += 1
+            if n_acquired < needed[resource]:
+                _release(held)
+                return None
+        return held
+
+    @contextmanager
+    def acquire(self, exp_args_list: list[ExpArgs]):
+        """Block until the experiments can run together, and hold their slots
+        until the end of the context."""
+        needed = {}
+        for exp_args in exp_args_list:
+            for resource in get_resources(exp_args, self.limits):
+                needed[resource] = needed.get(resource, 0) + 1
+        for resource, n in needed.items():
+            if n > self.limits[resource]:
+                raise ValueError(
+                    f"{n} experiments run together need {resource}, "
+                    f"but its limit is {self.limits[resource]}."
+                )
+
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        t0 = time.time()
+        while (held := self._try_acquire(needed)) is None:
+            time.sleep(self.poll_interval)
+        if time.time() - t0 > self.poll_interval:
+            logger.info(f"Waited {time.time() - t0:.0f}s for resources {sorted(needed)}.")
+        try:
+            yield
+        finally:
+            _release(held)
+
+
+def _release(fds: list):
+    for fd in fds:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
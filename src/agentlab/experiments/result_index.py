@@ -0,0 +1,115 @@
+"""Index of the successful experiments of all the studies in an exp_root.
+
+Experiments are identified by a hash of their agent and env args, so that the
+same (agent config, task, seed) is recognized across studies. The launcher
+looks it up to skip experiments that already completed successfully in
+another study, and links to their directories instead.
+"""
+
+from contextlib import closing
+from dataclasses import asdict
+import hashlib
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import time
+
+from browsergym.experiments.loop import ExpArgs, _flatten_dict, yield_all_exp_results
+
+logger = logging.getLogger(__name__)
+
+RESULT_INDEX_FILE = "result_index.db"
+
+# fields that don't change the outcome of an experiment
+_IGNORED_FIELDS = (
+    "model_url",
+    "cassette_path",
+    "replay_path",
+    "replay_root",
+    "headless",
+    "record_video",
+    "slow_mo",
+    "login_fn",
+)
+
+
+def exp_hash(exp_args: ExpArgs) -> str:
+    """Stable hash of the agent and env args of an experiment.
+
+    Returns:
+        The hash, or None if the task seed is random, in which case runs are
+        not equivalent.
+    """
+    if exp_args.env_args.task_seed is None:
+        return None
+    flat_args = _flatten_dict(
+        {"agent_args": asdict(exp_args.agent_args), "env_args": asdict(exp_args.env_args)}
+    )
+    flat_args = {
+        key: val for key, val in flat_args.items() if key.split(".")[-1] not in _IGNORED_FIELDS
+    }
+    content = json.dumps(flat_args, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class ResultIndex:
+    """Maps experiment hashes to the directory of a successful run."""
+
+    def __init__(self, exp_root):
+        self.db_path = Path(exp_root) / RESULT_INDEX_FILE
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    exp_hash TEXT PRIMARY KEY,
+                    exp_dir TEXT NOT NULL,
+                    updated REAL NOT NULL
+                )"""
+            )
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.db_path, timeout=60, isolation_level=None))
+
+    def add(self, exp_args: ExpArgs, summary_info: dict):
+        """Add a finished experiment if it was successful."""
+        key = exp_hash(exp_args)
+        if key is None or summary_info.get("err_msg") is not None:
+            return
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (key, str(Path(exp_args.exp_dir).resolve()), time.time()),
+            )
+
+    def lookup(self, exp_args: ExpArgs) -> Path:
+        """Directory of a successful run of the same experiment, or None."""
+        key = exp_hash(exp_args)
+        if key is None:
+            return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT exp_dir FROM results WHERE exp_hash = ?", (key,)).fetchone()
+        if row is None or not (Path(row[0]) / "summary_info.json").exists():
+            # the result may have been deleted
+            return None
+        return Path(row[0])
+
+
+def index_results(exp_root, result_dirs=None, progress_fn=None) -> ResultIndex:
+    """Add the successful experiments of existing studies to the index.
+
+    Args:
+        exp_root: directory of the index.
+        result_dirs: directories to scan. Defaults to exp_root.
+        progress_fn: progress function, e.g. tqdm.
+    """
+    index = ResultIndex(exp_root)
+    result_dirs = exp_root if result_dirs is None else result_dirs
+    for exp_result in yield_all_exp_results(result_dirs, progress_fn=progress_fn):
+        try:
+            exp_args = exp_result.exp_args
+            exp_args.exp_dir = exp_result.exp_dir
+            index.add(exp_args, exp_result.summary_info)
+        except Exception as e:
+            logger.debug(f"Skipping {exp_result.exp_dir}: {e}")
+    return index
@@ -0,0 +1,86 @@
+"""Order experiments to shorten the completion time of a study.
+
+With a pool of workers taking jobs in order, starting the longest episodes
+first (LPT scheduling) avoids a tail dominated by a few long episodes started
+last. Episode durations are estimated from the results of previous studies
+and fall back to a per-benchmark default per step.
+"""
+
+from collections import defaultdict
+import logging
+
+import numpy as np
+from browsergym.experiments.loop import EnvArgs, ExpArgs, yield_all_exp_results
+
+logger = logging.getLogger(__name__)
+
+# rough wall time of one step, in seconds, for tasks never seen before
+DEFAULT_STEP_DURATION = {
+    "miniwob": 5,
+    "workarena": 20,
+    "webarena": 15,
+}
+DEFAULT_MAX_STEPS = 10
+
+
+def _episode_duration(summary_info: dict) -> float:
+    """Wall time of an episode from its summary info."""
+    step_elapsed = summary_info.get("stats.cum_step_elapsed")
+    agent_elapsed = summary_info.get("stats.cum_agent_elapsed")
+    if step_elapsed is None or agent_elapsed is None:
+        return None
+    return step_elapsed + agent_elapsed
+
+
+def load_episode_durations(result_dirs) -> dict[str, float]:
+    """Median episode duration per task name in previous studies.
+
+    Args:
+        result_dirs: a directory or a list of directories containing
+            experiments, e.g. previous studies.
+
+    Returns:
+        A dict mapping task names to durations in seconds.
+    """
+    durations = defaultdict(list)
+    for exp_result in yield_all_exp_results(result_dirs, progress_fn=None):
+        try:
+            duration = _episode_duration(exp_result.summary_info)
+            task_name = exp_result.exp_args.env_args.task_name
+        except Exception:
+            # incomplete or unreadable experiment
+            continue
+        if duration is not None:
+            durations[task_name].append(duration)
+    return {task_name: float(np.median(vals)) for task_name, vals in durations.items()}
+
+
+def estimate_duration(env_args: EnvArgs, durations: dict[str, float] = None) -> float:
+    """Expected wall time of an episode, in seconds."""
+    if durations and env_args.task_name in durations:
+        return durations[env_args.task_name]
+    benchmark = env_args.task_name.split(".")[0]
+    step_duration = DEFAULT_STEP_DURATION.get(benchmark, max(DEFAULT_STEP_DURATION.values()))
+    return step_duration * (env_args.max_steps or DEFAULT_MAX_STEPS)
+
+
+def sort_longest_first(
+    exp_args_list: list[ExpArgs], durations: dict[str, float] = None
+) -> list[ExpArgs]:
+    """Sort experiments by decreasing expected duration.
+
+    Args:
+        exp_args_list: experiments to sort.
+        durations: known durations per task name, see load_episode_durations.
+
+    Returns:
+        The sorted list.
+    """
+    expected = [estimate_duration(exp_args.env_args, durations) for exp_args in exp_args_list]
+    order = sorted(range(len(exp_args_list)), key=lambda i: -expected[i])
+    n_known = sum(exp_args.env_args.task_name in (durations or {}) for exp_args in exp_args_list)
+    logger.info(
+        f"Scheduling longest episodes first. {n_known}/{len(exp_args_list)} durations "
+        f"are estimated from previous results, total expected work: {sum(expected) / 3600:.1f}h."
+    )
+    return [exp_args_list[i] for i in order]
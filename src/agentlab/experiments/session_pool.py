@@ -0,0 +1,102 @@
+"""Authenticated browser sessions shared by the episodes of a study.
+
+Instead of logging in at every episode, set `EnvArgs.storage_state` to a
+`SessionArgs`. Before the environment of an episode is created, the worker
+replaces it with the path of a Playwright storage state (cookies and local
+storage). That state is saved by the first worker that needs it, after running
+the login function once, and reused by all the episodes and workers of
+exp_root. It is refreshed when it is older than `max_age` or when one of its
+cookies expired.
+"""
+
+from dataclasses import dataclass
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+import re
+import time
+from typing import Callable
+
+import browsergym.core.env
+import playwright.sync_api
+
+logger = logging.getLogger(__name__)
+
+SESSION_DIR_NAME = ".sessions"
+
+
+@dataclass
+class SessionArgs:
+    """How to log into a website.
+
+    Args:
+        name: identifies the session, e.g. the website and the user.
+        login_url: page where the login starts.
+        login_fn: logs in from the login page. It must be a module-level
+            function to be sent to other processes.
+        max_age: seconds after which the session is refreshed.
+        headless: run the login browser headless, False for manual logins.
+    """
+
+    name: str
+    login_url: str
+    login_fn: Callable[[playwright.sync_api.Page], None] = None
+    max_age: float = 3600
+    headless: bool = True
+
+
+def _is_fresh(path: Path, max_age: float) -> bool:
+    if not path.exists() or time.time() - path.stat().st_mtime > max_age:
+        return False
+    try:
+        cookies = json.loads(path.read_text()).get("cookies", [])
+    except (OSError, json.JSONDecodeError):
+        return False
+    # session cookies have expires = -1
+    return all(
+        cookie.get("expires", -1) < 0 or cookie["expires"] > time.time() for cookie in cookies
+    )
+
+
+def login(session_args: SessionArgs, path):
+    """Log in and save the storage state to path."""
+    logger.info(f"Logging into {session_args.name}.")
+    browser = browsergym.core.env._get_global_playwright().chromium.launch(
+        headless=session_args.headless
+    )
+    try:
+        context = browser.new_context()
+        page = context.new_page()
+        page.goto(session_args.login_url)
+        if session_args.login_fn is not None:
+            session_args.login_fn(page)
+        tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+        context.storage_state(path=tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        browser.close()
+
+
+def get_storage_state(session_args: SessionArgs, session_dir) -> Path:
+    """Path of a fresh storage state of the session, logging in if needed.
+
+    Workers sharing session_dir wait for the one that logs in.
+    """
+    session_dir = Path(session_dir)
+    session_dir.mkdir(parents=True, exist_ok=True)
+    safe_name = re.sub(r"[^\w.-]", "_", session_args.name)
+    path = session_dir / f"{safe_name}.json"
+    if _is_fresh(path, session_args.max_age):
+        return path
+
+    with open(session_dir / f"{safe_name}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # another worker may have logged in while we waited
+            if not _is_fresh(path, session_args.max_age):
+                login(session_args, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return path
@@ -0,0 +1,147 @@
+"""Index of the experiments of a study, to avoid scanning its directories.
+
+The manifest is a SQLite database in the study directory. An experiment is
+added when it is prepared, with its flattened arguments, and updated with its
+summary info and error class when it finishes. Relaunching and
+`inspect_results.load_result_df` query it instead of opening every
+experiment directory. `rebuild_manifest` recreates it from the directories,
+e.g. for studies launched before the manifest existed.
+"""
+
+from contextlib import closing
+from dataclasses import asdict
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import time
+
+from browsergym.experiments.loop import ExpArgs, _flatten_dict, yield_all_exp_results
+
+from agentlab.analyze.error_categorization import get_error_class
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "study_manifest.db"
+
+
+def _to_json(record: dict) -> str:
+    return json.dumps(record, default=str)
+
+
+def _from_json(text: str) -> dict:
+    # tuples become lists in json, make them hashable again for pandas indexes
+    return {
+        key: tuple(val) if isinstance(val, list) else val for key, val in json.loads(text).items()
+    }
+
+
+class StudyManifest:
+    """Manifest of the experiments of a study directory."""
+
+    def __init__(self, study_dir):
+        self.study_dir = Path(study_dir)
+        self.db_path = self.study_dir / MANIFEST_FILE
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS experiments (
+                    exp_id TEXT PRIMARY KEY,
+                    exp_dir TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    exp_record TEXT NOT NULL,
+                    summary_info TEXT,
+                    err_msg TEXT,
+                    stack_trace TEXT,
+                    err_class TEXT,
+                    updated REAL NOT NULL
+                )"""
+            )
+
+    @staticmethod
+    def exists(study_dir) -> bool:
+        return (Path(study_dir) / MANIFEST_FILE).exists()
+
+    def _connect(self):
+        self.study_dir.mkdir(parents=True, exist_ok=True)
+        return closing(sqlite3.connect(self.db_path, timeout=60, isolation_level=None))
+
+    def add_prepared(self, exp_args_list: list[ExpArgs]):
+        """Add prepared experiments. A relaunched experiment replaces its
+        previous run."""
+        for exp_args in exp_args_list:
+            exp_args.make_id()
+        rows = [
+            (
+                exp_args.exp_id,
+                Path(exp_args.exp_dir).name,
+                _to_json(_flatten_dict(asdict(exp_args))),
+                time.time(),
+            )
+            for exp_args in exp_args_list
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO experiments (exp_id, exp_dir, status, exp_record, updated) "
+                "VALUES (?, ?, 'prepared', ?, ?)",
+                rows,
+            )
+
+    def set_finished(self, exp_args: ExpArgs, summary_info: dict):
+        """Record the summary info of a finished experiment."""
+        err_msg = summary_info.get("err_msg")
+        stack_trace = summary_info.get("stack_trace")
+        with self._connect() as conn:
+            # the experiment may have been re-prepared in another directory
+            conn.execute(
+                "UPDATE experiments SET status = 'done', exp_dir = ?, summary_info = ?, "
+                "err_msg = ?, stack_trace = ?, err_class = ?, updated = ? WHERE exp_id = ?",
+                (
+                    Path(exp_args.exp_dir).name,
+                    _to_json(summary_info),
+                    err_msg,
+                    stack_trace,
+                    get_error_class(err_msg, stack_trace),
+                    time.time(),
+                    exp_args.exp_id,
+                ),
+            )
+
+    def records(self) -> list[dict]:
+        """Records as returned by ExpResult.get_exp_record."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT exp_dir, exp_record, summary_info FROM experiments"
+            ).fetchall()
+        records = []
+        for exp_dir, exp_record, summary_info in rows:
+            record = _from_json(exp_record)
+            if summary_info is not None:
+                record.update(_from_json(summary_info))
+            record["exp_dir"] = self.study_dir / exp_dir
+            records.append(record)
+        return records
+
+    def status(self) -> list[tuple]:
+        """(exp_dir, status, err_msg, stack_trace) of each experiment."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT exp_dir, status, err_msg, stack_trace FROM experiments"
+            ).fetchall()
+        return [(self.study_dir / exp_dir, *row) for exp_dir, *row in rows]
+
+
+def rebuild_manifest(study_dir, progress_fn=None) -> StudyManifest:
+    """Recreate the manifest of a study from its experiment directories."""
+    manifest = StudyManifest(study_dir)
+    for exp_result in yield_all_exp_results(study_dir, progress_fn=progress_fn):
+        try:
+            exp_args = exp_result.exp_args
+        except Exception as e:
+            logger.warning(f"Skipping {exp_result.exp_dir}: {e}")
+            continue
+        manifest.add_prepared([exp_args])
+        try:
+            manifest.set_finished(exp_args, exp_result.summary_info)
+        except FileNotFoundError:
+            pass
+    return manifest
@@ -0,0 +1,127 @@
+"""Successive halving search over agent configurations.
+
+Configurations are sampled from agent args containing `args.Distribution`
+objects, e.g. `args.Choice` on some GenericPromptFlags. All of them are run on
+a small subset of the tasks, the best `1 / eta` are kept, and the survivors
+are run on a subset `eta` times larger, until one configuration is left or
+all the tasks are used. Subsets are nested, so the results of a round are
+reused in the next ones.
+"""
+
+import logging
+import math
+from typing import Callable
+
+import numpy as np
+from browsergym.experiments.loop import AbstractAgentArgs, EnvArgs, ExpArgs
+
+from agentlab.experiments import args
+from agentlab.experiments.early_stopping import config_key, load_rewards
+
+logger = logging.getLogger(__name__)
+
+
+def _run_in_study_dir(exp_dir, n_jobs: int) -> Callable[[list[ExpArgs]], None]:
+    """Run experiments in exp_dir with n_jobs parallel jobs."""
+    from joblib import Parallel, delayed
+
+    from agentlab.experiments.launch_exp import _prepare_exp_args, run_exp
+
+    def run_fn(exp_args_list):
+        _prepare_exp_args(exp_args_list, exp_dir)
+        Parallel(n_jobs=n_jobs, prefer="processes")(
+            delayed(run_exp)(exp_args) for exp_args in exp_args_list
+        )
+
+    return run_fn
+
+
+def _n_rounds(n_configs: int, eta: int) -> int:
+    """Rounds until a single configuration is left: floor(log_eta(n_configs)) + 1,
+    computed with integers since math.log(243, 3) < 5."""
+    n_rounds = 1
+    while eta**n_rounds <= n_configs:
+        n_rounds += 1
+    return n_rounds
+
+
+def successive_halving(
+    agent_args: AbstractAgentArgs,
+    env_args_list: list[EnvArgs],
+    n_configs: int,
+    exp_dir=None,
+    n_jobs: int = 1,
+    run_fn: Callable[[list[ExpArgs]], None] = None,
+    eta: int = 3,
+    min_tasks: int = None,
+    metric: str = "cum_reward",
+    seed: int = None,
+) -> list[tuple[AbstractAgentArgs, float, int]]:
+    """Search the configurations sampled from agent_args with successive halving.
+
+    Args:
+        agent_args: agent args containing args.Distribution objects.
+        env_args_list: tasks on which configurations are evaluated.
+        n_configs: number of configurations to sample. Duplicated samples are
+            evaluated once.
+        exp_dir: directory of the study, used when run_fn is None.
+        n_jobs: number of parallel jobs, used when run_fn is None.
+        run_fn: runs a list of experiments, which then have their results in
+            their exp_dir. Defaults to running them in exp_dir.
+        eta: a fraction 1 / eta of the configurations survives each round,
+            and the number of tasks is multiplied by eta.
+        min_tasks: number of tasks of the first round. Defaults to using all
+            the tasks in the last round.
+        metric: summary info field to maximize.
+        seed: seed of the sampling of configurations and of the task order.
+
+    Returns:
+        (agent_args, mean metric, number of tasks) of each configuration, the
+        best first. Configurations are compared on the tasks of the last round
+        they reached.
+    """
+    if run_fn is None:
+        if exp_dir is None:
+            raise ValueError("exp_dir is required when run_fn is None.")
+        run_fn = _run_in_study_dir(exp_dir, n_jobs)
+
+    rng = np.random.default_rng(seed)
+    configs = {}
+    for sampled_args in args.sample_args(agent_args, n_configs, rng=rng):
+        exp_args = ExpArgs(agent_args=sampled_args, env_args=env_args_list[0])
+        configs.setdefault(config_key(exp_args), sampled_args)
+    if len(configs) < n_configs:
+        logger.info(f"Sampled {len(configs)} distinct configurations out of {n_configs}.")
+
+    env_args_list = [env_args_list[i] for i in rng.permutation(len(env_args_list))]
+    n_rounds = _n_rounds(len(configs), eta)
+    if min_tasks is None:
+        min_tasks = max(1, len(env_args_list) // eta ** (n_rounds - 1))
+
+    survivors = list(configs)
+    done = {key: [] for key in configs}
+    scores = {}
+    for i in range(n_rounds):
+        n_tasks = min(len(env_args_list), min_tasks * eta**i)
+        new_exp_args = []
+        for key in survivors:
+            for env_args in env_args_list[len(done[key]) : n_tasks]:
+                done[key].append(ExpArgs(agent_args=configs[key], env_args=env_args))
+                new_exp_args.append(done[key][-1])
+        logger.info(
+            f"Successive halving round {i + 1}/{n_rounds}: {len(survivors)} configurations "
+            f"on {n_tasks} tasks, {len(new_exp_args)} new experiments."
+        )
+        run_fn(new_exp_args)
+
+        df = load_rewards([exp_args for key in survivors for exp_args in done[key]], metric)
+        means = df.groupby("config")[metric].mean()
+        for key in survivors:
+            # configurations without any result are ranked last
+            scores[key] = (means.get(key, -np.inf), n_tasks)
+        if i + 1 < n_rounds:
+            survivors.sort(key=lambda key: -scores[key][0])
+            survivors = survivors[: max(1, math.ceil(len(survivors) / eta))]
+
+    ranking = sorted(scores, key=lambda key: (-scores[key][1], -scores[key][0]))
+    return [(configs[key], *scores[key]) for key in ranking]
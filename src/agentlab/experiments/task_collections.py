@@ -1,4 +1,7 @@
+from importlib import metadata
+import json
 from logging import warning
+import os
 from pathlib import Path
 import numpy as np
 import pandas as pd
@@ -135,6 +138,91 @@ webgum_tasks = [
 ]
 
 
+# Task lists of the heavy benchmark packages are cached on disk, one manifest
+# per package version, to avoid importing them when building configs.
+TASK_MANIFEST_DIR = Path(
+    os.environ.get("AGENTLAB_TASK_MANIFEST_DIR", Path.home() / ".cache" / "agentlab")
+)
+TASK_MANIFEST_FORMAT = 1
+
+
+def _manifest_path(package: str) -> Path:
+    try:
+        version = metadata.version(package)
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+    return TASK_MANIFEST_DIR / f"{package}-{version}-v{TASK_MANIFEST_FORMAT}.json"
+
+
+def _cached_task_info(package: str, key: str, build_fn: callable):
+    """Return the entry `key` of the task manifest of `package`, building it
+    with `build_fn` if it is missing. The manifest is invalidated when the
+    version of the package changes."""
+    path = _manifest_path(package)
+    try:
+        manifest = json.loads(path.read_text())
+    except (OSError, json.JSONDecodeError):
+        manifest = {}
+    if key in manifest:
+        return manifest[key]
+
+    t0 = t.time()
+    manifest[key] = build_fn()
+    logger.info(f"Built the task manifest entry {key} of {package} in {t.time() - t0:.2f}s.")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(manifest))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not save the task manifest {path}: {e}")
+    return manifest[key]
+
+
+def _workarena_tasks(filter: str, meta_seed: int, n_seed_l1: int) -> list[tuple[str, int]]:
+    def build():
+        from browsergym.workarena import get_all_tasks_agents
+
+        return [
+            (task.get_task_id(), int(seed))
+            for task, seed in get_all_tasks_agents(
+                filter=filter, meta_seed=meta_seed, n_seed_l1=n_seed_l1
+            )
+        ]
+
+    key = f"tasks:{filter}:{meta_seed}:{n_seed_l1}"
+    return [tuple(task) for task in _cached_task_info("browsergym-workarena", key, build)]
+
+
+def _workarena_atomic_task_ids() -> list[str]:
+    def build():
+        from browsergym.workarena import ATOMIC_TASKS
+
+        return [task.get_task_id() for task in ATOMIC_TASKS]
+
+    return _cached_task_info("browsergym-workarena", "atomic_task_ids", build)
+
+
+def get_task_category_map() -> dict[str, str]:
+    """Category of each WorkArena task, see browsergym.workarena.TASK_CATEGORY_MAP."""
+
+    def build():
+        from browsergym.workarena import TASK_CATEGORY_MAP
+
+        return TASK_CATEGORY_MAP
+
+    return _cached_task_info("browsergym-workarena", "task_category_map", build)
+
+
+def _webarena_task_ids() -> list[str]:
+    def build():
+        from browsergym.webarena import ALL_WEBARENA_TASK_IDS
+
+        return list(ALL_WEBARENA_TASK_IDS)
+
+    return _cached_task_info("browsergym-webarena", "task_ids", build)
+
+
 def get_benchmark_env_args(
     benchmark_name: str, meta_seed=42, max_steps=None, n_repeat=None
 ) -> list[EnvArgs]:
@@ -185,33 +273,22 @@ def get_benchmark_env_args(
             n_repeat = 1
 
     if benchmark_name.startswith("workarena"):
-        t0 = t.time()
-        from browsergym.workarena import ATOMIC_TASKS, get_all_tasks_agents
-
-        dt = t.time() - t0
-        print(f"done importing workarena, took {dt:.2f} seconds")
-
         if len(filters) < 2:
             raise ValueError(f"You must specify the sub set of workarena, e.g.: workarena.l2.")
 
         if benchmark_name == "workarena.l1.sort":
-            task_names = [task.get_task_id() for task in ATOMIC_TASKS]
+            task_names = _workarena_atomic_task_ids()
             task_names = [task for task in task_names if "sort" in task]
             env_args_list = _make_env_args(task_names, max_steps, n_repeat, rng)
 
         else:
-            for task, seed in get_all_tasks_agents(
-                filter=".".join(filters[1:]), meta_seed=meta_seed, n_seed_l1=n_repeat
-            ):
-                task_name = task.get_task_id()
+            for task_name, seed in _workarena_tasks(".".join(filters[1:]), meta_seed, n_repeat):
                 env_args_list.append(
                     EnvArgs(task_name=task_name, task_seed=seed, max_steps=max_steps)
                 )
 
     elif benchmark_name == "webarena":
-        from browsergym.webarena import ALL_WEBARENA_TASK_IDS
-
-        env_args_list = _make_env_args(ALL_WEBARENA_TASK_IDS, max_steps, n_repeat, rng)
+        env_args_list = _make_env_args(_webarena_task_ids(), max_steps, n_repeat, rng)
     elif benchmark_name == "miniwob":
         env_args_list = _make_env_args(MINIWOB_ALL, max_steps, n_repeat, rng)
     else:
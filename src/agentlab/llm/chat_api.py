@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 import json
+import os
 import re
+from typing import Literal
 
 from langchain.schema import AIMessage
 import logging
@@ -9,6 +11,8 @@ import logging
 from langchain_openai import ChatOpenAI
 from dataclasses import dataclass
 
+from agentlab.llm.prompt_templates import get_prompt_template
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
 
@@ -104,3 +108,374 @@ class OpenAIChatModelArgs(ChatModelArgs):
 
     def close_server(self):
         pass
+
+
+class TGIChatModel:
+    """Chat model querying a self-hosted text-generation-inference server.
+
+    If `regex` is set, generation is constrained to match it.
+    """
+
+    def __init__(self, model_name, model_url, temperature, max_new_tokens):
+        from huggingface_hub import InferenceClient
+
+        self.client = InferenceClient(model=model_url, token=os.environ.get("TGI_TOKEN"))
+        self.prompt_template = get_prompt_template(model_name)
+        self.temperature = temperature
+        self.max_new_tokens = max_new_tokens
+        self.regex = None
+
+    def invoke(self, messages):
+        prompt = self.prompt_template.construct_prompt(messages)
+        grammar = {"type": "regex", "value": self.regex} if self.regex else None
+        answer = self.client.text_generation(
+            prompt,
+            max_new_tokens=self.max_new_tokens,
+            temperature=self.temperature or None,  # TGI doesn't accept 0
+            grammar=grammar,
+        )
+        return AIMessage(content=answer)
+
+    def __call__(self, messages):
+        return self.invoke(messages)
+
+
+class VLLMChatModel:
+    """Chat model querying the OpenAI compatible API of a self-hosted vLLM
+    server.
+
+    If `regex` is set, generation is constrained to match it.
+    """
+
+    def __init__(self, model_name, model_url, temperature, max_new_tokens):
+        self.chat = ChatOpenAI(
+            model_name=model_name,
+            base_url=f"{model_url.rstrip('/')}/v1",
+            api_key=os.environ.get("VLLM_API_KEY", "EMPTY"),
+            temperature=temperature,
+            max_tokens=max_new_tokens,
+        )
+        self.regex = None
+
+    def invoke(self, messages):
+        if self.regex:
+            return self.chat.invoke(messages, extra_body={"guided_regex": self.regex})
+        return self.chat.invoke(messages)
+
+    def __call__(self, messages):
+        return self.invoke(messages)
+
+
+@dataclass
+class SelfHostedChatModelArgs(ChatModelArgs):
+    """Model served on `model_url` by TGI or vLLM. Both backends support
+    regex constrained decoding, see GenericPromptFlags.use_constrained_decoding."""
+
+    backend: Literal["tgi", "vllm"] = "tgi"
+    vision_support: bool = False
+
+    def make_chat_model(self):
+        if self.model_url is None:
+            raise ValueError(f"model_url is not set for {self.model_name}.")
+        chat_model_cls = {"tgi": TGIChatModel, "vllm": VLLMChatModel}[self.backend]
+        return chat_model_cls(
+            model_name=self.model_name,
+            model_url=self.model_url,
+            temperature=self.temperature,
+            max_new_tokens=self.max_new_tokens,
+        )
+
+    def prepare_server(self, registry):
+        pass
+
+    def close_server(self):
+        pass
+
+
+class CascadeChatModel:
+    """Chat model that queries a list of chat models, from the cheapest to the
+    strongest.
+
+    Each step starts with the tier given to `new_step`. Every further call
+    within the same step, e.g. a retry after a parsing error, escalates to the
+    next tier. Calls and tokens are counted per tier.
+
+    Setting `regex` constrains the tiers that support constrained decoding.
+    It is not an attribute of the cascade if no tier supports it.
+    """
+
+    def __init__(self, chat_models: list):
+        self.chat_models = chat_models
+        self.tier = 0
+        self.stats = {}
+
+    def _regex_models(self) -> list:
+        models = [chat_model for chat_model in self.chat_models if hasattr(chat_model, "regex")]
+        if not models:
+            raise AttributeError("No tier of the cascade supports constrained decoding.")
+        return models
+
+    @property
+    def regex(self):
+        return self._regex_models()[0].regex
+
+    @regex.setter
+    def regex(self, regex):
+        for chat_model in self._regex_models():
+            chat_model.regex = regex
+
+    def new_step(self, min_tier=0):
+        self.tier = min(min_tier, len(self.chat_models) - 1)
+        self.stats = {}
+
+    def invoke(self, messages):
+        tier = self.tier
+        answer = self.chat_models[tier].invoke(messages)
+
+        token_usage = getattr(answer, "response_metadata", {}).get("token_usage", {}) or {}
+        for key, val in (("calls", 1), ("tokens", token_usage.get("total_tokens", 0))):
+            stat_key = f"cascade_tier_{tier}_{key}"
+            self.stats[stat_key] = self.stats.get(stat_key, 0) + val
+        self.stats["cascade_max_tier"] = max(self.stats.get("cascade_max_tier", 0), tier)
+
+        self.tier = min(tier + 1, len(self.chat_models) - 1)
+        return answer
+
+    def __call__(self, messages):
+        return self.invoke(messages)
+
+
+@dataclass
+class CascadeChatModelArgs(ChatModelArgs):
+    """Cascade of chat models, from the cheapest to the strongest.
+
+    The agent escalates to the next tier on parsing errors and, depending on
+    the flags, when the previous action raised an error or when the same action
+    is repeated. The prompt is tokenized with the first tier and fitted to the
+    smallest context of all tiers.
+    """
+
+    model_name: str = None
+    max_total_tokens: int = None
+    max_input_tokens: int = None
+    max_new_tokens: int = None
+    tiers: list[ChatModelArgs] = None
+    escalate_on_action_error: bool = True
+    escalate_on_repeated_action: bool = True
+
+    def __post_init__(self):
+        if not self.tiers:
+            raise ValueError("CascadeChatModelArgs requires at least one tier.")
+        if self.model_name is None:
+            self.model_name = self.tiers[0].model_name
+        for attr in ("max_total_tokens", "max_input_tokens", "max_new_tokens"):
+            if getattr(self, attr) is None:
+                values = [getattr(tier, attr) for tier in self.tiers]
+                values = [val for val in values if val is not None]
+                setattr(self, attr, min(values) if values else None)
+
+    @property
+    def vision_support(self):
+        return all(getattr(tier, "vision_support", False) for tier in self.tiers)
+
+    def make_chat_model(self):
+        return CascadeChatModel([tier.make_chat_model() for tier in self.tiers])
+
+    def prepare_server(self, registry):
+        for tier in self.tiers:
+            tier.prepare_server(registry)
+
+    def close_server(self):
+        for tier in self.tiers:
+            tier.close_server()
+
+    def cleanup(self):
+        for tier in self.tiers:
+            tier.cleanup()
+
+    def key(self):
+        return json.dumps([json.loads(tier.key()) for tier in self.tiers])
+
+
+LLM_CASSETTE_FILE = "llm_cassette.jsonl"
+
+
+def _messages_to_json(messages) -> list[dict]:
+    return [{"role": message.type, "content": message.content} for message in messages]
+
+
+def _line_similarity(messages_a: list[dict], messages_b: list[dict]) -> float:
+    """Jaccard similarity between the sets of lines of two prompts."""
+    lines_a, lines_b = set(), set()
+    for lines, messages in ((lines_a, messages_a), (lines_b, messages_b)):
+        for message in messages:
+            content = message["content"]
+            if not isinstance(content, str):
+                content = json.dumps(content, indent=0)
+            lines.update(content.splitlines())
+    if not lines_a and not lines_b:
+        return 1.0
+    return len(lines_a & lines_b) / len(lines_a | lines_b)
+
+
+class CassetteChatModel:
+    """Chat model that records its requests and responses into a cassette and
+    can replay them instead of querying the model.
+
+    Each call is appended to `cassette_path` as one json line, so that the
+    cassette of an episode is complete even if it crashes. Recorded calls are
+    loaded from `replay_path` and consumed in order.
+
+    Args:
+        chat_model: the chat model queried when recording or on a cache miss.
+        cassette_path: jsonl file where calls are recorded. None to disable.
+        replay_path: jsonl file of a previous recording. None to disable.
+        mode: "record" always queries the model. "replay" only reads from the
+            cassette and raises on a miss. "auto" replays hits and queries the
+            model on misses.
+        match: "strict" requires identical messages. "fuzzy" accepts the
+            recorded call whose prompt has the most lines in common with the
+            request, if the similarity is above `fuzzy_threshold`.
+    """
+
+    def __init__(
+        self,
+        chat_model,
+        cassette_path=None,
+        replay_path=None,
+        mode: Literal["record", "replay", "auto"] = "auto",
+        match: Literal["strict", "fuzzy"] = "strict",
+        fuzzy_threshold: float = 0.8,
+    ):
+        self.chat_model = chat_model
+        self.cassette_path = cassette_path
+        self.mode = mode
+        self.match = match
+        self.fuzzy_threshold = fuzzy_threshold
+        self.recorded_calls = []
+        if mode != "record" and replay_path is not None and os.path.exists(replay_path):
+            with open(replay_path) as f:
+                self.recorded_calls = [json.loads(line) for line in f if line.strip()]
+        self.n_hits = 0
+        self.n_misses = 0
+
+    # constrained decoding applies to the wrapped model, if it supports it
+    @property
+    def regex(self):
+        return self.chat_model.regex
+
+    @regex.setter
+    def regex(self, regex):
+        if not hasattr(self.chat_model, "regex"):
+            raise AttributeError(
+                f"{type(self.chat_model).__name__} does not support constrained decoding."
+            )
+        self.chat_model.regex = regex
+
+    def _find_recorded_call(self, messages: list[dict]):
+        candidates = [
+            (i, call) for i, call in enumerate(self.recorded_calls) if not call.get("_consumed")
+        ]
+        for i, call in candidates:
+            if call["messages"] == messages:
+                return i
+        if self.match == "fuzzy":
+            best_i, best_score = None, self.fuzzy_threshold
+            for i, call in candidates:
+                score = _line_similarity(call["messages"], messages)
+                if score >= best_score and (best_i is None or score > best_score):
+                    best_i, best_score = i, score
+            return best_i
+        return None
+
+    def invoke(self, messages):
+        json_messages = _messages_to_json(messages)
+
+        i = None if self.mode == "record" else self._find_recorded_call(json_messages)
+        if i is not None:
+            self.n_hits += 1
+            call = self.recorded_calls[i]
+            call["_consumed"] = True
+            answer = AIMessage(content=call["content"], response_metadata=call["response_metadata"])
+        elif self.mode == "replay":
+            raise ValueError(
+                f"No recorded LLM call matches the request (match={self.match}) "
+                f"after {self.n_hits} replayed calls."
+            )
+        else:
+            self.n_misses += 1
+            answer = self.chat_model.invoke(messages)
+
+        if self.cassette_path is not None:
+            response_metadata = getattr(answer, "response_metadata", {}) or {}
+            record = {
+                "messages": json_messages,
+                "content": answer.content,
+                "response_metadata": json.loads(json.dumps(response_metadata, default=str)),
+            }
+            with open(self.cassette_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return answer
+
+    def __call__(self, messages):
+        return self.invoke(messages)
+
+
+@dataclass
+class CassetteChatModelArgs(ChatModelArgs):
+    """Wraps `chat_model_args` with a record/replay cassette of its LLM calls.
+
+    The launcher sets `cassette_path` to the cassette file of each experiment
+    directory and, when relaunching, `replay_path` to the cassette of the
+    previous run of the same experiment. `replay_root` can point to another
+    study whose cassettes are replayed, matched by experiment name.
+    """
+
+    model_name: str = None
+    max_total_tokens: int = None
+    max_input_tokens: int = None
+    max_new_tokens: int = None
+    chat_model_args: ChatModelArgs = None
+    mode: Literal["record", "replay", "auto"] = "auto"
+    match: Literal["strict", "fuzzy"] = "strict"
+    fuzzy_threshold: float = 0.8
+    cassette_path: str = None
+    replay_path: str = None
+    replay_root: str = None
+
+    def __post_init__(self):
+        if self.chat_model_args is None:
+            raise ValueError("CassetteChatModelArgs requires chat_model_args.")
+        for attr in ("model_name", "max_total_tokens", "max_input_tokens", "max_new_tokens"):
+            if getattr(self, attr) is None:
+                setattr(self, attr, getattr(self.chat_model_args, attr))
+        if self.max_trunk_itr is None:
+            self.max_trunk_itr = self.chat_model_args.max_trunk_itr
+
+    @property
+    def vision_support(self):
+        return getattr(self.chat_model_args, "vision_support", False)
+
+    def make_chat_model(self):
+        return CassetteChatModel(
+            self.chat_model_args.make_chat_model(),
+            cassette_path=self.cassette_path,
+            replay_path=self.replay_path,
+            mode=self.mode,
+            match=self.match,
+            fuzzy_threshold=self.fuzzy_threshold,
+        )
+
+    def prepare_server(self, registry):
+        # no server is needed if everything is replayed
+        if self.mode != "replay":
+            self.chat_model_args.prepare_server(registry)
+
+    def close_server(self):
+        self.chat_model_args.close_server()
+
+    def cleanup(self):
+        self.chat_model_args.cleanup()
+
+    def key(self):
+        return self.chat_model_args.key()
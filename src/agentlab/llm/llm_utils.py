@@ -413,6 +413,34 @@ def extract_code_blocks(text) -> list[tuple[str, str]]:
     return [(match[0], match[1].strip()) for match in matches]
 
 
+def close_unclosed_html_tags(text, keys):
+    """Close the tags in `keys` that were opened but never closed.
+
+    The closing tag is inserted right before the next opening tag among `keys`,
+    or at the end of the text.
+    """
+    for key in keys:
+        opening, closing = f"<{key}>", f"</{key}>"
+        start = text.rfind(opening)
+        if start < 0 or closing in text[start:]:
+            continue
+        content_start = start + len(opening)
+        next_tags = [text.find(f"<{other}>", content_start) for other in keys]
+        next_tags = [pos for pos in next_tags if pos >= 0]
+        end = min(next_tags) if next_tags else len(text)
+        text = f"{text[:end].rstrip()}\n{closing}\n{text[end:]}"
+    return text
+
+
+def keep_last_html_tag(text, key):
+    """Remove all but the last instance of the tag `key`."""
+    pattern = re.compile(f"<{key}>.*?</{key}>", re.DOTALL)
+    matches = list(pattern.finditer(text))
+    for match in reversed(matches[:-1]):
+        text = text[: match.start()] + text[match.end() :]
+    return text
+
+
 def parse_html_tags_raise(text, keys=(), optional_keys=(), merge_multiple=False):
     """A version of parse_html_tags that raises an exception if the parsing is not successful."""
     content_dict, valid, retry_message = parse_html_tags(
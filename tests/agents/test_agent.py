@@ -1,7 +1,10 @@
+from dataclasses import dataclass, field
 import tempfile
+import pytest
+from langchain.schema import AIMessage
 from agentlab.agents.generic_agent.generic_agent import GenericAgentArgs
 from agentlab.agents.generic_agent.generic_agent_prompt import BASIC_FLAGS
-from agentlab.llm.chat_api import ChatModelArgs
+from agentlab.llm.chat_api import CascadeChatModelArgs, CassetteChatModelArgs, ChatModelArgs
 from browsergym.experiments.loop import EnvArgs, ExpArgs
 from agentlab.experiments import launch_exp
 from agentlab.analyze import inspect_results
@@ -45,5 +48,169 @@ def test_generic_agent():
             assert result_record[key][0] == target_val
 
 
+class FakeLLM:
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def invoke(self, messages):
+        self.calls.append(messages)
+        return AIMessage(content=self.answers.pop(0))
+
+
+@dataclass
+class FakeLLMArgs:
+    answers: list = field(default_factory=list)
+    model_name: str = "test/fake"
+    max_total_tokens: int = None
+    max_input_tokens: int = None
+    max_new_tokens: int = None
+    max_trunk_itr: int = None
+    vision_support: bool = False
+
+    def make_chat_model(self):
+        return FakeLLM(self.answers)
+
+
+class FakeConstrainedLLM(FakeLLM):
+    regex = None
+
+
+@dataclass
+class FakeConstrainedLLMArgs(FakeLLMArgs):
+    def make_chat_model(self):
+        return FakeConstrainedLLM(self.answers)
+
+
+OBS = {
+    "goal": "click the button",
+    "chat_messages": [],
+    "pruned_html": "<button bid='a1'>OK</button>",
+    "axtree_txt": "[a1] button 'OK'",
+    "focused_element_bid": None,
+    "last_action_error": "",
+}
+
+
+def test_repair_model_avoids_full_retry():
+    agent = GenericAgentArgs(
+        chat_model_args=FakeLLMArgs(answers=["I will click on OK.", "<action>click('a1')</action>"]),
+        flags=BASIC_FLAGS.copy(),
+        repair_model_args=FakeLLMArgs(answers=["<action>\nclick('a1')\n</action>"]),
+    ).make_agent()
+
+    action, agent_info = agent.get_action(OBS)
+
+    assert action == "click('a1')"
+    assert len(agent.chat_llm.calls) == 1  # no full retry
+    assert len(agent.repair_llm.calls) == 1
+    repair_prompt = agent.repair_llm.calls[0][0].content
+    assert "I will click on OK." in repair_prompt
+    assert "click the button" not in repair_prompt  # the main prompt is not resent
+
+
+def test_repair_model_errors_fall_back_to_retry():
+    agent = GenericAgentArgs(
+        chat_model_args=FakeLLMArgs(answers=["I will click on OK.", "<action>click('a1')</action>"]),
+        flags=BASIC_FLAGS.copy(),
+        # no answer left, the repair model raises an error
+        repair_model_args=FakeLLMArgs(answers=[]),
+    ).make_agent()
+
+    action, agent_info = agent.get_action(OBS)
+
+    assert action == "click('a1')"
+    assert len(agent.chat_llm.calls) == 2  # full retry with the main model
+    assert len(agent.repair_llm.calls) == 1
+
+
+def test_summary_model_errors_are_not_raised():
+    agent = GenericAgentArgs(
+        chat_model_args=FakeLLMArgs(),
+        flags=BASIC_FLAGS.copy(),
+        # no answer left, the summary model raises an error
+        summary_model_args=FakeLLMArgs(answers=[]),
+    ).make_agent()
+
+    assert agent._summarize_history("## step 0\naction: click('a1')") is None
+
+
+def test_cascade_escalates_on_parse_error_and_action_error():
+    cheap = FakeLLMArgs(answers=["no action here", "<action>click('a1')</action>"])
+    strong = FakeLLMArgs(answers=["<action>click('a1')</action>", "<action>click('a1')</action>"])
+    chat_model_args = CascadeChatModelArgs(tiers=[cheap, strong], escalate_on_repeated_action=False)
+    agent = GenericAgentArgs(chat_model_args=chat_model_args, flags=BASIC_FLAGS.copy()).make_agent()
+
+    # parse error with the cheap model, the retry is sent to the strong model
+    action, agent_info = agent.get_action(OBS)
+    assert action == "click('a1')"
+    assert agent_info["stats"]["cascade_tier_0_calls"] == 1
+    assert agent_info["stats"]["cascade_tier_1_calls"] == 1
+
+    # no problem, stay with the cheap model
+    action, agent_info = agent.get_action(OBS)
+    assert agent_info["stats"]["cascade_max_tier"] == 0
+
+    # the previous action raised an error, start with the strong model
+    action, agent_info = agent.get_action(dict(OBS, last_action_error="TimeoutError"))
+    assert "cascade_tier_0_calls" not in agent_info["stats"]
+    assert agent_info["stats"]["cascade_tier_1_calls"] == 1
+
+
+def test_cassette_replays_recorded_calls():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cassette_path = f"{tmp_dir}/llm_cassette.jsonl"
+        recorder_args = CassetteChatModelArgs(
+            chat_model_args=FakeLLMArgs(answers=["<action>click('a1')</action>"]),
+            mode="record",
+            cassette_path=cassette_path,
+        )
+        agent = GenericAgentArgs(chat_model_args=recorder_args, flags=BASIC_FLAGS.copy()).make_agent()
+        action, _ = agent.get_action(OBS)
+        assert action == "click('a1')"
+
+        def make_replay_agent(match):
+            chat_model_args = CassetteChatModelArgs(
+                chat_model_args=FakeLLMArgs(answers=[]),  # the model is never queried
+                mode="replay",
+                match=match,
+                replay_path=cassette_path,
+            )
+            return GenericAgentArgs(chat_model_args=chat_model_args, flags=BASIC_FLAGS.copy()).make_agent()
+
+        agent = make_replay_agent("strict")
+        action, _ = agent.get_action(OBS)
+        assert action == "click('a1')"
+        assert agent.chat_llm.n_hits == 1
+
+        # a slightly different observation only matches with fuzzy matching
+        obs = dict(OBS, axtree_txt="[a1] button 'Ok'")
+        with pytest.raises(ValueError, match="No recorded LLM call"):
+            make_replay_agent("strict").get_action(obs)
+        action, _ = make_replay_agent("fuzzy").get_action(obs)
+        assert action == "click('a1')"
+
+
+def test_constrained_decoding_reaches_wrapped_models():
+    flags = BASIC_FLAGS.copy()
+    flags.use_constrained_decoding = True
+
+    chat_model_args = CascadeChatModelArgs(tiers=[FakeLLMArgs(), FakeConstrainedLLMArgs()])
+    agent = GenericAgentArgs(chat_model_args=chat_model_args, flags=flags).make_agent()
+    cheap, strong = agent.chat_llm.chat_models
+    assert strong.regex is not None
+    assert agent.chat_llm.regex == strong.regex
+    assert not hasattr(cheap, "regex")
+
+    chat_model_args = CassetteChatModelArgs(chat_model_args=FakeConstrainedLLMArgs())
+    agent = GenericAgentArgs(chat_model_args=chat_model_args, flags=flags).make_agent()
+    assert agent.chat_llm.chat_model.regex is not None
+
+    # no wrapped model supports it
+    chat_model_args = CassetteChatModelArgs(chat_model_args=FakeLLMArgs())
+    with pytest.warns(UserWarning, match="does not support constrained decoding"):
+        GenericAgentArgs(chat_model_args=chat_model_args, flags=flags).make_agent()
+
+
 if __name__ == "__main__":
     test_generic_agent()
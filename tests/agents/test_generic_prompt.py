@@ -7,7 +7,7 @@ from agentlab.agents.generic_agent.generic_agent_prompt import (
 )
 import pytest
 
-from agentlab.llm.llm_utils import count_tokens
+from agentlab.llm.llm_utils import ParseError, count_tokens
 
 
 html_template = """
@@ -135,10 +135,10 @@ FLAG_EXPECTED_PROMPT = [
         "use_memory",
         ("<memory>", "</memory>", "memory A", "memory B"),
     ),
-    # (
-    #     "obs.use_diff",
-    #     ("diff:", "- Step 2", "Identical"),
-    # ),
+    (
+        "obs.use_diff",
+        ("diff:", "- Step 2", "Identical"),
+    ),
     (
         "use_concrete_example",
         ("# Concrete Example", "<action>\nclick('a324')"),
@@ -180,6 +180,235 @@ def test_shrinking_observation():
     assert "</html>" not in new_prompt
 
 
+def test_history_summarization():
+    flags = deepcopy(ALL_TRUE_FLAGS.obs)
+    flags.summarize_history = True
+    n_steps = 7
+    obs_history = [OBS_HISTORY[i % len(OBS_HISTORY)] for i in range(n_steps + 1)]
+    actions = [f"click('{i}')" for i in range(n_steps)]
+    thoughts = [f"long thought {i}" for i in range(n_steps)]
+
+    calls = []
+
+    def summarizer(text):
+        calls.append(text)
+        return f"summary of {text.count('## step')} steps"
+
+    summary_cache = {}
+    history = dp.History(
+        obs_history,
+        actions,
+        None,
+        thoughts,
+        flags,
+        summarizer=summarizer,
+        summary_cache=summary_cache,
+    )
+
+    assert history.summarize()  # collapse the oldest half
+    assert "long thought 0" not in history.prompt
+    assert "long thought 6" in history.prompt
+    assert "action: click('0')" in history.prompt
+
+    while history.summarize():
+        pass
+    prompt = history.prompt
+    assert "## steps 0 to 4 (summary)\nsummary of 5 steps" in prompt
+    assert "## step 5\naction: click('5')" in prompt
+    assert "long thought" not in prompt
+    assert len(calls) == 1
+
+    # the summary is reused by the next step
+    history = dp.History(
+        obs_history, actions, None, thoughts, flags, summarizer=summarizer, summary_cache=summary_cache
+    )
+    while history.summarize():
+        pass
+    assert len(calls) == 1
+
+
+def test_failed_summary_keeps_collapsed_steps():
+    flags = deepcopy(ALL_TRUE_FLAGS.obs)
+    flags.summarize_history = True
+    n_steps = 7
+    obs_history = [OBS_HISTORY[i % len(OBS_HISTORY)] for i in range(n_steps + 1)]
+    actions = [f"click('{i}')" for i in range(n_steps)]
+    thoughts = [f"long thought {i}" for i in range(n_steps)]
+    calls = []
+
+    def failing_summarizer(text):
+        calls.append(text)
+        return None
+
+    history = dp.History(
+        obs_history, actions, None, thoughts, flags, summarizer=failing_summarizer
+    )
+    while history.summarize():
+        pass
+    for _ in range(5):
+        history.shrink()
+
+    assert len(calls) == 1  # not retried at each shrink
+    assert "(summary)" not in history.prompt
+    assert "## step 0\naction: click('0')" in history.prompt
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        "<think>\nI will click.\n</think>\n<action>\nclick('a1')",
+        "<action>\nclick('a2')\n</action>\n<action>\nclick('a1')\n</action>",
+        "<action>\nI will click on the button:\nclick('a1')\n</action>",
+        "<action>\n```python\nclick('a1')\n```\n</action>",
+    ],
+)
+def test_repair_and_parse_answer(answer):
+    flags = deepcopy(BASIC_FLAGS)
+    flags.action.is_strict = True
+    prompt = MainPrompt(
+        action_set=dp.make_action_set(flags.action),
+        obs_history=OBS_HISTORY,
+        actions=ACTIONS,
+        memories=MEMORIES,
+        thoughts=THOUGHTS,
+        previous_plan="1- think\n2- do it",
+        step=2,
+        flags=flags,
+    )
+
+    with pytest.raises(ParseError):
+        prompt._parse_answer(answer)
+
+    ans_dict = prompt.repair_and_parse_answer(answer)
+    assert ans_dict["action"] == "click('a1')"
+
+
+def test_answer_regex():
+    import re
+
+    action_set = dp.make_action_set(dp.ActionFlags(multi_actions=True))
+    regex = dp.make_answer_regex(action_set, tags=["think", "plan", "step"])
+
+    answer = """<think>
+I will fill the form, then submit it.
+</think>
+
+<plan>
+1. fill
+2. submit
+</plan>
+
+<step>1</step>
+
+<action>
+fill('a12', 'John')
+click('a13')
+</action>"""
+    assert re.fullmatch(regex, answer)
+    assert not re.fullmatch(regex, answer.replace("click(", "rm_rf("))
+    assert not re.fullmatch(regex, answer.replace("</think>", ""))
+
+    single_action_set = dp.make_action_set(dp.ActionFlags(multi_actions=False))
+    regex = dp.make_answer_regex(single_action_set, tags=[])
+    assert re.fullmatch(regex, "<action>\nclick('a13')\n</action>")
+    assert not re.fullmatch(regex, "<action>\nclick('a13')\nclick('a14')\n</action>")
+
+
+def test_allocate_token_budget():
+    sizes = {"obs": 1000, "step_0": 300, "step_1": 50}
+    priorities = {"obs": 2.0, "step_0": 1.0, "step_1": 1.0}
+
+    quotas = dp.allocate_token_budget(sizes, priorities, budget=950)
+
+    assert quotas["step_1"] == 50  # small enough to be kept as is
+    assert quotas["obs"] == 600
+    assert quotas["step_0"] == 300
+    assert dp.allocate_token_budget(sizes, priorities, budget=2000) == sizes
+    assert quotas == dp.allocate_token_budget(sizes, priorities, budget=950)
+
+
+def test_shrinking_observation_by_budget():
+    flags = deepcopy(BASIC_FLAGS)
+    flags.obs.use_html = True
+    flags.use_token_budget = True
+
+    prompt_maker = MainPrompt(
+        action_set=dp.HighLevelActionSet(),
+        obs_history=OBS_HISTORY,
+        actions=ACTIONS,
+        memories=MEMORIES,
+        thoughts=THOUGHTS,
+        previous_plan="1- think\n2- do it",
+        step=2,
+        flags=flags,
+    )
+
+    prompt = prompt_maker.prompt
+    new_prompt = dp.fit_tokens_by_budget(
+        prompt_maker, max_prompt_tokens=count_tokens(prompt) - 1, max_iterations=7
+    )
+    assert count_tokens(new_prompt) < count_tokens(prompt)
+    assert "</html>" not in new_prompt
+    assert set(prompt_maker.token_budget["quotas"]) == {"obs", "history_step_0", "history_step_1"}
+
+
+class WordsElement(dp.Shrinkable):
+    """Halves its words at each shrink, after `delay` calls, if it can shrink."""
+
+    def __init__(self, n_words, can_shrink=True, delay=0):
+        super().__init__()
+        self.words = ["word"] * n_words
+        self.can_shrink = can_shrink
+        self.delay = delay
+        self.shrink_calls = 0
+
+    def shrink(self):
+        self.shrink_calls += 1
+        if self.can_shrink and self.shrink_calls > self.delay:
+            self.words = self.words[: len(self.words) // 2]
+
+    @property
+    def _prompt(self):
+        return " ".join(self.words) + "\n"
+
+
+class WordsPrompt(dp.Shrinkable):
+    def __init__(self, **elements):
+        super().__init__()
+        self.elements = elements
+
+    def shrink(self):
+        for element in self.elements.values():
+            element.shrink()
+
+    def budget_elements(self):
+        return [(name, element, 1.0) for name, element in self.elements.items()]
+
+    @property
+    def _prompt(self):
+        return "header\n" + "".join(element.prompt for element in self.elements.values())
+
+
+def test_fit_tokens_by_budget_redistributes_unused_quota(monkeypatch):
+    n_calls = []
+
+    def count_words(text, model=None):
+        n_calls.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(dp, "count_tokens", count_words)
+    prompt = WordsPrompt(stuck=WordsElement(100, can_shrink=False), obs=WordsElement(100, delay=3))
+
+    new_prompt = dp.fit_tokens_by_budget(prompt, max_prompt_tokens=160, additional_prompts=[])
+
+    # the element that can't shrink keeps its size, the other one shrinks
+    # to the rest of the budget but no further
+    assert len(new_prompt.split()) == 151
+    assert prompt.token_budget["final_sizes"] == {"stuck": 100, "obs": 50}
+    # the prompt, each element, and the only shrink that changed the obs
+    assert len(n_calls) == 4
+
+
 @pytest.mark.parametrize("flag_name, expected_prompts", FLAG_EXPECTED_PROMPT)
 def test_main_prompt_elements_gone_one_at_a_time(flag_name: str, expected_prompts):
 
@@ -217,6 +446,71 @@ def test_main_prompt_elements_gone_one_at_a_time(flag_name: str, expected_prompt
         assert expected not in prompt
 
 
+def test_diff_matches_elements_by_bid():
+    previous = "[a1] button 'OK'\n\t[a2] StaticText 'Hello'\n\t[a3] link 'Home'"
+    new = "[a1] button 'OK'\n\t[a3] link 'Home', focused\n\t[a4] textbox 'Name'"
+
+    header, diff_lines = dp.diff(previous, new)
+
+    assert header == "1 elements added, 1 removed and 1 changed:"
+    assert diff_lines == [
+        "- [a2] StaticText 'Hello'",
+        "+ [a4] textbox 'Name'",
+        "~ [a3] link 'Home', focused",
+    ]
+    assert dp.diff(previous, previous) == ("Identical", [])
+
+
+def test_shrinking_diff():
+    previous = "\n".join(f"[a{i}] button 'b{i}'" for i in range(10))
+    new = "\n".join(f"[a{i}] button 'c{i}'" for i in range(10))
+    diff_element = dp.Diff(previous, new, max_line_diff=5, shrink_speed=2)
+
+    assert "5 changes not shown" in diff_element.prompt
+    diff_element.shrink()
+    assert "7 changes not shown" in diff_element.prompt
+
+
+AX_TREE = """\
+[1] RootWebArea 'Incidents'
+\t[2] navigation 'Menu'
+\t\t[3] link 'Home'
+\t\t[4] link 'Settings'
+\t[5] table 'Incident list'
+\t\t[6] row 'INC0012 printer is broken'
+\t\t[7] row 'INC0013 laptop battery'
+\t[8] contentinfo 'Footer'
+\t\t[9] link 'Privacy policy'"""
+
+
+def test_relevance_pruning_keeps_relevant_subtrees_and_ancestors():
+    lines = AX_TREE.splitlines()
+    scores = dp.bm25_scores(lines, "Open the incident about the broken printer")
+
+    kept = dp.prune_ax_tree_by_relevance(lines, scores, n_keep=4)
+    kept_lines = [line.strip() for line, keep in zip(lines, kept) if keep]
+
+    assert "[6] row 'INC0012 printer is broken'" in kept_lines
+    assert "[5] table 'Incident list'" in kept_lines
+    assert "[1] RootWebArea 'Incidents'" in kept_lines
+    assert "[9] link 'Privacy policy'" not in kept_lines
+    assert len(kept_lines) <= 4
+
+
+def test_ax_tree_relevance_shrink():
+    ax_tree = dp.AXTree(
+        AX_TREE,
+        visible_elements_only=False,
+        relevance_query="broken printer",
+    )
+    for _ in range(ax_tree.start_trunkate_iteration + 1):
+        ax_tree.shrink()
+
+    assert "printer is broken" in ax_tree.prompt
+    assert "Privacy policy" not in ax_tree.prompt
+    assert "lines least relevant to the goal" in ax_tree.prompt
+
+
 def test_main_prompt_elements_present():
     # Make sure the flag is enabled
 
@@ -0,0 +1,28 @@
+from dataclasses import dataclass, field
+
+from browsergym.experiments.loop import AbstractAgentArgs, EnvArgs, ExpArgs
+
+
+@dataclass
+class FakeChatModelArgs:
+    model_name: str = "fake_model"
+    model_url: str = None
+    temperature: float = 0.1
+
+
+@dataclass
+class FakeAgentArgs(AbstractAgentArgs):
+    """Agent args of experiments that are prepared but never run."""
+
+    agent_name: str = "FakeAgent"
+    chat_model_args: FakeChatModelArgs = field(default_factory=FakeChatModelArgs)
+
+    def make_agent(self):
+        raise NotImplementedError
+
+
+def make_exp_args(task_name="fake_task", task_seed=0, agent_args=None, **env_kwargs) -> ExpArgs:
+    return ExpArgs(
+        agent_args=FakeAgentArgs() if agent_args is None else agent_args,
+        env_args=EnvArgs(task_name=task_name, task_seed=task_seed, **env_kwargs),
+    )
@@ -1,13 +1,20 @@
 from ast import mod
 from dataclasses import dataclass
+import tempfile
+
+from browsergym.experiments.loop import EnvArgs, ExpArgs
+from conftest import FakeAgentArgs
+
 from agentlab.experiments.args import (
     expand_cross_product,
+    iter_cross_product,
     CrossProd,
     Choice,
     make_progression_study,
     sample_args,
     make_ablation_study,
 )
+from agentlab.experiments.launch_exp import _prepare_exp_args
 
 
 @dataclass
@@ -157,3 +164,39 @@ def test_make_ablation_study():
     params.sort()
 
     assert params == [("model1", 0.1), ("model1", 0.2), ("model2", 0.1)]
+
+
+def test_cross_product_shares_unchanged_objects():
+    exp_args = ExpArgsTest(
+        n_episode=CrossProd([1, 2, 3]),
+        llm_args=LLMArgsTest(model_name=CrossProd(["model1", "model2"])),
+        task_name={"name": "task1"},
+    )
+    expanded = list(iter_cross_product(exp_args))
+    assert len(expanded) == 6
+
+    # objects along the cross product paths are copied
+    assert len({id(args.llm_args) for args in expanded}) == 6
+    assert isinstance(exp_args.llm_args.model_name, CrossProd)
+    # the others are shared
+    assert all(args.task_name is exp_args.task_name for args in expanded)
+
+    samples = sample_args(ExpArgsTest(llm_args=LLMArgsTest(), n_episode=Choice([1, 2])), 4)
+    assert all(sample.llm_args is samples[0].llm_args for sample in samples)
+
+
+def test_prepared_experiments_dont_share_args():
+    exp_args_list = expand_cross_product(
+        ExpArgs(
+            agent_args=FakeAgentArgs(),
+            env_args=EnvArgs(task_name=CrossProd(["task1", "task2"]), task_seed=0),
+        )
+    )
+    assert exp_args_list[0].agent_args is exp_args_list[1].agent_args
+
+    with tempfile.TemporaryDirectory() as exp_dir:
+        _prepare_exp_args(exp_args_list, exp_dir)
+
+    # an agent modifying its args in place doesn't change the other experiment
+    exp_args_list[0].agent_args.chat_model_args.temperature = 1.0
+    assert exp_args_list[1].agent_args.chat_model_args.temperature == 0.1
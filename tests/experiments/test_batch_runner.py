@@ -0,0 +1,261 @@
+from dataclasses import dataclass
+import json
+import logging
+import tempfile
+import threading
+
+import pytest
+from browsergym.experiments.agent import Agent
+from browsergym.experiments.loop import AbstractAgentArgs, EnvArgs, ExpArgs
+
+from agentlab.experiments import batch_runner
+from agentlab.experiments.batch_runner import load_checkpoint, run_exp_batch
+from agentlab.experiments.circuit_breaker import CircuitBreaker
+from agentlab.experiments.progress import load_events
+
+SERVER_ERROR = "requests.exceptions.HTTPError: 502 Server Error: Bad Gateway for url"
+
+
+# messages sent to the chats of all the environments
+CHAT_MESSAGES = []
+
+
+class FakeChat:
+    def add_message(self, role, msg):
+        CHAT_MESSAGES.append((role, msg))
+
+
+class FakeEnv:
+    """Environment where the task is solved after `n_steps` actions."""
+
+    def __init__(self, n_steps):
+        self.n_steps = n_steps
+        self.step_count = 0
+        self.unwrapped = self
+        self.chat = FakeChat()
+
+    def reset(self, seed=None):
+        return {"step": 0}, {}
+
+    def step(self, action):
+        self.step_count += 1
+        done = self.step_count >= self.n_steps
+        info = {"action_exec_start": 0, "action_exec_stop": 0, "action_exec_timeout": 0}
+        return {"step": self.step_count}, float(done), done, False, info
+
+    def close(self):
+        pass
+
+
+class FakeActionSet:
+    def to_python_code(self, action):
+        return action
+
+
+N_EPISODES = 3
+# all agents must query their action at the same time to get past the barrier
+BARRIER = threading.Barrier(N_EPISODES, timeout=10)
+
+
+class BarrierAgent(Agent):
+    action_set = FakeActionSet()
+
+    def obs_preprocessor(self, obs):
+        return obs
+
+    def get_action(self, obs):
+        BARRIER.wait()
+        return "noop()", {}
+
+
+@dataclass
+class BarrierAgentArgs(AbstractAgentArgs):
+    agent_name: str = "BarrierAgent"
+
+    def make_agent(self):
+        return BarrierAgent()
+
+
+@dataclass
+class FakeEnvArgs(EnvArgs):
+    n_steps: int = 2
+
+    def make_env(self, action_mapping, exp_dir, exp_task_kwargs={}):
+        return FakeEnv(self.n_steps)
+
+
+def test_run_exp_batch_sends_llm_calls_concurrently():
+    exp_args_list = [
+        ExpArgs(
+            agent_args=BarrierAgentArgs(),
+            env_args=FakeEnvArgs(task_name=f"fake_task_{i}", task_seed=i, n_steps=2),
+        )
+        for i in range(N_EPISODES)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for exp_args in exp_args_list:
+            exp_args.prepare(tmp_dir)
+
+        run_exp_batch(exp_args_list)
+
+        for exp_args in exp_args_list:
+            summary_info = json.loads((exp_args.exp_dir / "summary_info.json").read_text())
+            assert summary_info["err_msg"] is None
+            assert summary_info["n_steps"] == 2
+            assert summary_info["cum_reward"] == 1.0
+
+        events = load_events(tmp_dir)
+        assert sum(event["event"] == "episode_end" for event in events) == N_EPISODES
+
+
+class LoggingAgent(Agent):
+    action_set = FakeActionSet()
+
+    def __init__(self, name):
+        self.name = name
+
+    def obs_preprocessor(self, obs):
+        return obs
+
+    def get_action(self, obs):
+        logging.getLogger(__name__).info(f"action of {self.name}")
+        BARRIER.wait()
+        return "noop()", {}
+
+
+@dataclass
+class LoggingAgentArgs(AbstractAgentArgs):
+    agent_name: str = "LoggingAgent"
+
+    def make_agent(self):
+        return LoggingAgent(self.agent_name)
+
+
+def test_each_episode_logs_to_its_own_file():
+    exp_args_list = [
+        ExpArgs(
+            agent_args=LoggingAgentArgs(agent_name=f"agent_{i}"),
+            env_args=FakeEnvArgs(task_name=f"fake_task_{i}", task_seed=i, n_steps=2),
+        )
+        for i in range(N_EPISODES)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for exp_args in exp_args_list:
+            exp_args.prepare(tmp_dir)
+
+        handlers = list(logging.getLogger().handlers)
+        run_exp_batch(exp_args_list)
+        assert logging.getLogger().handlers == handlers
+
+        for i, exp_args in enumerate(exp_args_list):
+            log = (exp_args.exp_dir / batch_runner.LOG_FILE).read_text()
+            assert log.count(f"action of agent_{i}") == 2
+            assert log.count("action of agent_") == 2
+            assert exp_args.exp_name in log
+
+
+class CrashingAgent(Agent):
+    """Agent that crashes on its third action, unless `crash` is unset."""
+
+    action_set = FakeActionSet()
+    crash = True
+    n_calls = 0
+
+    def __init__(self):
+        self.actions = []
+
+    def obs_preprocessor(self, obs):
+        return obs
+
+    def get_action(self, obs):
+        CrashingAgent.n_calls += 1
+        if CrashingAgent.crash and len(self.actions) == 2:
+            raise RuntimeError("worker died")
+        self.actions.append(f"noop() # {obs['step']}")
+        return self.actions[-1], {}
+
+
+@dataclass
+class CrashingAgentArgs(AbstractAgentArgs):
+    agent_name: str = "CrashingAgent"
+
+    def make_agent(self):
+        return CrashingAgent()
+
+
+def test_resume_replays_checkpointed_actions():
+    exp_args = ExpArgs(
+        agent_args=CrashingAgentArgs(),
+        env_args=FakeEnvArgs(task_name="fake_task", task_seed=0, n_steps=3),
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exp_args.prepare(tmp_dir)
+        run_exp_batch([exp_args])
+        previous_exp_dir = exp_args.exp_dir
+        assert len(load_checkpoint(previous_exp_dir)["actions"]) == 2
+
+        CrashingAgent.crash = False
+        CrashingAgent.n_calls = 0
+        CHAT_MESSAGES.clear()
+        exp_args.prepare(tmp_dir)  # moves the previous run to _<name>
+        previous_exp_dir = previous_exp_dir.with_name("_" + previous_exp_dir.name)
+        run_exp_batch([exp_args], resume_dirs=[previous_exp_dir])
+
+        assert CrashingAgent.n_calls == 1  # the first two actions are replayed
+        checkpoint = load_checkpoint(exp_args.exp_dir)
+        assert checkpoint["agent_state"]["actions"] == ["noop() # 0", "noop() # 1", "noop() # 2"]
+        summary_info = json.loads((exp_args.exp_dir / "summary_info.json").read_text())
+        assert summary_info["err_msg"] is None
+        assert summary_info["n_steps"] == 3
+        assert summary_info["cum_reward"] == 1.0
+
+        # the replayed actions are sent to the chat, as in the original run
+        chat_actions = [msg.split("action:\n")[1].strip() for _, msg in CHAT_MESSAGES]
+        assert chat_actions == ["noop() # 0", "noop() # 1", "noop() # 2"]
+
+
+def test_errors_are_raised_in_debug_mode(monkeypatch):
+    monkeypatch.setattr(batch_runner, "_is_debugging", lambda: True)
+    CrashingAgent.crash = True
+    exp_args = ExpArgs(
+        agent_args=CrashingAgentArgs(),
+        env_args=FakeEnvArgs(task_name="fake_task", task_seed=0, n_steps=3),
+        enable_debug=True,
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exp_args.prepare(tmp_dir)
+        with pytest.raises(RuntimeError, match="worker died"):
+            run_exp_batch([exp_args])
+        # the episode is still closed
+        summary_info = json.loads((exp_args.exp_dir / "summary_info.json").read_text())
+        assert "worker died" in summary_info["err_msg"]
+
+
+def test_probe_episode_runs_alone():
+    CrashingAgent.crash = False
+    exp_args_list = [
+        ExpArgs(
+            agent_args=CrashingAgentArgs(),
+            env_args=FakeEnvArgs(task_name=f"fake_task_{i}", task_seed=i, n_steps=2),
+        )
+        for i in range(3)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for exp_args in exp_args_list:
+            exp_args.prepare(tmp_dir)
+        breaker = CircuitBreaker.create(tmp_dir, min_episodes=1, initial_backoff=0)
+        breaker.record("HTTPError", SERVER_ERROR)
+        assert breaker.status() == "open"
+
+        run_exp_batch(exp_args_list)
+
+        # the other episodes start once the probe succeeded
+        events = [event["event"] for event in load_events(tmp_dir) if event["event"] != "step"]
+        assert events[:3] == ["episode_start", "episode_end", "episode_start"]
+        assert events.count("episode_end") == 3
+        assert breaker.status() == "closed"
@@ -0,0 +1,67 @@
+from agentlab.experiments.browser_pool import BrowserPool
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.closed = False
+
+    def new_context(self, **kwargs):
+        return FakeContext()
+
+    def is_connected(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBrowserType:
+    name = "chromium"
+
+    def __init__(self):
+        self.browsers = []
+
+    def launch(self, **kwargs):
+        self.browsers.append(FakeBrowser())
+        return self.browsers[-1]
+
+
+def test_browser_pool_reuses_and_recycles_browsers():
+    browser_type = FakeBrowserType()
+    pool = BrowserPool(max_episodes_per_browser=2)
+
+    browser = pool.launch(browser_type, headless=True)
+    context = browser.new_context()
+    browser.close()
+    assert context.closed
+    assert not browser_type.browsers[0].closed  # only the context is closed
+
+    pool.launch(browser_type, headless=True).close()
+    assert len(browser_type.browsers) == 1
+
+    # different launch arguments get their own browser
+    pool.launch(browser_type, headless=False).close()
+    assert len(browser_type.browsers) == 2
+
+    # recycled after 2 episodes, but not while an episode still uses it
+    first = pool.launch(browser_type, headless=True)
+    assert len(browser_type.browsers) == 3
+    second = pool.launch(browser_type, headless=True)
+    third = pool.launch(browser_type, headless=True)
+    assert len(browser_type.browsers) == 3
+    for browser in (first, second, third):
+        browser.close()
+    pool.launch(browser_type, headless=True)
+    assert len(browser_type.browsers) == 4
+    assert browser_type.browsers[2].closed
+
+    pool.close()
+    assert all(browser.closed for browser in browser_type.browsers)
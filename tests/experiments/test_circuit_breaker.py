@@ -0,0 +1,47 @@
+import tempfile
+import time
+
+from agentlab.experiments.circuit_breaker import CircuitBreaker
+
+SERVER_ERROR = "requests.exceptions.HTTPError: 502 Server Error: Bad Gateway for url"
+
+
+def test_circuit_opens_on_server_errors_and_closes_after_probe():
+    with tempfile.TemporaryDirectory() as study_dir:
+        assert CircuitBreaker.load(study_dir) is None
+        CircuitBreaker.create(study_dir, window=4, min_episodes=4, initial_backoff=0.2)
+        breaker = CircuitBreaker.load(study_dir)
+
+        # other errors don't open the circuit
+        for _ in range(4):
+            breaker.record("ValueError", "ValueError: invalid action")
+        assert breaker.status() == "closed"
+
+        for _ in range(2):
+            breaker.record("HTTPError", SERVER_ERROR)
+        assert breaker.status() == "open"
+
+        # the first worker waits for the backoff and runs the probe
+        t0 = time.time()
+        assert breaker.wait_until_closed(probe_id="probe_1", poll_interval=0.05)
+        assert time.time() - t0 >= 0.15
+        assert breaker.status() == "half_open"
+
+        # episodes started before the outage don't decide for the probe
+        breaker.record(None, None, exp_id="old_episode")
+        breaker.record("HTTPError", SERVER_ERROR, exp_id="other_old_episode")
+        assert breaker.status() == "half_open"
+
+        # the probe fails, the backoff doubles
+        breaker.record("HTTPError", SERVER_ERROR, exp_id="probe_1")
+        assert breaker.status() == "open"
+        t0 = time.time()
+        assert breaker.wait_until_closed(probe_id="probe_2", poll_interval=0.05)
+        assert time.time() - t0 >= 0.35
+
+        # the probe succeeds, episodes resume
+        breaker.record(None, None, exp_id="probe_2")
+        assert breaker.status() == "closed"
+        t0 = time.time()
+        assert not breaker.wait_until_closed(probe_id="probe_3", poll_interval=0.05)
+        assert time.time() - t0 < 0.1
@@ -0,0 +1,44 @@
+import json
+import tempfile
+
+import pytest
+from conftest import FakeAgentArgs, FakeChatModelArgs
+from conftest import make_exp_args as _make_exp_args
+
+from agentlab.experiments.cost_estimation import estimate_launch, load_step_stats
+
+
+def make_exp_args(task_name, model_name="fake_model"):
+    agent_args = FakeAgentArgs(chat_model_args=FakeChatModelArgs(model_name))
+    return _make_exp_args(task_name, agent_args=agent_args, max_steps=20)
+
+
+def test_estimate_from_previous_study():
+    with tempfile.TemporaryDirectory() as study_dir:
+        for task_name in ["miniwob.a", "miniwob.b"]:
+            exp_args = make_exp_args(task_name)
+            exp_args.prepare(study_dir)
+            summary_info = {
+                "stats.cum_steps": 5,
+                "stats.cum_openai_total_tokens": 1000,
+                "stats.cum_openai_total_cost": 0.5,
+                "stats.cum_step_elapsed": 40,
+                "stats.cum_agent_elapsed": 10,
+            }
+            (exp_args.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+        history = load_step_stats(study_dir)
+
+    exp_args_list = [
+        make_exp_args("miniwob.a"),  # same task
+        make_exp_args("miniwob.c"),  # same benchmark
+        make_exp_args("miniwob.a", model_name="other_model"),  # no history
+    ]
+    estimate = estimate_launch(exp_args_list, n_jobs=2, history=history)
+
+    assert estimate.n_experiments == 3
+    assert estimate.n_with_history == 2
+    assert estimate.tokens == pytest.approx(2000)
+    assert estimate.cost == pytest.approx(1.0)
+    # 50s episodes and a 100s default for the unknown one (5s per step, 20 steps)
+    assert estimate.wall_time == pytest.approx(150)
+    assert "Estimated cost: $1.00" in str(estimate)
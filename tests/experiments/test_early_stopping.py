@@ -0,0 +1,58 @@
+from dataclasses import dataclass
+import json
+import tempfile
+
+from conftest import FakeAgentArgs, make_exp_args
+
+from agentlab.experiments.early_stopping import make_rounds, run_with_early_stopping
+
+
+@dataclass
+class RatedAgentArgs(FakeAgentArgs):
+    success_rate: float = 0.5
+
+
+def make_exp_args_list(success_rates, n_tasks=10, n_seeds=6):
+    return [
+        make_exp_args(
+            f"fake_task_{task}",
+            task_seed=seed,
+            agent_args=RatedAgentArgs(agent_name=f"agent_{rate}", success_rate=rate),
+        )
+        for rate in success_rates
+        for task in range(n_tasks)
+        for seed in range(n_seeds)
+    ]
+
+
+def test_make_rounds():
+    rounds = make_rounds(make_exp_args_list([0.2, 0.8], n_tasks=3, n_seeds=4))
+    assert len(rounds) == 4
+    for i, round_exp_args in enumerate(rounds):
+        assert len(round_exp_args) == 6
+        assert {exp_args.env_args.task_seed for exp_args in round_exp_args} == {i}
+
+
+def test_dominated_configs_are_stopped():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        def run_fn(exp_args_list):
+            for exp_args in exp_args_list:
+                exp_args.prepare(tmp_dir)
+                # deterministic rewards with the success rate of the agent
+                seed = exp_args.env_args.task_seed
+                reward = float((seed + 0.5) / 6 < exp_args.agent_args.success_rate)
+                summary_info = {"cum_reward": reward}
+                (exp_args.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+
+        exp_args_list = make_exp_args_list([0.1, 0.5, 0.9])
+        done = run_with_early_stopping(exp_args_list, run_fn, min_rounds=2, n_bootstrap=200)
+
+        n_done = {
+            name: sum(exp_args.agent_args.agent_name == name for exp_args in done)
+            for name in ["agent_0.1", "agent_0.5", "agent_0.9"]
+        }
+        # the best configuration runs all its seeds, the worst is stopped early
+        assert n_done["agent_0.9"] == 60
+        assert n_done["agent_0.1"] < 60
+        assert len(done) < len(exp_args_list)
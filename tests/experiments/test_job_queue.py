@@ -0,0 +1,95 @@
+import multiprocessing
+import os
+from pathlib import Path
+import tempfile
+import time
+
+from conftest import make_exp_args
+
+from agentlab.experiments.job_queue import JobQueue, run_worker
+
+
+def make_exp_args_list(exp_root, n):
+    exp_args_list = [make_exp_args(f"fake_task_{i}", task_seed=i) for i in range(n)]
+    for exp_args in exp_args_list:
+        exp_args.prepare(exp_root)
+    return exp_args_list
+
+
+def test_expired_leases_are_requeued():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        queue = JobQueue(f"{tmp_dir}/queue.db", lease_duration=0.2, max_attempts=2)
+        (exp_args,) = make_exp_args_list(tmp_dir, 1)
+        queue.enqueue([exp_args])
+
+        leased, resume_dir, attempt = queue.lease("worker_a")
+        assert leased.exp_id == exp_args.exp_id and attempt == 1
+        assert queue.lease("worker_b") == (None, None, None)
+        assert queue.heartbeat(exp_args.exp_id, "worker_a")
+
+        # worker_a dies, its lease expires and the job is given to worker_b
+        time.sleep(0.3)
+        leased, resume_dir, attempt = queue.lease("worker_b")
+        assert attempt == 2
+        assert not queue.heartbeat(exp_args.exp_id, "worker_a")
+        assert not queue.complete(exp_args.exp_id, "worker_a")
+
+        # worker_b dies too, no attempt left
+        time.sleep(0.3)
+        assert queue.lease("worker_c") == (None, None, None)
+        assert queue.counts() == {"failed": 1}
+
+
+def test_retries_resume_from_the_previous_attempt():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # directory names have a resolution of one second
+        queue = JobQueue(f"{tmp_dir}/queue.db", lease_duration=1, max_attempts=3)
+        (exp_args,) = make_exp_args_list(tmp_dir, 1)
+        queue.enqueue([exp_args])
+
+        exp_dirs = []
+        for attempt in range(1, 4):
+            leased, resume_dir, n_attempts = queue.lease(f"worker_{attempt}")
+            assert n_attempts == attempt
+            assert leased.exp_id == exp_args.exp_id
+            if attempt > 1:
+                # resumes from the previous attempt, not from the first one
+                assert Path(resume_dir) == exp_dirs[-1].with_name("_" + exp_dirs[-1].name)
+                assert (Path(resume_dir) / "attempt.txt").read_text() == str(attempt - 1)
+            exp_dirs.append(Path(leased.exp_dir))
+            (leased.exp_dir / "attempt.txt").write_text(str(attempt))
+            # the worker dies
+            time.sleep(1.1)
+
+        # previous attempts are hidden, only the last one is a visible experiment
+        visible = [
+            path for path in Path(tmp_dir).iterdir() if path.is_dir() and path.name[0] != "_"
+        ]
+        assert visible == [exp_dirs[-1]]
+        assert queue.counts() == {"failed": 1}
+
+
+def _record_run(exp_args, resume_dir, max_episodes_per_browser, resource_limiter):
+    (exp_args.exp_dir / "worker_pid.txt").write_text(str(os.getpid()))
+
+
+def test_local_workers_run_all_jobs():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        queue_path = f"{tmp_dir}/queue.db"
+        exp_args_list = make_exp_args_list(tmp_dir, 6)
+        JobQueue(queue_path).enqueue(exp_args_list)
+
+        context = multiprocessing.get_context("fork")
+        workers = [
+            context.Process(target=run_worker, args=(queue_path,), kwargs={"run_fn": _record_run})
+            for _ in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=60)
+            assert worker.exitcode == 0
+
+        assert JobQueue(queue_path).counts() == {"done": 6}
+        for exp_args in exp_args_list:
+            assert (exp_args.exp_dir / "worker_pid.txt").exists()
@@ -0,0 +1,25 @@
+from agentlab.experiments.progress import format_progress, summarize_progress
+
+
+def test_summarize_progress():
+    events = [
+        {"event": "study_start", "time": 0, "n_episodes": 10},
+        {"event": "episode_start", "time": 0, "exp_id": "a"},
+        {"event": "episode_start", "time": 0, "exp_id": "b"},
+        {"event": "episode_start", "time": 0, "exp_id": "c"},
+        {"event": "step", "time": 30, "exp_id": "a", "tokens": 1000, "cost": 0.5},
+        {"event": "step", "time": 30, "exp_id": "b", "tokens": 1000, "cost": 0.5},
+        {"event": "episode_end", "time": 60, "exp_id": "a", "reward": 1, "err_class": None},
+        {"event": "episode_end", "time": 120, "exp_id": "b", "reward": 0, "err_class": "retry_error"},
+    ]
+
+    summary = summarize_progress(events, now=120)
+
+    assert summary["n_done"] == 2 and summary["n_running"] == 1
+    assert summary["episodes_per_min"] == 1.0
+    assert summary["eta_seconds"] == 8 * 60
+    assert summary["success_rate"] == 0.5
+    assert summary["errors_per_class"] == {"retry_error": 1}
+    assert summary["cost"] == 1.0
+    assert summary["cost_per_hour"] == 30.0
+    assert "2/10 done" in format_progress(summary)
@@ -0,0 +1,71 @@
+import tempfile
+import threading
+
+import pytest
+from conftest import FakeAgentArgs, FakeChatModelArgs
+from conftest import make_exp_args as _make_exp_args
+
+from agentlab.experiments.resource_limits import ResourceLimiter, get_resources, split_batches
+
+
+def make_exp_args(task_name, model_name="model_a"):
+    agent_args = FakeAgentArgs(chat_model_args=FakeChatModelArgs(model_name))
+    return _make_exp_args(task_name, agent_args=agent_args)
+
+
+LIMITS = {"workarena": 1, "model_a": 2}
+
+
+def test_get_resources():
+    exp_args = make_exp_args("workarena.servicenow.task")
+    assert get_resources(exp_args, LIMITS) == ["workarena", "model_a"]
+    assert get_resources(make_exp_args("miniwob.click-test", "model_b"), LIMITS) == []
+
+
+def test_split_batches_respects_limits():
+    exp_args_list = [
+        make_exp_args("workarena.a", "model_b"),
+        make_exp_args("workarena.b", "model_b"),
+        make_exp_args("miniwob.a", "model_b"),
+        make_exp_args("miniwob.b", "model_b"),
+        make_exp_args("miniwob.c", "model_b"),
+    ]
+    batches = split_batches(exp_args_list, 3, LIMITS)
+    task_names = [[exp_args.env_args.task_name for exp_args in batch] for batch in batches]
+    assert task_names == [["workarena.a", "miniwob.a", "miniwob.b"], ["workarena.b", "miniwob.c"]]
+
+    # every batch can be acquired
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        limiter = ResourceLimiter(tmp_dir, LIMITS, poll_interval=0.01)
+        for batch in split_batches([make_exp_args("workarena.a")] * 4, 4, LIMITS):
+            with limiter.acquire(batch):
+                pass
+
+    assert len(split_batches(exp_args_list, 2)) == 3
+
+
+def test_limiter_blocks_until_a_slot_is_free():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        limiter = ResourceLimiter(tmp_dir, LIMITS, poll_interval=0.01)
+        events = []
+
+        def run_second():
+            with limiter.acquire([make_exp_args("workarena.servicenow.task_2")]):
+                events.append("second started")
+
+        with limiter.acquire([make_exp_args("workarena.servicenow.task_1")]):
+            # another resource, not blocked
+            with limiter.acquire([make_exp_args("miniwob.click-test")]):
+                pass
+            thread = threading.Thread(target=run_second)
+            thread.start()
+            thread.join(timeout=0.2)
+            assert thread.is_alive()  # waiting for the workarena slot
+            events.append("first done")
+        thread.join(timeout=5)
+
+        assert events == ["first done", "second started"]
+
+        with pytest.raises(ValueError):
+            with limiter.acquire([make_exp_args("workarena.a"), make_exp_args("workarena.b")]):
+                pass
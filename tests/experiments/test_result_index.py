@@ -0,0 +1,55 @@
+import json
+from pathlib import Path
+import tempfile
+
+from conftest import FakeAgentArgs, FakeChatModelArgs
+from conftest import make_exp_args as _make_exp_args
+
+from agentlab.experiments.launch_exp import _validate_launch_mode
+from agentlab.experiments.result_index import ResultIndex, exp_hash
+from agentlab.experiments.study_manifest import StudyManifest
+
+
+def make_exp_args(task_seed=0, **chat_model_kwargs):
+    agent_args = FakeAgentArgs(chat_model_args=FakeChatModelArgs(**chat_model_kwargs))
+    return _make_exp_args(task_seed=task_seed, agent_args=agent_args)
+
+
+def test_exp_hash():
+    assert exp_hash(make_exp_args()) == exp_hash(make_exp_args(model_url="http://localhost"))
+    assert exp_hash(make_exp_args()) != exp_hash(make_exp_args(temperature=0.2))
+    assert exp_hash(make_exp_args()) != exp_hash(make_exp_args(task_seed=1))
+    assert exp_hash(make_exp_args(task_seed=None)) is None
+
+
+def test_completed_experiments_are_reused(monkeypatch):
+    with tempfile.TemporaryDirectory() as exp_root:
+        # a previous study with one success and one error
+        previous = [make_exp_args(task_seed=0), make_exp_args(task_seed=1)]
+        for exp_args, err_msg in zip(previous, [None, "Timeout"]):
+            exp_args.prepare(f"{exp_root}/previous_study")
+            summary_info = {"cum_reward": 1, "err_msg": err_msg}
+            (exp_args.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+            ResultIndex(exp_root).add(exp_args, summary_info)
+
+        # nothing is linked if the launch is aborted
+        monkeypatch.setattr("builtins.input", lambda message: "n")
+        exp_args_list = [make_exp_args(task_seed=seed) for seed in range(3)]
+        assert _validate_launch_mode(exp_root, "new_study", exp_args_list, None, False, {}) is None
+        assert not list(Path(exp_root).glob("*new_study"))
+
+        exp_args_list = [make_exp_args(task_seed=seed) for seed in range(3)]
+        answers = []
+        monkeypatch.setattr("builtins.input", lambda message: answers.append(message) or "y")
+        remaining, exp_dir = _validate_launch_mode(
+            exp_root, "new_study", exp_args_list, None, False, {}
+        )
+
+        # the confirmation only counts the experiments that will run
+        assert "launch 2 experiments" in answers[0]
+        assert "1 other experiments already completed" in answers[0]
+        assert [exp_args.env_args.task_seed for exp_args in remaining] == [1, 2]
+        ((linked_dir, status, _, _),) = StudyManifest(exp_dir).status()
+        assert status == "done"
+        assert linked_dir.is_symlink()
+        assert linked_dir.resolve() == previous[0].exp_dir.resolve()
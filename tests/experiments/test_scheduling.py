@@ -0,0 +1,39 @@
+import json
+import tempfile
+
+from conftest import make_exp_args
+
+from agentlab.experiments.scheduling import load_episode_durations, sort_longest_first
+
+
+def test_load_episode_durations():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for task_name, step_elapsed in [("miniwob.a", 10), ("miniwob.a", 30), ("miniwob.b", 5)]:
+            exp_args = make_exp_args(task_name)
+            exp_args.prepare(tmp_dir)
+            summary_info = {"stats.cum_step_elapsed": step_elapsed, "stats.cum_agent_elapsed": 1}
+            (exp_args.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+        # not run yet
+        make_exp_args("miniwob.c").prepare(tmp_dir)
+
+        assert load_episode_durations(tmp_dir) == {"miniwob.a": 21.0, "miniwob.b": 6.0}
+
+
+def test_sort_longest_first():
+    exp_args_list = [
+        make_exp_args("miniwob.short", max_steps=10),
+        make_exp_args("workarena.servicenow.l1_task", max_steps=15),
+        make_exp_args("workarena.servicenow.l3_task", max_steps=30),
+        make_exp_args("miniwob.slow", max_steps=10),
+    ]
+    durations = {"miniwob.slow": 1000}
+
+    sorted_list = sort_longest_first(exp_args_list, durations)
+
+    task_names = [exp_args.env_args.task_name for exp_args in sorted_list]
+    assert task_names == [
+        "miniwob.slow",
+        "workarena.servicenow.l3_task",
+        "workarena.servicenow.l1_task",
+        "miniwob.short",
+    ]
@@ -0,0 +1,38 @@
+import json
+import tempfile
+import time
+
+from agentlab.experiments import session_pool
+from agentlab.experiments.session_pool import SessionArgs, get_storage_state
+
+
+def test_storage_state_is_reused_until_expiry(monkeypatch):
+    logins = []
+
+    def fake_login(session_args, path):
+        # the browser is not needed to test the pooling
+        logins.append(session_args.name)
+        state = {"cookies": [{"name": "session", "expires": time.time() + 3600}], "origins": []}
+        with open(path, "w") as f:
+            json.dump(state, f)
+
+    monkeypatch.setattr(session_pool, "login", fake_login)
+    session_args = SessionArgs(name="fake/site", login_url="https://example.com/login")
+
+    with tempfile.TemporaryDirectory() as session_dir:
+        path = get_storage_state(session_args, session_dir)
+        assert get_storage_state(session_args, session_dir) == path
+        assert logins == ["fake/site"]
+
+        # an expired cookie triggers a new login
+        state = json.loads(path.read_text())
+        state["cookies"][0]["expires"] = time.time() - 1
+        path.write_text(json.dumps(state))
+        get_storage_state(session_args, session_dir)
+        get_storage_state(session_args, session_dir)
+        assert len(logins) == 2
+
+        # so does an old session
+        old_session = SessionArgs(name="fake/site", login_url="https://example.com", max_age=0)
+        get_storage_state(old_session, session_dir)
+        assert len(logins) == 3
@@ -0,0 +1,94 @@
+import json
+import tempfile
+import time
+
+from conftest import make_exp_args
+
+from agentlab.analyze.inspect_results import load_result_df
+from agentlab.experiments.job_queue import JobQueue
+from agentlab.experiments.launch_exp import _prepare_exp_args, _yield_incomplete_experiments
+from agentlab.experiments.study_manifest import MANIFEST_FILE, StudyManifest, rebuild_manifest
+
+
+def make_study(study_dir):
+    exp_args_list = [make_exp_args(f"fake_task_{i}", task_seed=i) for i in range(3)]
+    for exp_args in exp_args_list:
+        exp_args.prepare(study_dir)
+    manifest = StudyManifest(study_dir)
+    manifest.add_prepared(exp_args_list)
+
+    summaries = [
+        {"cum_reward": 1, "err_msg": None, "stack_trace": None},
+        {"cum_reward": 0, "err_msg": "Timeout", "stack_trace": "TimeoutError: ..."},
+    ]
+    for exp_args, summary_info in zip(exp_args_list, summaries):
+        (exp_args.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+        manifest.set_finished(exp_args, summary_info)
+    return exp_args_list
+
+
+def test_manifest_tracks_experiments():
+    with tempfile.TemporaryDirectory() as study_dir:
+        exp_args_list = make_study(study_dir)
+        manifest = StudyManifest(study_dir)
+
+        status = {exp_dir: row for exp_dir, *row in manifest.status()}
+        assert status[exp_args_list[0].exp_dir] == ["done", None, None]
+        assert status[exp_args_list[1].exp_dir][:2] == ["done", "Timeout"]
+        assert status[exp_args_list[2].exp_dir] == ["prepared", None, None]
+
+        incomplete = list(_yield_incomplete_experiments(study_dir, "incomplete_only"))
+        assert [exp_args.exp_id for exp_args in incomplete] == [exp_args_list[2].exp_id]
+        errors = list(_yield_incomplete_experiments(study_dir, "all_errors"))
+        assert len(errors) == 2
+
+        df = load_result_df(study_dir, progress_fn=None, set_index=False)
+        assert len(df) == 3
+        assert df["cum_reward"].sum() == 1
+
+        # rebuilding from the directories gives the same records
+        (manifest.db_path).unlink()
+        rebuilt = rebuild_manifest(study_dir)
+        key = lambda record: record["exp_id"]
+        assert sorted(rebuilt.records(), key=key) == sorted(manifest.records(), key=key)
+
+
+def test_load_result_df_without_manifest():
+    with tempfile.TemporaryDirectory() as study_dir:
+        make_study(study_dir)
+        with_manifest = load_result_df(study_dir, progress_fn=None, set_index=False)
+        (StudyManifest(study_dir).study_dir / MANIFEST_FILE).unlink()
+        without_manifest = load_result_df(study_dir, progress_fn=None, set_index=False)
+        assert set(with_manifest["exp_dir"]) == set(without_manifest["exp_dir"])
+        assert (
+            with_manifest.sort_values("env_args.task_seed")["cum_reward"].fillna(-1).tolist()
+            == without_manifest.sort_values("env_args.task_seed")["cum_reward"]
+            .fillna(-1)
+            .tolist()
+        )
+
+
+def test_manifest_follows_retried_jobs():
+    with tempfile.TemporaryDirectory() as study_dir:
+        exp_args = make_exp_args()
+        _prepare_exp_args([exp_args], study_dir)
+        queue = JobQueue(f"{study_dir}/job_queue.db", lease_duration=0.2)
+        queue.enqueue([exp_args])
+
+        queue.lease("worker_a")
+        time.sleep(0.3)  # worker_a dies
+        retried, _, attempt = queue.lease("worker_b")
+        assert attempt == 2
+
+        # relaunching finds the directory of the last attempt
+        (incomplete,) = _yield_incomplete_experiments(study_dir, "incomplete_only")
+        assert incomplete.exp_dir == retried.exp_dir
+        (record,) = load_result_df(study_dir, progress_fn=None, set_index=False).to_dict("records")
+        assert record["exp_dir"] == retried.exp_dir
+
+        summary_info = {"cum_reward": 1, "err_msg": None, "stack_trace": None}
+        (retried.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+        StudyManifest(study_dir).set_finished(retried, summary_info)
+        assert list(_yield_incomplete_experiments(study_dir, "all_errors")) == []
+        ((exp_dir, status, _, _),) = StudyManifest(study_dir).status()
+        assert (exp_dir, status) == (retried.exp_dir, "done")
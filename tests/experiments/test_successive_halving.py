@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+import json
+import tempfile
+
+from browsergym.experiments.loop import EnvArgs
+from conftest import FakeAgentArgs
+
+from agentlab.experiments.args import Choice
+from agentlab.experiments.successive_halving import _n_rounds, successive_halving
+
+
+@dataclass
+class SkilledAgentArgs(FakeAgentArgs):
+    skill: int = 0
+
+
+def test_successive_halving_keeps_the_best_configuration():
+    env_args_list = [EnvArgs(task_name=f"fake_task_{i}", task_seed=0) for i in range(27)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        runs = []
+
+        def run_fn(exp_args_list):
+            runs.append(exp_args_list)
+            for exp_args in exp_args_list:
+                exp_args.prepare(tmp_dir)
+                # tasks with a larger index are harder
+                task_index = int(exp_args.env_args.task_name.split("_")[-1])
+                reward = float(exp_args.agent_args.skill * 3 > task_index)
+                summary_info = {"cum_reward": reward}
+                (exp_args.exp_dir / "summary_info.json").write_text(json.dumps(summary_info))
+
+        ranking = successive_halving(
+            SkilledAgentArgs(skill=Choice(list(range(10)))),
+            env_args_list,
+            n_configs=30,
+            run_fn=run_fn,
+            seed=0,
+        )
+
+    skills = {agent_args.skill for agent_args, _, _ in ranking}
+    best_args, best_score, n_tasks = ranking[0]
+    assert best_args.skill == max(skills)
+    assert n_tasks == 27
+
+    # results are reused: every experiment is run once
+    exp_keys = [
+        (exp_args.agent_args.skill, exp_args.env_args.task_name) for run in runs for exp_args in run
+    ]
+    assert len(exp_keys) == len(set(exp_keys))
+    assert len(exp_keys) < len(skills) * len(env_args_list)
+
+
+def test_n_rounds():
+    assert [_n_rounds(n, 3) for n in [1, 2, 3, 8, 9, 26, 27]] == [1, 1, 2, 2, 3, 3, 4]
+    assert _n_rounds(243, 3) == 6
+    assert _n_rounds(1000, 10) == 4
@@ -1,3 +1,4 @@
+from agentlab.experiments import task_collections
 from agentlab.experiments.task_collections import get_benchmark_env_args
 import pytest
 
@@ -17,6 +18,35 @@ def test_get_benchmark_env_args(benchmark_name, expected_length):
     assert len(result) == expected_length
 
 
+def test_task_manifest_is_cached_per_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_collections, "TASK_MANIFEST_DIR", tmp_path)
+    n_builds = []
+
+    def build():
+        n_builds.append(1)
+        return ["task_a", "task_b"]
+
+    for _ in range(2):
+        assert task_collections._cached_task_info("fake-package", "ids", build) == [
+            "task_a",
+            "task_b",
+        ]
+    assert len(n_builds) == 1
+
+    # a new version of the package invalidates the manifest
+    monkeypatch.setattr(task_collections.metadata, "version", lambda package: "99.0")
+    task_collections._cached_task_info("fake-package", "ids", build)
+    assert len(n_builds) == 2
+
+
+def test_workarena_env_args_from_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(task_collections, "TASK_MANIFEST_DIR", tmp_path)
+    built = get_benchmark_env_args("workarena.l2")
+    cached = get_benchmark_env_args("workarena.l2")
+    assert len(list(tmp_path.glob("browsergym-workarena-*.json"))) == 1
+    assert [(e.task_name, e.task_seed) for e in built] == [(e.task_name, e.task_seed) for e in cached]
+
+
 if __name__ == "__main__":
     test_get_benchmark_env_args("workarena.l1", 5)
     test_get_benchmark_env_args("workarena.l2", 5)
@@ -274,6 +274,19 @@ console.log("Hello, world!");
     assert llm_utils.extract_code_blocks(text) == expected_output
 
 
+def test_close_unclosed_html_tags():
+    text = "<think>\nI should click.\n<action>\nclick('a1')"
+    repaired = llm_utils.close_unclosed_html_tags(text, keys=["think", "action"])
+
+    parsed = llm_utils.parse_html_tags_raise(repaired, keys=["think", "action"])
+    assert parsed == {"think": "I should click.", "action": "click('a1')"}
+
+
+def test_keep_last_html_tag():
+    text = "<action>click('a1')</action> oops <action>click('a2')</action>"
+    assert llm_utils.keep_last_html_tag(text, "action") == " oops <action>click('a2')</action>"
+
+
 if __name__ == "__main__":
     # test_retry_parallel()
     # test_rate_limit_max_wait_time()